@@ -1,4 +1,5 @@
 import argparse
+import copy
 import logging
 import pathlib
 from collections import deque, defaultdict
@@ -9,10 +10,13 @@ import numpy as np
 from sklearn.metrics import confusion_matrix
 from tqdm import tqdm
 
-from active_learning_topk import mean_reciprocal_rank
 from data_utils import CIFAR100_SUPERCLASS_LOOKUP, DATAFILE_LIST, COST_MATRIX_FILE_DICT
 from data_utils import RESULTS_DIR
+from checkpoints import add_checkpoint_arguments, CheckpointSchedule, EndOfRun, FixedSchedule, \
+    get_checkpoint_schedule
 from models import DirichletMultinomialCost, Model
+from data_utils import get_budget
+from utils import PRECISION, PRECISION_DICT, batch_mean_reciprocal_rank, topk_agreement
 
 OUTPUT_DIR = RESULTS_DIR + 'costs/cifar100'
 
@@ -180,7 +184,11 @@ def max_choice_fn(sample: np.ndarray) -> np.ndarray:
 def select_and_label(dataset: Dataset,
                      model: Model,
                      topk: int,
-                     choice_fn: Callable) -> Tuple[np.ndarray, np.ndarray]:
+                     choice_fn: Callable,
+                     dtype=np.float64,
+                     batch_size: int = 1,
+                     schedule: CheckpointSchedule = None,
+                     budget: int = None) -> Tuple[np.ndarray, np.ndarray]:
     """
     Selects data points from dataset according to criterion and updates the model.
 
@@ -192,17 +200,35 @@ def select_and_label(dataset: Dataset,
         Bayesian assessment model.
     choice_fn : Callable
         Function used to identify the next class to be labeled.
+    dtype : np.dtype
+        Floating point precision of the logged estimates. Default: np.float64.
+    batch_size : int
+        Number of data points selected per round. With batch_size > 1 a round draws ceil(batch_size / topk) posterior
+        samples at once, all from the posterior at the start of the round, and the model only sees the labels of the
+        round when it ends. Default: 1.
+    schedule : CheckpointSchedule
+        Sample indices after which the estimates are logged. Labeling stops after the last checkpoint.
+        Default: None, i.e. every LOG_FREQ samples.
+    budget : int
+        Length of the runs the schedule is applied to. Labeling stops after the last checkpoint, so schedules of
+        budgeted runs are wrapped in EndOfRun. Default: None, i.e. all data points.
     """
+    if batch_size > 1:
+        return select_and_label_batch(dataset, model, topk, choice_fn, dtype, batch_size, schedule, budget)
+
     # Initialize outputs
+    if schedule is None:
+        schedule = FixedSchedule(LOG_FREQ, start=LOG_FREQ - 1)
 
     # Shuffle the dataset and enqueue queries
     dataset.shuffle()
     queues = dataset.enqueue()
 
-    n_samples = len(dataset)
+    slots = schedule.slots(len(dataset) if budget is None else budget)
+    n_samples = max(slots, default=-1) + 1
 
-    mpe = np.zeros((n_samples // LOG_FREQ, dataset.num_classes))
-    confusion_log = np.zeros((n_samples // LOG_FREQ, dataset.num_classes, dataset.num_classes))
+    mpe = np.zeros((len(slots), dataset.num_classes), dtype=dtype)
+    confusion_log = np.zeros((len(slots), dataset.num_classes, dataset.num_classes), dtype=dtype)
 
     # Run experiment
     i = 0
@@ -220,13 +246,70 @@ def select_and_label(dataset: Dataset,
             model.update(choice, observation)
 
             i += 1
-            if not i % LOG_FREQ:
-                index = i // LOG_FREQ - 1
-                mpe[index] = model.mpe()
-                confusion_log[index] = model.confusion_matrix()
+            if i - 1 in slots:
+                mpe[slots[i - 1]] = model.mpe()
+                confusion_log[slots[i - 1]] = model.confusion_matrix()
+            if i == n_samples:
+                break
+
+    # In case we're one short
+    if len(slots):
+        mpe[-1] = model.mpe()
+
+    return mpe, confusion_log
+
+
+def select_and_label_batch(dataset: Dataset,
+                           model: Model,
+                           topk: int,
+                           choice_fn: Callable,
+                           dtype=np.float64,
+                           batch_size: int = 1,
+                           schedule: CheckpointSchedule = None,
+                           budget: int = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Batch mode of select_and_label. Logged estimates reflect the labels the model has received, so checkpoints within
+    a round see the posterior from the start of the round.
+    """
+    if schedule is None:
+        schedule = FixedSchedule(LOG_FREQ, start=LOG_FREQ - 1)
+
+    dataset.shuffle()
+    queues = dataset.enqueue()
+
+    slots = schedule.slots(len(dataset) if budget is None else budget)
+    n_samples = max(slots, default=-1) + 1
+
+    mpe = np.zeros((len(slots), dataset.num_classes), dtype=dtype)
+    confusion_log = np.zeros((len(slots), dataset.num_classes, dataset.num_classes), dtype=dtype)
+
+    remaining = np.array([len(queue) for queue in queues])
+    i = 0
+    while i < n_samples:
+        # select the whole round against the current posterior
+        round_size = min(batch_size, n_samples - i)
+        n_draws = -(-round_size // topk)
+        samples = model.sample(n_draws).reshape(n_draws, dataset.num_classes)
+        batch = []
+        for sample in samples:
+            choices = [choice for choice in choice_fn(sample) if remaining[choice] > 0][:topk]
+            for choice in choices[:round_size - len(batch)]:
+                remaining[choice] -= 1
+                batch.append(choice)
+
+        predicted_classes = batch
+        true_classes = [queues[choice].pop() for choice in batch]
+        for observation_idx in range(len(batch)):
+            i += 1
+            if observation_idx == len(batch) - 1:
+                model.update_batch(predicted_classes, true_classes)
+            if i - 1 in slots:
+                mpe[slots[i - 1]] = model.mpe()
+                confusion_log[slots[i - 1]] = model.confusion_matrix()
 
     # In case we're one short
-    mpe[-1] = model.mpe()
+    if len(slots):
+        mpe[-1] = model.mpe()
 
     return mpe, confusion_log
 
@@ -240,64 +323,70 @@ def pretty_print(arr):
 def eval(results: np.ndarray, ground_truth: list, topk: int) -> Dict[str, np.ndarray]:
     """
 
-    :param results:(num_runs, num_samples // LOG_FREQ, num_classes)
+    :param results:(num_runs, num_checkpoints, num_classes)
     :param ground_truth: list of integers of length topk. Ground truth of topk classes.
     :param topk: int
     :return:
     """
     assert len(ground_truth) == topk
     num_runs, num_evals, num_classes = results.shape
-    avg_num_agreement = [None] * num_evals
-    mrr = [None] * num_evals
 
     ground_truth_array = np.zeros((num_classes,), dtype=np.bool_)
     ground_truth_array[np.array(ground_truth).astype(int)] = 1
 
-    for idx in range(num_evals):
-        current_result = results[:, idx, :]
-        topk_arms = np.argsort(current_result, axis=-1)[:, -topk:]
-        topk_list = topk_arms.flatten().tolist()
-        avg_num_agreement[idx] = len([arm for arm in topk_list if arm in ground_truth]) * 1.0 / (
-                topk * num_runs)
-        mrr[idx] = sum([mean_reciprocal_rank(results[run_id, idx, :], ground_truth_array, 'max') for run_id in
-                        range(num_runs)]) / num_runs
     return {
-        'avg_num_agreement': avg_num_agreement,
-        'mrr': mrr,
+        'avg_num_agreement': topk_agreement(results, ground_truth_array, 'max', topk).mean(axis=0),
+        'mrr': batch_mean_reciprocal_rank(results, ground_truth_array, 'max').mean(axis=0),
     }
 
 
+def load_dataset(args: argparse.Namespace):
+    """
+    Load the dataset of args.dataset, with superclass observations if args.superclass is set.
+    :return: Dataset or SuperclassDataset
+    """
+    if args.superclass:
+        return SuperclassDataset.load_from_text(DATAFILE_LIST[args.dataset], CIFAR100_SUPERCLASS_LOOKUP)
+    return Dataset.load_from_text(DATAFILE_LIST[args.dataset])
+
+
+def get_costs(args: argparse.Namespace, dataset) -> np.ndarray:
+    """
+    Cost matrix of args.type_cost, or a matrix with relative cost args.k if the type has no cost matrix file.
+    :param dataset: Dataset or SuperclassDataset
+    :return: (num_classes, num_classes) array, or (num_classes, 3) for superclass datasets.
+    """
+    cost_matrix = COST_MATRIX_FILE_DICT[args.type_cost]
+    if cost_matrix is not None:
+        return np.load(cost_matrix)
+
+    if args.superclass:
+        costs = np.zeros((dataset.num_classes, 3))
+        costs[:, 1] = 1
+        costs[:, 2] = args.k
+    else:
+        # Randomly fill cost matrix with integers between 1 and 5 w/ zeros on diagonal.
+        # costs = np.random.randint(1, 5, size=(dataset.num_classes, dataset.num_classes))
+        costs = np.ones((dataset.num_classes, dataset.num_classes))
+        costs[:, -1] = args.k * costs[:, -1]
+        np.fill_diagonal(costs, 0)
+    return costs
+
+
 # 01 loss
 # Informative priors...avg predicted confidences by predicted class
 
 def main(args: argparse.Namespace) -> None:
     # Set random seed to ensure reproducibility of experiments
     np.random.seed(args.seed)
+    dtype = PRECISION_DICT[args.precision]
 
     if not args.output.exists():
         args.output.mkdir()
 
     # Load the dataset and cost matrix
-    if args.superclass:
-        dataset = SuperclassDataset.load_from_text(DATAFILE_LIST[args.dataset], CIFAR100_SUPERCLASS_LOOKUP)
-    else:
-        dataset = Dataset.load_from_text(DATAFILE_LIST[args.dataset])
-
-    cost_matrix = COST_MATRIX_FILE_DICT[args.type_cost]
-
-    if cost_matrix is None:
-        if args.superclass:
-            costs = np.zeros((dataset.num_classes, 3))
-            costs[:, 1] = 1
-            costs[:, 2] = args.k
-        else:
-            # Randomly fill cost matrix with integers between 1 and 5 w/ zeros on diagonal.
-            # costs = np.random.randint(1, 5, size=(dataset.num_classes, dataset.num_classes))
-            costs = np.ones((dataset.num_classes, dataset.num_classes))
-            costs[:, -1] = args.k * costs[:, -1]
-            np.fill_diagonal(costs, 0)
-    else:
-        costs = np.load(cost_matrix)
+    dataset = load_dataset(args)
+    costs = get_costs(args, dataset)
     logging.info('Cost matrix:\n%s', costs)
 
     # Determine the highest cost predicted classes
@@ -309,12 +398,18 @@ def main(args: argparse.Namespace) -> None:
     logging.info('Classwise expected costs:\n%s', cost_string)
 
     # Run experiments...
-    # stores MPE of classwise cost after every LOG_FREQ steps for each run...
-    random_no_prior_results = np.zeros((N_SIMULATIONS, len(dataset) // LOG_FREQ, dataset.num_classes))
-    random_uniform_results = np.zeros((N_SIMULATIONS, len(dataset) // LOG_FREQ, dataset.num_classes))
-    random_informed_results = np.zeros((N_SIMULATIONS, len(dataset) // LOG_FREQ, dataset.num_classes))
-    active_uniform_results = np.zeros((N_SIMULATIONS, len(dataset) // LOG_FREQ, dataset.num_classes))
-    active_informed_results = np.zeros((N_SIMULATIONS, len(dataset) // LOG_FREQ, dataset.num_classes))
+    # stores MPE of classwise cost at every checkpoint for each run...
+    schedule = get_checkpoint_schedule(args, LOG_FREQ, start=LOG_FREQ - 1)
+    if args.budget is not None:
+        # labeling stops at the last checkpoint, which has to be the last sample of the budget
+        schedule = EndOfRun(schedule)
+    budget = get_budget(args.budget, len(dataset))
+    num_checkpoints = schedule.num_checkpoints(budget)
+    random_no_prior_results = np.zeros((N_SIMULATIONS, num_checkpoints, dataset.num_classes), dtype=dtype)
+    random_uniform_results = np.zeros((N_SIMULATIONS, num_checkpoints, dataset.num_classes), dtype=dtype)
+    random_informed_results = np.zeros((N_SIMULATIONS, num_checkpoints, dataset.num_classes), dtype=dtype)
+    active_uniform_results = np.zeros((N_SIMULATIONS, num_checkpoints, dataset.num_classes), dtype=dtype)
+    active_informed_results = np.zeros((N_SIMULATIONS, num_checkpoints, dataset.num_classes), dtype=dtype)
 
     if args.superclass:
         # will note enter this branch for now...
@@ -325,34 +420,28 @@ def main(args: argparse.Namespace) -> None:
     uniform_prior_alphas = np.ones(
         (dataset.num_classes, dataset.num_classes)) * args.pseudocount / dataset.num_classes
     informed_prior_alphas = args.pseudocount * dataset.confusion_prior
+
+    def simulate(prior_alphas: np.ndarray, choice_fn: Callable, run_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        # common random numbers: every method of a simulation labels the same shuffle of the dataset and starts its
+        # posterior draws from the same state. Shuffling replaces the arrays of the dataset, a shallow copy keeps the
+        # original order for the other methods.
+        np.random.seed([args.seed, run_idx])
+        model = DirichletMultinomialCost(prior_alphas, costs, dtype=dtype)
+        return select_and_label(dataset=copy.copy(dataset),
+                                model=model,
+                                topk=args.topk,
+                                choice_fn=choice_fn,
+                                dtype=dtype,
+                                batch_size=args.batch_size,
+                                schedule=schedule,
+                                budget=budget)
+
     for i in tqdm(range(N_SIMULATIONS)):
-        model = DirichletMultinomialCost(no_prior_alphas, costs)
-        random_no_prior_results[i], random_no_prior_confusion_log = select_and_label(dataset=dataset,
-                                                                                     model=model,
-                                                                                     topk=args.topk,
-                                                                                     choice_fn=random_choice_fn)
-
-        model = DirichletMultinomialCost(uniform_prior_alphas, costs)
-        random_uniform_results[i], random_uniform_confusion_log = select_and_label(dataset=dataset,
-                                                                                   model=model,
-                                                                                   topk=args.topk,
-                                                                                   choice_fn=random_choice_fn)
-        model = DirichletMultinomialCost(informed_prior_alphas, costs)
-        random_informed_results[i], random_informed_confusion_log = select_and_label(dataset=dataset,
-                                                                                     model=model,
-                                                                                     topk=args.topk,
-                                                                                     choice_fn=random_choice_fn)
-
-        model = DirichletMultinomialCost(uniform_prior_alphas, costs)
-        active_uniform_results[i], active_confusion_log = select_and_label(dataset=dataset,
-                                                                           model=model,
-                                                                           topk=args.topk,
-                                                                           choice_fn=max_choice_fn)
-        model = DirichletMultinomialCost(informed_prior_alphas, costs)
-        active_informed_results[i], active_informed_confusion_log = select_and_label(dataset=dataset,
-                                                                                     model=model,
-                                                                                     topk=args.topk,
-                                                                                     choice_fn=max_choice_fn)
+        random_no_prior_results[i], random_no_prior_confusion_log = simulate(no_prior_alphas, random_choice_fn, i)
+        random_uniform_results[i], random_uniform_confusion_log = simulate(uniform_prior_alphas, random_choice_fn, i)
+        random_informed_results[i], random_informed_confusion_log = simulate(informed_prior_alphas, random_choice_fn, i)
+        active_uniform_results[i], active_confusion_log = simulate(uniform_prior_alphas, max_choice_fn, i)
+        active_informed_results[i], active_informed_confusion_log = simulate(informed_prior_alphas, max_choice_fn, i)
 
     # Evaluation...
     random_no_prior_success = eval(random_no_prior_results, ground_truth, args.topk)['avg_num_agreement']
@@ -401,7 +490,7 @@ def main(args: argparse.Namespace) -> None:
 
     # Plot..
     fig, axes = plt.subplots(1, 1)
-    x_axis = np.arange(len(random_no_prior_success)) * LOG_FREQ
+    x_axis = schedule.indices(budget) + 1
     axes.plot(x_axis, random_no_prior_success, label='non-active(no prior)')
     axes.plot(x_axis, random_uniform_success, label='non-active(uniform prior)')
     axes.plot(x_axis, random_informed_success, label='non-active(informative prior)')
@@ -411,7 +500,7 @@ def main(args: argparse.Namespace) -> None:
     plt.savefig(args.output / f'success_curve_top{args.topk}_pseudocount{args.pseudocount}.png')
 
     fig, axes = plt.subplots(1, 1)
-    x_axis = np.arange(len(random_no_prior_mrr)) * LOG_FREQ
+    x_axis = schedule.indices(budget) + 1
     axes.plot(x_axis, random_no_prior_mrr, label='non-active(no prior)')
     axes.plot(x_axis, random_uniform_mrr, label='non-active(uniform prior)')
     axes.plot(x_axis, random_informed_mrr, label='non-active(informative prior)')
@@ -431,9 +520,22 @@ if __name__ == '__main__':
     parser.add_argument('-pseudocount', type=float, default=1, help='pseudocount per row for confusion matrix.')
     parser.add_argument('-k', type=float, default=2, help='relative cost')
     parser.add_argument('--superclass', action='store_true')
+    parser.add_argument('-precision', type=str, default=PRECISION, choices=list(PRECISION_DICT),
+                        help='floating point precision of models and results')
+    parser.add_argument('-batch_size', type=int, default=1,
+                        help='number of data points labeled per round, selected against the same posterior')
+    parser.add_argument('-budget', type=float, default=None,
+                        help='number of data points labeled per run, or a fraction of the dataset if at most 1. '
+                             'Default: all data points')
+
+    add_checkpoint_arguments(parser)
 
     args, _ = parser.parse_known_args()
     args.output = args.output / args.type_cost
+    if args.batch_size > 1:
+        args.output = args.output.parent / ('%s_batch%d' % (args.output.name, args.batch_size))
+    if args.budget is not None:
+        args.output = args.output.parent / ('%s_budget%g' % (args.output.name, args.budget))
 
     logging.basicConfig(level=logging.INFO)
 
@@ -1,11 +1,15 @@
 import pathlib
-from multiprocessing import Lock, Process, JoinableQueue
+from multiprocessing import Lock
 
 from tqdm import tqdm
 
+from pipeline import EVAL_ARGS, IGNORED_ARGS, run_topk_pipeline
+from resumable import array_digest, run_units, UnitStore
 from utils import *
 
 OUTPUT_DIR = RESULTS_DIR + "active_learning_topk"
+# the topk and baseline drivers share experiment directories
+EXPERIMENT = 'baselines'
 
 logger = logging.getLogger(__name__)
 process_lock = Lock()
@@ -13,58 +17,60 @@ process_lock = Lock()
 
 def main_accuracy_topk(args: argparse.Namespace, sample=True, eval=True, plot=True) -> None:
     num_classes = NUM_CLASSES_DICT[args.dataset]
+    dtype = PRECISION_DICT[args.precision]
 
-    categories, observations, confidences, idx2category, category2idx, labels = prepare_data(
-        DATAFILE_LIST[args.dataset], False)
-    indices = np.arange(len(categories))
+    dataset = PredictionSet.from_file(DATAFILE_LIST[args.dataset])
+    categories, observations, confidences, labels, indices = dataset.astuple()
 
     num_samples = len(observations)
+    # runs stop labeling at the budget
+    num_labeled = get_budget(args.budget, num_samples)
+    checkpoints = metric_checkpoints(args, 'avg_num_agreement', num_labeled)
 
     uniform_prior = np.ones((num_classes, 2)) / 2 * args.pseudocount
     confidence = get_confidence_k(categories, confidences, num_classes)
     informed_prior = np.array([confidence, 1 - confidence]).T * args.pseudocount
 
-    experiment_name = '%s_%s_%s_top%d_runs%d_pseudocount%.2f' % (
-        args.dataset, args.metric, args.mode, args.topk, RUNS, args.pseudocount)
+    experiment_name = get_experiment_name(args)
 
     if not (args.output / experiment_name).is_dir():
         (args.output / experiment_name).mkdir()
     sampled_categories_dict = {
-        'epsilon_greedy': np.empty((RUNS, num_samples), dtype=int),
-        'bayesian_ucb': np.empty((RUNS, num_samples), dtype=int),
+        'epsilon_greedy': np.empty((RUNS, num_labeled), dtype=int),
+        'bayesian_ucb': np.empty((RUNS, num_labeled), dtype=int),
     }
     sampled_observations_dict = {
-        'epsilon_greedy': np.empty((RUNS, num_samples), dtype=bool),
-        'bayesian_ucb': np.empty((RUNS, num_samples), dtype=bool),
+        'epsilon_greedy': np.empty((RUNS, num_labeled), dtype=bool),
+        'bayesian_ucb': np.empty((RUNS, num_labeled), dtype=bool),
     }
     sampled_scores_dict = {
-        'epsilon_greedy': np.empty((RUNS, num_samples), dtype=float),
-        'bayesian_ucb': np.empty((RUNS, num_samples), dtype=float),
+        'epsilon_greedy': np.empty((RUNS, num_labeled), dtype=dtype),
+        'bayesian_ucb': np.empty((RUNS, num_labeled), dtype=dtype),
     }
     sampled_labels_dict = {
-        'epsilon_greedy': np.empty((RUNS, num_samples), dtype=int),
-        'bayesian_ucb': np.empty((RUNS, num_samples), dtype=int),
+        'epsilon_greedy': np.empty((RUNS, num_labeled), dtype=int),
+        'bayesian_ucb': np.empty((RUNS, num_labeled), dtype=int),
     }
     sampled_indices_dict = {
-        'epsilon_greedy': np.empty((RUNS, num_samples), dtype=int),
-        'bayesian_ucb': np.empty((RUNS, num_samples), dtype=int),
+        'epsilon_greedy': np.empty((RUNS, num_labeled), dtype=int),
+        'bayesian_ucb': np.empty((RUNS, num_labeled), dtype=int),
     }
 
     avg_num_agreement_dict = {
-        'epsilon_greedy_no_prior': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
-        'epsilon_greedy_uniform': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
-        'epsilon_greedy_informed': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
-        'bayesian_ucb_no_prior': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
-        'bayesian_ucb_uniform': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
-        'bayesian_ucb_informed': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
+        'epsilon_greedy_no_prior': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'epsilon_greedy_uniform': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'epsilon_greedy_informed': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'bayesian_ucb_no_prior': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'bayesian_ucb_uniform': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'bayesian_ucb_informed': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
     }
     mrr_dict = {
-        'epsilon_greedy_no_prior': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
-        'epsilon_greedy_uniform': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
-        'epsilon_greedy_informed': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
-        'bayesian_ucb_no_prior': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
-        'bayesian_ucb_uniform': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
-        'bayesian_ucb_informed': np.zeros((RUNS, num_samples // LOG_FREQ + 1)),
+        'epsilon_greedy_no_prior': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'epsilon_greedy_uniform': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'epsilon_greedy_informed': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'bayesian_ucb_no_prior': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'bayesian_ucb_uniform': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'bayesian_ucb_informed': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
     }
 
     if sample:
@@ -78,10 +84,13 @@ def main_accuracy_topk(args: argparse.Namespace, sample=True, eval=True, plot=Tr
                                                                          labels,
                                                                          indices,
                                                                          num_classes,
-                                                                         num_samples,
+                                                                         num_labeled,
                                                                          sample_method='epsilon_greedy',
                                                                          prior=uniform_prior * 1e-6,
-                                                                         random_seed=r)
+                                                                         random_seed=r,
+                                                                         sampler=args.beta_sampler,
+                                                                         sampler_threshold=args.beta_sampler_threshold,
+                                                                         batch_size=args.batch_size)
             sampled_categories_dict['bayesian_ucb'][r], sampled_observations_dict['bayesian_ucb'][r], \
             sampled_scores_dict['bayesian_ucb'][r], sampled_labels_dict['bayesian_ucb'][r], \
             sampled_indices_dict['bayesian_ucb'][r] = get_samples_topk(args,
@@ -91,107 +100,60 @@ def main_accuracy_topk(args: argparse.Namespace, sample=True, eval=True, plot=Tr
                                                                        labels,
                                                                        indices,
                                                                        num_classes,
-                                                                       num_samples,
+                                                                       num_labeled,
                                                                        sample_method='bayesian_ucb',
                                                                        prior=uniform_prior * 1e-6,
-                                                                       random_seed=r)
-        # write samples to file
+                                                                       random_seed=r,
+                                                                       sampler=args.beta_sampler,
+                                                                       sampler_threshold=args.beta_sampler_threshold,
+                                                                       batch_size=args.batch_size)
+        # write sampled indices and observations to file
         for method in ['epsilon_greedy', 'bayesian_ucb']:
-            np.save(args.output / experiment_name / ('sampled_categories_%s.npy' % method),
-                    sampled_categories_dict[method])
-            np.save(args.output / experiment_name / ('sampled_observations_%s.npy' % method),
-                    sampled_observations_dict[method])
-            np.save(args.output / experiment_name / ('sampled_scores_%s.npy' % method), sampled_scores_dict[method])
-            np.save(args.output / experiment_name / ('sampled_labels_%s.npy' % method), sampled_labels_dict[method])
-            np.save(args.output / experiment_name / ('sampled_indices_%s.npy' % method), sampled_indices_dict[method])
+            save_trajectory(args.output / experiment_name, method, sampled_indices_dict[method],
+                            sampled_observations_dict[method])
     else:
-        # load sampled categories, scores and observations from file
+        # load sampled trajectories from file
         for method in ['epsilon_greedy', 'bayesian_ucb']:
-            sampled_categories_dict[method] = np.load(
-                args.output / experiment_name / ('sampled_categories_%s.npy' % method))
-            sampled_observations_dict[method] = np.load(
-                args.output / experiment_name / ('sampled_observations_%s.npy' % method))
-            sampled_scores_dict[method] = np.load(args.output / experiment_name / ('sampled_scores_%s.npy' % method))
-            sampled_labels_dict[method] = np.load(args.output / experiment_name / ('sampled_labels_%s.npy' % method))
-            sampled_indices_dict[method] = np.load(args.output / experiment_name / ('sampled_indices_%s.npy' % method))
+            sampled_categories_dict[method], sampled_observations_dict[method], sampled_scores_dict[method], \
+            sampled_labels_dict[method], sampled_indices_dict[method] = load_trajectory(
+                args.output / experiment_name, method, dataset).astuple()
 
     if eval:
         ground_truth = get_ground_truth(categories, observations, confidences, num_classes, args.metric, args.mode,
                                         topk=args.topk)
 
+        priors_dict = {
+            'epsilon_greedy': {'epsilon_greedy_no_prior': uniform_prior * 1e-6,
+                               'epsilon_greedy_uniform': uniform_prior,
+                               'epsilon_greedy_informed': informed_prior},
+            'bayesian_ucb': {'bayesian_ucb_no_prior': uniform_prior * 1e-6,
+                             'bayesian_ucb_uniform': uniform_prior,
+                             'bayesian_ucb_informed': informed_prior},
+        }
+        store = ResultStore(args.output / experiment_name, RUNS, dtype=dtype)
+        store.write_metadata(num_samples=num_samples, budget=num_labeled)
         for r in tqdm(range(RUNS)):
-            avg_num_agreement_dict['epsilon_greedy_no_prior'][r], mrr_dict['epsilon_greedy_no_prior'][r] = evaluate(
-                args,
-                sampled_categories_dict['epsilon_greedy'][r].tolist(),
-                sampled_observations_dict['epsilon_greedy'][r].tolist(),
-                sampled_scores_dict['epsilon_greedy'][r].tolist(),
-                sampled_labels_dict['epsilon_greedy'][r].tolist(),
-                sampled_indices_dict['epsilon_greedy'][r].tolist(),
-                ground_truth,
-                num_classes=num_classes,
-                prior=uniform_prior * 1e-6)
-            avg_num_agreement_dict['epsilon_greedy_uniform'][r], mrr_dict['epsilon_greedy_uniform'][r] = evaluate(
-                args,
-                sampled_categories_dict['epsilon_greedy'][r].tolist(),
-                sampled_observations_dict['epsilon_greedy'][r].tolist(),
-                sampled_scores_dict['epsilon_greedy'][r].tolist(),
-                sampled_labels_dict['epsilon_greedy'][r].tolist(),
-                sampled_indices_dict['epsilon_greedy'][r].tolist(),
-                ground_truth,
-                num_classes=num_classes,
-                prior=uniform_prior)
-            avg_num_agreement_dict['epsilon_greedy_informed'][r], mrr_dict['epsilon_greedy_informed'][r] = evaluate(
-                args,
-                sampled_categories_dict['epsilon_greedy'][r].tolist(),
-                sampled_observations_dict['epsilon_greedy'][r].tolist(),
-                sampled_scores_dict['epsilon_greedy'][r].tolist(),
-                sampled_labels_dict['epsilon_greedy'][r].tolist(),
-                sampled_indices_dict['epsilon_greedy'][r].tolist(),
-                ground_truth,
-                num_classes=num_classes,
-                prior=informed_prior)
-            avg_num_agreement_dict['bayesian_ucb_no_prior'][r], mrr_dict['bayesian_ucb_no_prior'][r] = evaluate(
-                args,
-                sampled_categories_dict['bayesian_ucb'][r].tolist(),
-                sampled_observations_dict['bayesian_ucb'][r].tolist(),
-                sampled_scores_dict['bayesian_ucb'][r].tolist(),
-                sampled_labels_dict['bayesian_ucb'][r].tolist(),
-                sampled_indices_dict['bayesian_ucb'][r].tolist(),
-                ground_truth,
-                num_classes=num_classes,
-                prior=uniform_prior * 1e-6)
-            avg_num_agreement_dict['bayesian_ucb_uniform'][r], mrr_dict['bayesian_ucb_uniform'][r] = evaluate(
-                args,
-                sampled_categories_dict['bayesian_ucb'][r].tolist(),
-                sampled_observations_dict['bayesian_ucb'][r].tolist(),
-                sampled_scores_dict['bayesian_ucb'][r].tolist(),
-                sampled_labels_dict['bayesian_ucb'][r].tolist(),
-                sampled_indices_dict['bayesian_ucb'][r].tolist(),
-                ground_truth,
-                num_classes=num_classes,
-                prior=uniform_prior)
-            avg_num_agreement_dict['bayesian_ucb_informed'][r], mrr_dict['bayesian_ucb_informed'][r] = evaluate(
-                args,
-                sampled_categories_dict['bayesian_ucb'][r].tolist(),
-                sampled_observations_dict['bayesian_ucb'][r].tolist(),
-                sampled_scores_dict['bayesian_ucb'][r].tolist(),
-                sampled_labels_dict['bayesian_ucb'][r].tolist(),
-                sampled_indices_dict['bayesian_ucb'][r].tolist(),
-                ground_truth,
-                num_classes=num_classes,
-                prior=informed_prior)
-
-        for method in ['epsilon_greedy_no_prior', 'epsilon_greedy_uniform', 'epsilon_greedy_informed',
-                       'bayesian_ucb_no_prior', 'bayesian_ucb_uniform', 'bayesian_ucb_informed']:
-            np.save(args.output / experiment_name / ('avg_num_agreement_%s.npy' % method),
-                    avg_num_agreement_dict[method])
-            np.save(args.output / experiment_name / ('mrr_%s.npy' % method), mrr_dict[method])
-    else:
+            # all priors of a sample sequence are evaluated from the same checkpoint counts
+            for method, priors in priors_dict.items():
+                avg_num_agreement, mrr = evaluate_priors(args, sampled_categories_dict[method][r],
+                                                         sampled_observations_dict[method][r], ground_truth,
+                                                         num_classes, np.array(list(priors.values())))
+                for p, key in enumerate(priors):
+                    avg_num_agreement_dict[key][r] = avg_num_agreement[p]
+                    mrr_dict[key][r] = mrr[p]
+                    if not r:
+                        # curves of an earlier evaluation, e.g. with another checkpoint schedule, are replaced
+                        store.remove('avg_num_agreement', key)
+                        store.remove('mrr', key)
+                    store.write_run('avg_num_agreement', key, r, avg_num_agreement[p], checkpoints=checkpoints)
+                    store.write_run('mrr', key, r, mrr[p], checkpoints=checkpoints)
+
+        store.finalize()
+    elif plot:
         for method in ['epsilon_greedy_no_prior', 'epsilon_greedy_uniform', 'epsilon_greedy_informed',
                        'bayesian_ucb_no_prior', 'bayesian_ucb_uniform', 'bayesian_ucb_informed']:
-            avg_num_agreement_dict[method] = np.load(
-                args.output / experiment_name / ('avg_num_agreement_%s.npy' % method))
-            mrr_dict[method] = np.load(args.output / experiment_name / ('mrr_%s.npy' % method))
+            avg_num_agreement_dict[method] = load_runs(args.output / experiment_name, 'avg_num_agreement', method)
+            mrr_dict[method] = load_runs(args.output / experiment_name, 'mrr', method)
 
     if plot:
         comparison_plot(args, experiment_name, avg_num_agreement_dict, mrr_dict=mrr_dict, is_baseline=True)
@@ -199,257 +161,199 @@ def main_accuracy_topk(args: argparse.Namespace, sample=True, eval=True, plot=Tr
 
 def main_calibration_error_topk(args: argparse.Namespace, sample=True, eval=True, plot=True) -> None:
     num_classes = NUM_CLASSES_DICT[args.dataset]
+    dtype = PRECISION_DICT[args.precision]
 
     global logits
-    logits_path = LOGITSFILE_DICT.get(args.dataset,
-                                      None)  # Since we haven't created all the logits yet, assign defaul value of None.
-    if logits_path is not None:
-        logits = np.genfromtxt(logits_path)[:, 1:]
-    else:
-        logits = None
-
-    categories, observations, confidences, idx2category, category2idx, labels = prepare_data(
-        DATAFILE_LIST[args.dataset], False)
-    indices = np.arange(len(categories))
-
-    categories, observations, confidences, labels, indices, \
+    # Since we haven't created all the logits yet, assign defaul value of None. Logits are only read from disk when the
+    # calibration model is trained on them.
+    dataset = PredictionSet.from_file(DATAFILE_LIST[args.dataset], logits_path=LOGITSFILE_DICT.get(args.dataset, None))
+    logits = dataset.logits if args.calibration_model in ['platt_scaling', 'temperature_scaling'] else None
+
+    train_set, holdout_set = dataset.split(holdout_ratio=HOLDOUT_RATIO,
+                                           random_state=np.random.RandomState(HOLDOUT_SEED))
+    categories, observations, confidences, labels, indices = train_set.astuple()
     holdout_categories, holdout_observations, holdout_confidences, holdout_labels, holdout_indices = \
-        train_holdout_split(categories, observations, confidences, labels, indices, holdout_ratio=HOLDOUT_RATIO)
+        holdout_set.astuple()
 
     num_samples = len(observations)
+    # runs stop labeling at the budget
+    num_labeled = get_budget(args.budget, num_samples)
+    checkpoints = metric_checkpoints(args, 'avg_num_agreement', num_labeled)
+    calibration_checkpoints = metric_checkpoints(args, 'holdout_ece', num_labeled)
 
-    experiment_name = '%s_%s_%s_top%d_runs%d_pseudocount%.2f' % (
-        args.dataset, args.metric, args.mode, args.topk, RUNS, args.pseudocount)
+    experiment_name = get_experiment_name(args)
+    # arguments the sampled and evaluated runs depend on
+    eval_fingerprint = {key: value for key, value in vars(args).items() if key not in IGNORED_ARGS}
+    eval_fingerprint['runs'] = RUNS
+    sample_fingerprint = {key: value for key, value in eval_fingerprint.items() if key not in EVAL_ARGS}
 
     if not (args.output / experiment_name).is_dir():
         (args.output / experiment_name).mkdir()
 
     sampled_categories_dict = {
-        'epsilon_greedy': MpSafeSharedArray((RUNS, num_samples), dtype=np.int),
-        'bayesian_ucb': MpSafeSharedArray((RUNS, num_samples), dtype=np.int),
+        'epsilon_greedy': np.empty((RUNS, num_labeled), dtype=int),
+        'bayesian_ucb': np.empty((RUNS, num_labeled), dtype=int),
     }
     sampled_observations_dict = {
-        'epsilon_greedy': MpSafeSharedArray((RUNS, num_samples), dtype=np.bool),
-        'bayesian_ucb': MpSafeSharedArray((RUNS, num_samples), dtype=np.bool),
+        'epsilon_greedy': np.empty((RUNS, num_labeled), dtype=bool),
+        'bayesian_ucb': np.empty((RUNS, num_labeled), dtype=bool),
     }
     sampled_scores_dict = {
-        'epsilon_greedy': MpSafeSharedArray((RUNS, num_samples), dtype=np.float),
-        'bayesian_ucb': MpSafeSharedArray((RUNS, num_samples), dtype=np.float),
+        'epsilon_greedy': np.empty((RUNS, num_labeled), dtype=dtype),
+        'bayesian_ucb': np.empty((RUNS, num_labeled), dtype=dtype),
     }
     sampled_labels_dict = {
-        'epsilon_greedy': MpSafeSharedArray((RUNS, num_samples), dtype=np.int),
-        'bayesian_ucb': MpSafeSharedArray((RUNS, num_samples), dtype=np.int),
+        'epsilon_greedy': np.empty((RUNS, num_labeled), dtype=int),
+        'bayesian_ucb': np.empty((RUNS, num_labeled), dtype=int),
     }
     sampled_indices_dict = {
-        'epsilon_greedy': MpSafeSharedArray((RUNS, num_samples), dtype=np.int),
-        'bayesian_ucb': MpSafeSharedArray((RUNS, num_samples), dtype=np.int),
+        'epsilon_greedy': np.empty((RUNS, num_labeled), dtype=int),
+        'bayesian_ucb': np.empty((RUNS, num_labeled), dtype=int),
     }
 
     avg_num_agreement_dict = {
-        'epsilon_greedy': MpSafeSharedArray((RUNS, num_samples // LOG_FREQ + 1), dtype=np.float),
-        'bayesian_ucb': MpSafeSharedArray((RUNS, num_samples // LOG_FREQ + 1), dtype=np.float),
+        'epsilon_greedy': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'bayesian_ucb': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
     }
     mrr_dict = {
-        'epsilon_greedy': MpSafeSharedArray((RUNS, num_samples // CALIBRATION_FREQ + 1), dtype=np.float),
-        'bayesian_ucb': MpSafeSharedArray((RUNS, num_samples // CALIBRATION_FREQ + 1), dtype=np.float),
+        'epsilon_greedy': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
+        'bayesian_ucb': np.zeros((RUNS, len(checkpoints)), dtype=dtype),
     }
     holdout_ece_dict = {
-        'epsilon_greedy': MpSafeSharedArray((RUNS, num_samples // CALIBRATION_FREQ + 1), dtype=np.float),
-        'bayesian_ucb': MpSafeSharedArray((RUNS, num_samples // CALIBRATION_FREQ + 1), dtype=np.float),
+        'epsilon_greedy': np.zeros((RUNS, len(calibration_checkpoints)), dtype=dtype),
+        'bayesian_ucb': np.zeros((RUNS, len(calibration_checkpoints)), dtype=dtype),
     }
 
     if sample:
         logger.info('Starting sampling')
 
-        def sampler_worker(queue):
-            # Continue to work until queue is empty
-            while not queue.empty():
-                # Get a job (e.g. run index)
-                run_idx, sample_method = queue.get()
-
-                if sample_method == 'non-active':
-                    method = 'random'
-                else:
-                    method = sample_method
-
-                with process_lock:
-                    logger.debug(f'Working on sampling task :: Run: {run_idx} :: Method {method}')
-
-                sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices = \
-                    get_samples_topk(args,
-                                     categories,
-                                     observations,
-                                     confidences,
-                                     labels,
-                                     indices,
-                                     num_classes,
-                                     num_samples,
-                                     sample_method=method,
-                                     random_seed=run_idx)
-
-                category_array = sampled_categories_dict[sample_method]
-                with category_array.get_lock():
-                    arr = category_array.get_array()
-                    arr[run_idx] = sampled_categories
-
-                observation_array = sampled_observations_dict[sample_method]
-                with observation_array.get_lock():
-                    arr = observation_array.get_array()
-                    arr[run_idx] = sampled_observations
-
-                score_array = sampled_scores_dict[sample_method]
-                with score_array.get_lock():
-                    arr = score_array.get_array()
-                    arr[run_idx] = sampled_scores
-
-                label_array = sampled_labels_dict[sample_method]
-                with label_array.get_lock():
-                    arr = label_array.get_array()
-                    arr[run_idx] = sampled_labels
-
-                index_array = sampled_indices_dict[sample_method]
-                with index_array.get_lock():
-                    arr = index_array.get_array()
-                    arr[run_idx] = sampled_indices
-
-                queue.task_done()
-
-        # Enqueue tasks
-        logger.debug('Enqueueing sampling tasks')
-        sampling_job_queue = JoinableQueue()
-        for i in range(RUNS):
-            sampling_job_queue.put((i, 'epsilon_greedy'))
-            sampling_job_queue.put((i, 'bayesian_ucb'))
-
-        # Start tasks
+        units = UnitStore(args.output / experiment_name, '%s_sample' % EXPERIMENT, fingerprint=sample_fingerprint)
+
+        def sample_unit(task: Tuple[int, str]) -> Dict[str, np.ndarray]:
+            run_idx, sample_method = task
+
+            if sample_method == 'non-active':
+                method = 'random'
+            else:
+                method = sample_method
+
+            with process_lock:
+                logger.debug(f'Working on sampling task :: Run: {run_idx} :: Method {method}')
+
+            sampled = get_samples_topk(args,
+                                       categories,
+                                       observations,
+                                       confidences,
+                                       labels,
+                                       indices,
+                                       num_classes,
+                                       num_labeled,
+                                       sample_method=method,
+                                       random_seed=run_idx,
+                                       sampler=args.beta_sampler,
+                                       sampler_threshold=args.beta_sampler_threshold,
+                                       batch_size=args.batch_size)
+            return dict(zip(SAMPLE_COLUMNS, sampled))
+
+        # Run tasks in a pool of workers. Every run is committed to its own file, so runs finished by an interrupted
+        # call are not sampled again.
         logger.debug('Running sampling tasks')
-        for _ in range(args.processes):
-            process = Process(target=sampler_worker, args=(sampling_job_queue,))
-            process.start()
-
-        # Make sure all work is done before proceeding
-        sampling_job_queue.join()
+        tasks = []
+        for i in range(RUNS):
+            tasks.append((i, 'epsilon_greedy'))
+            tasks.append((i, 'bayesian_ucb'))
+        sample_units = [(units, '%s_run%d' % (method, run_idx), (run_idx, method)) for run_idx, method in tasks]
+        failed = run_units(sample_unit, sample_units, args.processes)
+        if failed:
+            raise RuntimeError("%d sampling tasks failed, rerun to retry them." % len(failed))
         logger.debug('Sampling finished')
 
-        # We want numpy arrays but instead have the weird custom process-safe arrays.
-        # Since the rest of the code expects a numpy array we're going to replace the
-        # elements in the dictionaries with their array counterparts.
-        for method in ['epsilon_greedy', 'bayesian_ucb']:
-            with sampled_categories_dict[method].get_lock():
-                sampled_categories_dict[method] = sampled_categories_dict[method].get_array()
-            with sampled_observations_dict[method].get_lock():
-                sampled_observations_dict[method] = sampled_observations_dict[method].get_array()
-            with sampled_scores_dict[method].get_lock():
-                sampled_scores_dict[method] = sampled_scores_dict[method].get_array()
-            with sampled_labels_dict[method].get_lock():
-                sampled_labels_dict[method] = sampled_labels_dict[method].get_array()
-            with sampled_indices_dict[method].get_lock():
-                sampled_indices_dict[method] = sampled_indices_dict[method].get_array()
+        for _, name, (run_idx, method) in sample_units:
+            sampled = units.load(name)
+            for sampled_dict, column in zip([sampled_categories_dict, sampled_observations_dict, sampled_scores_dict,
+                                             sampled_labels_dict, sampled_indices_dict], SAMPLE_COLUMNS):
+                sampled_dict[method][run_idx] = sampled[column]
 
         # Write to disk
         for method in ['epsilon_greedy', 'bayesian_ucb']:
-            np.save(args.output / experiment_name / ('sampled_categories_%s.npy' % method),
-                    sampled_categories_dict[method])
-            np.save(args.output / experiment_name / ('sampled_observations_%s.npy' % method),
-                    sampled_observations_dict[method])
-            np.save(args.output / experiment_name / ('sampled_scores_%s.npy' % method), sampled_scores_dict[method])
-            np.save(args.output / experiment_name / ('sampled_labels_%s.npy' % method), sampled_labels_dict[method])
-            np.save(args.output / experiment_name / ('sampled_indices_%s.npy' % method), sampled_indices_dict[method])
+            save_trajectory(args.output / experiment_name, method, sampled_indices_dict[method],
+                            sampled_observations_dict[method])
+        units.clear()
     else:
-        # load sampled categories, scores and observations from file
+        # load sampled trajectories from file
         for method in ['epsilon_greedy', 'bayesian_ucb']:
-            sampled_categories_dict[method] = np.load(
-                args.output / experiment_name / ('sampled_categories_%s.npy' % method))
-            sampled_observations_dict[method] = np.load(
-                args.output / experiment_name / ('sampled_observations_%s.npy' % method))
-            sampled_scores_dict[method] = np.load(args.output / experiment_name / ('sampled_scores_%s.npy' % method))
-            sampled_labels_dict[method] = np.load(args.output / experiment_name / ('sampled_labels_%s.npy' % method))
-            sampled_indices_dict[method] = np.load(args.output / experiment_name / ('sampled_indices_%s.npy' % method))
+            sampled_categories_dict[method], sampled_observations_dict[method], sampled_scores_dict[method], \
+            sampled_labels_dict[method], sampled_indices_dict[method] = load_trajectory(
+                args.output / experiment_name, method, dataset).astuple()
 
     if eval:
         logger.info('Starting evaluation')
         ground_truth = get_bayesian_ground_truth(categories, observations, confidences, num_classes, args.metric,
                                                  args.mode, topk=args.topk, pseudocount=args.pseudocount)
-
-        def eval_worker(queue):
-            while not queue.empty():
-                run_idx, method = queue.get()
-                with process_lock:
-                    logger.debug(f'Working on eval task :: Run: {run_idx} :: Method {method}')
-                agreement, ece, mrr = evaluate(args,
-                                               sampled_categories_dict[method][run_idx].tolist(),
-                                               sampled_observations_dict[method][run_idx].tolist(),
-                                               sampled_scores_dict[method][run_idx].tolist(),
-                                               sampled_labels_dict[method][run_idx].tolist(),
-                                               sampled_indices_dict[method][run_idx].tolist(),
-                                               ground_truth,
-                                               num_classes,
-                                               holdout_categories=holdout_categories,
-                                               holdout_observations=holdout_observations,
-                                               holdout_confidences=holdout_confidences,
-                                               holdout_labels=holdout_labels,
-                                               holdout_indices=holdout_indices,
-                                               logits=logits)
-
-                # Write outputs
-                avg_num_agreement_array = avg_num_agreement_dict[method]
-                with avg_num_agreement_array.get_lock():
-                    arr = avg_num_agreement_array.get_array()
-                    arr[run_idx] = agreement
-                holdout_ece_array = holdout_ece_dict[method]
-                with holdout_ece_array.get_lock():
-                    arr = holdout_ece_array.get_array()
-                    arr[run_idx] = ece
-                mrr_array = mrr_dict[method]
-                with mrr_array.get_lock():
-                    arr = mrr_array.get_array()
-                    arr[run_idx] = mrr
-
-                queue.task_done()
-
-        # Enqueue tasks
-        logger.debug('Enqueueing evaluation tasks')
-        eval_job_queue = JoinableQueue()
-        for i in range(RUNS):
-            eval_job_queue.put((i, 'epsilon_greedy'))
-            eval_job_queue.put((i, 'bayesian_ucb'))
-
-        # Start tasks
+        holdout = HoldoutFeatures(holdout_categories, holdout_observations, holdout_confidences, holdout_indices,
+                                  ground_truth=ground_truth, logits=logits)
+
+        # evaluated runs are committed like sampled runs, they depend on the trajectories being evaluated
+        units = UnitStore(args.output / experiment_name, '%s_eval' % EXPERIMENT,
+                          fingerprint=dict(eval_fingerprint, trajectories=array_digest(
+                              *[sampled_indices_dict[method] for method in ['epsilon_greedy', 'bayesian_ucb']],
+                              *[sampled_observations_dict[method] for method in ['epsilon_greedy', 'bayesian_ucb']])))
+
+        def eval_unit(task: Tuple[int, str]) -> Dict[str, np.ndarray]:
+            run_idx, method = task
+            with process_lock:
+                logger.debug(f'Working on eval task :: Run: {run_idx} :: Method {method}')
+            agreement, ece, mrr = evaluate(args,
+                                           sampled_categories_dict[method][run_idx],
+                                           sampled_observations_dict[method][run_idx],
+                                           sampled_scores_dict[method][run_idx],
+                                           sampled_labels_dict[method][run_idx],
+                                           sampled_indices_dict[method][run_idx],
+                                           ground_truth,
+                                           num_classes,
+                                           holdout_categories=holdout_categories,
+                                           holdout_observations=holdout_observations,
+                                           holdout_confidences=holdout_confidences,
+                                           holdout_labels=holdout_labels,
+                                           holdout_indices=holdout_indices,
+                                           logits=logits,
+                                           holdout=holdout)
+            return {'avg_num_agreement': agreement, 'holdout_ece': ece, 'mrr': mrr}
+
+        # Run tasks
         logger.debug('Running evaluation tasks')
-        for _ in range(args.processes):
-            process = Process(target=eval_worker, args=(eval_job_queue,))
-            process.start()
-
-        # Make sure all work is done before proceeding
-        eval_job_queue.join()
+        eval_units = [(units, '%s_run%d' % (method, run_idx), (run_idx, method))
+                      for run_idx in range(RUNS) for method in ['epsilon_greedy', 'bayesian_ucb']]
+        failed = run_units(eval_unit, eval_units, args.processes)
+        if failed:
+            raise RuntimeError("%d evaluation tasks failed, rerun to retry them." % len(failed))
         logger.debug('Evaluation tasks finished')
 
-        # We want numpy arrays but instead have the weird custom process-safe arrays.
-        # Since the rest of the code expects a numpy array we're going to replace the
-        # elements in the dictionaries with their array counterparts.
-        for method in ['epsilon_greedy', 'bayesian_ucb']:
-            with avg_num_agreement_dict[method].get_lock():
-                avg_num_agreement_dict[method] = avg_num_agreement_dict[method].get_array()
-            with holdout_ece_dict[method].get_lock():
-                holdout_ece_dict[method] = holdout_ece_dict[method].get_array()
-            with mrr_dict[method].get_lock():
-                mrr_dict[method] = mrr_dict[method].get_array()
-
-        for method in ['epsilon_greedy', 'bayesian_ucb']:
-            np.save(args.output / experiment_name / ('avg_num_agreement_%s.npy' % method),
-                    avg_num_agreement_dict[method])
-            np.save(args.output / experiment_name / ('mrr_%s.npy' % method), mrr_dict[method])
-            np.save(args.output / experiment_name / ('holdout_ece_%s_%s.npy' % (args.calibration_model, method)),
-                    holdout_ece_dict[method])
-
-    else:
+        store = ResultStore(args.output / experiment_name, RUNS, dtype=dtype)
+        store.write_metadata(num_samples=num_samples, budget=num_labeled)
+        for _, name, (run_idx, method) in eval_units:
+            evaluated = units.load(name)
+            avg_num_agreement_dict[method][run_idx] = evaluated['avg_num_agreement']
+            holdout_ece_dict[method][run_idx] = evaluated['holdout_ece']
+            mrr_dict[method][run_idx] = evaluated['mrr']
+            if not run_idx:
+                # curves of an earlier evaluation, e.g. with another checkpoint schedule, are replaced
+                for metric in ['avg_num_agreement', 'holdout_ece_%s' % args.calibration_model, 'mrr']:
+                    store.remove(metric, method)
+            store.write_run('avg_num_agreement', method, run_idx, evaluated['avg_num_agreement'],
+                            checkpoints=checkpoints)
+            store.write_run('holdout_ece_%s' % args.calibration_model, method, run_idx, evaluated['holdout_ece'],
+                            checkpoints=calibration_checkpoints)
+            store.write_run('mrr', method, run_idx, evaluated['mrr'], checkpoints=checkpoints)
+        store.finalize()
+        units.clear()
+
+    elif plot:
         for method in ['epsilon_greedy', 'bayesian_ucb']:
-            avg_num_agreement_dict[method] = np.load(
-                args.output / experiment_name / ('avg_num_agreement_%s.npy' % method))
-            mrr_dict[method] = np.load(
-                args.output / experiment_name / ('mrr_%s.npy' % method))
-            holdout_ece_dict[method] = np.load(
-                args.output / experiment_name / ('holdout_ece_%s_%s.npy' % (args.calibration_model, method)))
+            avg_num_agreement_dict[method] = load_runs(args.output / experiment_name, 'avg_num_agreement', method)
+            mrr_dict[method] = load_runs(args.output / experiment_name, 'mrr', method)
+            holdout_ece_dict[method] = load_runs(args.output / experiment_name,
+                                                 'holdout_ece_%s' % args.calibration_model, method)
 
     if plot:
         comparison_plot(args, experiment_name, avg_num_agreement_dict, holdout_ece_dict, mrr_dict=mrr_dict,
@@ -468,8 +372,23 @@ if __name__ == "__main__":
                         help='calibration models to apply on holdout data')
     parser.add_argument('--processes', type=int, default=4,
                         help='Number of sample processes. Increase to speed up sampling.')
+    parser.add_argument('--precision', type=str, default=PRECISION, choices=list(PRECISION_DICT),
+                        help='floating point precision of models, sample buffers and results')
+    parser.add_argument('--beta_sampler', type=str, default=BETA_SAMPLER, choices=BETA_SAMPLERS,
+                        help='exact or normal, sampler used to draw from Beta posteriors')
+    parser.add_argument('--beta_sampler_threshold', type=float, default=NORMAL_APPROXIMATION_THRESHOLD,
+                        help='minimum alpha + beta for the normal sampler to approximate a Beta posterior')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='number of samples labeled per round, selected against the same posterior')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='number of samples labeled per run, or a fraction of the dataset if at most 1. '
+                             'Default: all samples')
+    parser.add_argument('--cache', action='store_true',
+                        help='run sample, eval and plot as cached stages, skipping stages whose inputs are unchanged')
     parser.add_argument('--debug', action='store_true', help='Enables debug statements')
 
+    add_checkpoint_arguments(parser)
+
     args, _ = parser.parse_known_args()
 
     if args.debug:
@@ -483,6 +402,14 @@ if __name__ == "__main__":
 
     logger.info(f'Dataset: {args.dataset} :: Model: {args.mode}')
     if args.metric == 'accuracy':
-        main_accuracy_topk(args, sample=True, eval=True, plot=True)
+        main_fct = main_accuracy_topk
     elif args.metric == 'calibration_error':
-        main_calibration_error_topk(args, sample=True, eval=True, plot=True)
+        main_fct = main_calibration_error_topk
+    else:
+        raise ValueError("%s is not a supported metric." % args.metric)
+
+    if args.cache:
+        directories = run_topk_pipeline(args, main_fct, RUNS, cache_dir=args.output / 'cache')
+        logger.info('Results: %s' % directories['plot'])
+    else:
+        main_fct(args, sample=True, eval=True, plot=True)
@@ -0,0 +1,242 @@
+"""
+Active assessment against a labeling oracle with latency. Queries are selected with the sampling methods in
+SAMPLE_CATEGORY, up to max_in_flight queries are outstanding at any time, and labels update the model in the order in
+which they arrive. While labels are outstanding the next queries are selected ahead of time, so that a freed slot is
+refilled without waiting for the selector.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+
+from utils import *
+
+MAX_IN_FLIGHT = 50
+PREFETCH = 10
+LATENCY = 0.01
+NUM_RUNS = 3
+
+logger = logging.getLogger(__name__)
+
+
+class Oracle:
+    """
+    Abstract base class to be inhereted by all labeling oracles.
+    Derived classes must implement an asynchronous label method.
+    """
+
+    async def label(self, index: int) -> int:
+        """
+        Request the true label of a sample.
+        :param index: int
+            Index of the sample in the dataset.
+        :return: int
+            The true class revealed by the oracle.
+        """
+        raise NotImplementedError
+
+
+class FakeOracle(Oracle):
+    """
+    In-process oracle that answers from known labels after a random delay. Delays are min_latency plus an exponential
+        variate with mean latency, so labels of concurrent queries arrive out of order.
+    """
+
+    def __init__(self, labels: List[int], latency: float = LATENCY, min_latency: float = 0., random_seed: int = 0):
+        """
+        :param labels: List[int]
+            True labels of the samples in the dataset.
+        :param latency: float
+            Mean of the random part of the delay in seconds. Default: LATENCY.
+        :param min_latency: float
+            Minimum delay in seconds. Default: 0.
+        :param random_seed: int
+            Seed of the delays. Default: 0.
+        """
+        self._labels = labels
+        self.latency = latency
+        self.min_latency = min_latency
+        self._random = random.Random(random_seed)
+        self.num_queries = 0
+        self.num_in_flight = 0
+        self.max_num_in_flight = 0
+
+    async def label(self, index: int) -> int:
+        self.num_queries += 1
+        self.num_in_flight += 1
+        self.max_num_in_flight = max(self.max_num_in_flight, self.num_in_flight)
+        delay = self.min_latency
+        if self.latency > 0:
+            delay += self._random.expovariate(1 / self.latency)
+        await asyncio.sleep(delay)
+        self.num_in_flight -= 1
+        return self._labels[index]
+
+
+async def assess(args: argparse.Namespace,
+                 categories: List[int],
+                 confidences: List[float],
+                 oracle: Oracle,
+                 num_classes: int,
+                 sample_method: str,
+                 prior=None,
+                 weight=None,
+                 max_in_flight: int = MAX_IN_FLIGHT,
+                 prefetch: int = PREFETCH,
+                 random_seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Label every sample through the oracle, selecting queries actively.
+    :param args: argparse.Namespace
+        Provides metric, mode, topk, pseudocount and precision, as for get_samples_topk.
+    :param categories: List[int]
+        Predicted classes of the samples.
+    :param confidences: List[float]
+        Confidences of the predictions.
+    :param oracle: Oracle
+    :param num_classes: int
+    :param sample_method: str
+        A key of SAMPLE_CATEGORY.
+    :param max_in_flight: int
+        The maximum number of queries waiting for a label. Default: MAX_IN_FLIGHT.
+    :param prefetch: int
+        The number of queries selected ahead of time while labels are outstanding. Prefetched queries are selected
+            against a posterior that may miss the labels that arrive before they are sent. Default: PREFETCH.
+    :return: sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices
+        In the order the labels arrived, i.e. the order in which the model was updated.
+    """
+    random.seed(random_seed)
+    dtype = PRECISION_DICT[args.precision]
+
+    if args.metric == 'accuracy':
+        model = BetaBernoulli(num_classes, prior, dtype=dtype)
+    elif args.metric == 'calibration_error':
+        model = ClasswiseEce(num_classes, num_bins=10, pseudocount=args.pseudocount, weight=weight, prior=None,
+                             dtype=dtype)
+
+    deques = [deque() for _ in range(num_classes)]
+    for index, category in enumerate(categories):
+        deques[category].append(index)
+    for _deque in deques:
+        random.shuffle(_deque)
+
+    num_samples = len(categories)
+    sampled_categories = np.zeros((num_samples,), dtype=np.int)
+    sampled_observations = np.zeros((num_samples,), dtype=np.int)
+    sampled_scores = np.zeros((num_samples,), dtype=dtype)
+    sampled_labels = np.zeros((num_samples,), dtype=np.int)
+    sampled_indices = np.zeros((num_samples,), dtype=np.int)
+
+    sample_fct = SAMPLE_CATEGORY[sample_method]
+    topk = args.topk
+    num_selected = 0
+    selected = deque()  # (category, index) of queries selected but not sent yet
+    pending = {}  # labeling task -> (category, index)
+
+    def select() -> int:
+        nonlocal topk
+        categories_list = sample_fct(deques=deques,
+                                     random_seed=random_seed,
+                                     model=model,
+                                     mode=args.mode,
+                                     topk=topk,
+                                     max_ttts_trial=50,
+                                     ttts_beta=0.5,
+                                     epsilon=0.1,
+                                     ucb_c=1)
+        if type(categories_list) != list:
+            categories_list = [categories_list]
+            topk = 1
+        for category in categories_list:
+            selected.append((category, deques[category].pop()))
+        return len(categories_list)
+
+    idx = 0
+    while idx < num_samples:
+        # fill free slots
+        while len(pending) < max_in_flight and (selected or num_selected < num_samples):
+            if not selected:
+                num_selected += select()
+            category, index = selected.popleft()
+            pending[asyncio.ensure_future(oracle.label(index))] = (category, index)
+
+        # select the next queries while labels are outstanding
+        while len(selected) < prefetch and num_selected < num_samples:
+            num_selected += select()
+
+        done, _ = await asyncio.wait(list(pending), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            category, index = pending.pop(task)
+            label = task.result()
+            observation = label == category
+            if args.metric == 'accuracy':
+                model.update(category, observation)
+            elif args.metric == 'calibration_error':
+                model.update(category, observation, confidences[index])
+
+            sampled_categories[idx] = category
+            sampled_observations[idx] = observation
+            sampled_scores[idx] = confidences[index]
+            sampled_labels[idx] = label
+            sampled_indices[idx] = index
+            idx += 1
+
+    return sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices
+
+
+def main(args: argparse.Namespace) -> None:
+    args.metric = 'accuracy'
+    args.precision = PRECISION
+    num_classes = NUM_CLASSES_DICT[args.dataset]
+    categories, observations, confidences, labels, indices = PredictionSet.from_file(
+        DATAFILE_LIST[args.dataset]).astuple()
+    num_samples = len(observations)
+    num_checkpoints = get_checkpoint_schedule(args, LOG_FREQ).num_checkpoints(num_samples)
+    ground_truth = get_ground_truth(categories, observations, confidences, num_classes, args.metric, args.mode,
+                                    topk=args.topk)
+    prior = np.ones((num_classes, 2)) / 2 * args.pseudocount
+
+    avg_num_agreement = np.zeros((args.num_runs, num_checkpoints))
+    mrr = np.zeros((args.num_runs, num_checkpoints))
+    for r in range(args.num_runs):
+        np.random.seed(r)
+        oracle = FakeOracle(labels, latency=args.latency, min_latency=args.min_latency, random_seed=r)
+        start = time.perf_counter()
+        sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices = asyncio.run(
+            assess(args, categories, confidences, oracle, num_classes, args.sample_method, prior=prior,
+                   max_in_flight=args.max_in_flight, prefetch=args.prefetch, random_seed=r))
+        logger.info('Run %d :: %d labels in %.1f s, at most %d in flight', r, oracle.num_queries,
+                    time.perf_counter() - start, oracle.max_num_in_flight)
+        avg_num_agreement[r], mrr[r] = evaluate(args, sampled_categories, sampled_observations, sampled_scores,
+                                                sampled_labels, sampled_indices, ground_truth, num_classes,
+                                                prior=prior)
+
+    logger.info('%s :: area under agreement curve %.4f, mrr curve %.4f', args.dataset,
+                avg_num_agreement.mean(axis=0).mean(), mrr.mean(axis=0).mean())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dataset', type=str, default='cifar100', help='input dataset')
+    parser.add_argument('-topk', type=int, default=1, help='number of optimal arms to identify')
+    parser.add_argument('-pseudocount', type=float, default=PRIOR_STRENGTH, help='strength of prior')
+    parser.add_argument('-mode', type=str, default='min', help='min or max, identify topk with highest/lowest reward')
+    parser.add_argument('--sample_method', type=str, default='ts', help='sampling method, a key of SAMPLE_CATEGORY')
+    parser.add_argument('--max_in_flight', type=int, default=MAX_IN_FLIGHT,
+                        help='maximum number of queries waiting for a label')
+    parser.add_argument('--prefetch', type=int, default=PREFETCH,
+                        help='number of queries selected ahead of time while labels are outstanding')
+    parser.add_argument('--latency', type=float, default=LATENCY, help='mean random labeling delay in seconds')
+    parser.add_argument('--min_latency', type=float, default=0., help='minimum labeling delay in seconds')
+    parser.add_argument('--num_runs', type=int, default=NUM_RUNS, help='number of runs')
+
+    add_checkpoint_arguments(parser)
+
+    args, _ = parser.parse_known_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.dataset not in DATASET_LIST:
+        raise ValueError("%s is not in DATASET_LIST." % args.dataset)
+
+    main(args)
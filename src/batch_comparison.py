@@ -0,0 +1,80 @@
+import argparse
+import logging
+import os
+import time
+
+from utils import *
+
+NUM_RUNS = 10
+BATCH_SIZES = [1, 10, 50, 100, 500]
+OUTPUT_DIR = RESULTS_DIR + "batch_comparison/"
+
+logger = logging.getLogger(__name__)
+
+
+def main(args: argparse.Namespace) -> None:
+    args.metric = 'accuracy'
+    args.precision = PRECISION
+    num_classes = NUM_CLASSES_DICT[args.dataset]
+    categories, observations, confidences, labels, indices = PredictionSet.from_file(
+        DATAFILE_LIST[args.dataset]).astuple()
+    num_samples = len(observations)
+    num_checkpoints = get_checkpoint_schedule(args, LOG_FREQ).num_checkpoints(num_samples)
+    ground_truth = get_ground_truth(categories, observations, confidences, num_classes, args.metric, args.mode,
+                                    topk=args.topk)
+    prior = np.ones((num_classes, 2)) / 2 * args.pseudocount
+
+    try:
+        os.stat(args.output)
+    except:
+        os.mkdir(args.output)
+
+    curves = {}
+    for batch_size in args.batch_sizes:
+        avg_num_agreement = np.zeros((args.num_runs, num_checkpoints))
+        mrr = np.zeros((args.num_runs, num_checkpoints))
+        elapsed = 0
+        for r in range(args.num_runs):
+            np.random.seed(r)
+            start = time.perf_counter()
+            sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices = \
+                get_samples_topk(args, categories, observations, confidences, labels, indices, num_classes,
+                                 num_samples, sample_method=args.sample_method, prior=prior, random_seed=r,
+                                 batch_size=batch_size)
+            elapsed += time.perf_counter() - start
+            avg_num_agreement[r], mrr[r] = evaluate(args, sampled_categories, sampled_observations, sampled_scores,
+                                                    sampled_labels, sampled_indices, ground_truth, num_classes,
+                                                    prior=prior)
+        curves[batch_size] = (avg_num_agreement.mean(axis=0), mrr.mean(axis=0))
+        logger.info('%s :: batch size %d :: %.3f s per run :: area under agreement curve %.4f, mrr curve %.4f',
+                    args.dataset, batch_size, elapsed / args.num_runs, curves[batch_size][0].mean(),
+                    curves[batch_size][1].mean())
+
+    for metric_idx, metric in enumerate(['avg_num_agreement', 'mrr']):
+        filename = args.output + "%s_%s_top%d_%s_%s.csv" % (args.dataset, args.mode, args.topk, args.sample_method,
+                                                            metric)
+        np.savetxt(filename, np.array([curves[batch_size][metric_idx] for batch_size in args.batch_sizes]).T,
+                   delimiter=',', header=', '.join('batch%d' % batch_size for batch_size in args.batch_sizes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dataset', type=str, default='cifar100', help='input dataset')
+    parser.add_argument('--output', type=str, default=OUTPUT_DIR, help='output prefix')
+    parser.add_argument('-topk', type=int, default=1, help='number of optimal arms to identify')
+    parser.add_argument('-pseudocount', type=float, default=PRIOR_STRENGTH, help='strength of prior')
+    parser.add_argument('-mode', type=str, default='min', help='min or max, identify topk with highest/lowest reward')
+    parser.add_argument('--sample_method', type=str, default='ts', help='sampling method, a key of SAMPLE_CATEGORY')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=BATCH_SIZES,
+                        help='batch sizes to compare, 1 is the sequential mode')
+    parser.add_argument('--num_runs', type=int, default=NUM_RUNS, help='number of runs per batch size')
+
+    add_checkpoint_arguments(parser)
+
+    args, _ = parser.parse_known_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.dataset not in DATASET_LIST:
+        raise ValueError("%s is not in DATASET_LIST." % args.dataset)
+
+    main(args)
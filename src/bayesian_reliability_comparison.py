@@ -5,7 +5,7 @@ import random
 
 import numpy as np
 
-from data_utils import DATAFILE_LIST, DATASET_LIST, prepare_data, RESULTS_DIR
+from data_utils import DATAFILE_LIST, DATASET_LIST, get_budget, prepare_data, RESULTS_DIR
 from models import SumOfBetaEce
 
 random.seed(2020)
@@ -28,7 +28,14 @@ def main(args) -> None:
         ground_truth_model = SumOfBetaEce(num_bins=args.num_bins, pseudocount=1e-3)
     ground_truth_model.update_batch(confidences, observations)
 
-    results = np.zeros((args.num_runs, len(N_list), 5))
+    # sample sizes evaluated in each run, the last one is the budget
+    if args.budget is None:
+        n_list = N_list
+    else:
+        budget = get_budget(args.budget, len(observations))
+        n_list = [n for n in N_list if n < budget] + [budget]
+
+    results = np.zeros((args.num_runs, len(n_list), 5))
 
     for run_id in range(args.num_runs):
 
@@ -38,11 +45,11 @@ def main(args) -> None:
 
         model = SumOfBetaEce(num_bins=args.num_bins, pseudocount=args.pseudocount)
 
-        for i in range(len(N_list)):
-            tmp = 0 if i == 0 else N_list[i - 1]
-            model.update_batch(confidences[tmp: N_list[i]], observations[tmp: N_list[i]])
+        for i in range(len(n_list)):
+            tmp = 0 if i == 0 else n_list[i - 1]
+            model.update_batch(confidences[tmp: n_list[i]], observations[tmp: n_list[i]])
 
-            results[run_id, i, 0] = N_list[i]
+            results[run_id, i, 0] = n_list[i]
             results[run_id, i, 1] = model.eval
             results[run_id, i, 2] = model.frequentist_eval
             results[run_id, i, 3] = model.calibration_estimation_error(ground_truth_model, args.weight_type)
@@ -51,21 +58,25 @@ def main(args) -> None:
     results_mean = np.mean(results, axis=0)
     results_variance = np.std(results, axis=0)
 
+    output_dir = OUTPUT_DIR
     if args.weight_type == 'online':
-        OUTPUT_DIR += "online_weights/"
+        output_dir += "online_weights/"
     try:
-        os.stat(OUTPUT_DIR)
+        os.stat(output_dir)
     except:
-        os.mkdir(OUTPUT_DIR)
+        os.mkdir(output_dir)
 
+    budget_suffix = '' if args.budget is None else '_budget%g' % args.budget
     if args.ground_truth_type == 'frequentist':
-        filename_mean = OUTPUT_DIR + "frequentist_ground_truth_%s_pseudocount%d.csv" % (args.dataset, args.pseudocount)
-        filename_std = OUTPUT_DIR + "frequentist_ground_truth_%s_pseudocount%d_std.csv" % (
-            args.dataset, args.pseudocount)
+        filename_mean = output_dir + "frequentist_ground_truth_%s_pseudocount%d%s.csv" % (
+            args.dataset, args.pseudocount, budget_suffix)
+        filename_std = output_dir + "frequentist_ground_truth_%s_pseudocount%d%s_std.csv" % (
+            args.dataset, args.pseudocount, budget_suffix)
     else:
-        filename_mean = OUTPUT_DIR + "bayesian_ground_truth_%s_pseudocount%d.csv" % (args.dataset, args.pseudocount)
-        filename_std = OUTPUT_DIR + "bayesian_ground_truth_%s_pseudocount%d_std.csv" % (
-            args.dataset, args.pseudocount)
+        filename_mean = output_dir + "bayesian_ground_truth_%s_pseudocount%d%s.csv" % (
+            args.dataset, args.pseudocount, budget_suffix)
+        filename_std = output_dir + "bayesian_ground_truth_%s_pseudocount%d%s_std.csv" % (
+            args.dataset, args.pseudocount, budget_suffix)
 
     header = 'N, bayesian_ece, frequentist_ece, bayesian_estimation_error, frequentist_estimation_error'
     np.savetxt(filename_mean, results_mean, delimiter=',', header=header)
@@ -83,6 +94,9 @@ if __name__ == "__main__":
                         help='weigh each bin with all data or only data seen so far, online or pool')
     parser.add_argument('--num_runs', type=int, default=NUM_RUNS, help='number of runs')
     parser.add_argument('--num_bins', type=int, default=NUM_BINS, help='number of bins in reliability diagram')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='number of samples labeled per run, or a fraction of the dataset if at most 1. '
+                             'Default: the sample sizes in N_list')
 
     args, _ = parser.parse_known_args()
 
@@ -0,0 +1,105 @@
+import argparse
+import logging
+import os
+import time
+
+from utils import *
+
+NUM_RUNS = 10
+NUM_TIMING_REPEATS = 1000
+OUTPUT_DIR = RESULTS_DIR + "beta_sampler_benchmark/"
+
+logger = logging.getLogger(__name__)
+
+
+def time_sampler(model: BetaBernoulli, num_repeats: int) -> float:
+    """
+    Average wall time of drawing one posterior sample.
+    :param model: BetaBernoulli
+    :param num_repeats: int
+    :return: float, seconds per call of model.sample().
+    """
+    start = time.perf_counter()
+    for _ in range(num_repeats):
+        model.sample()
+    return (time.perf_counter() - start) / num_repeats
+
+
+def main(args: argparse.Namespace) -> None:
+    args.metric = 'accuracy'
+    args.precision = PRECISION
+    rows = []
+
+    for dataset in args.datasets:
+        num_classes = NUM_CLASSES_DICT[dataset]
+        categories, observations, confidences, labels, indices = PredictionSet.from_file(
+            DATAFILE_LIST[dataset]).astuple()
+        num_samples = len(observations)
+        num_checkpoints = get_checkpoint_schedule(args, LOG_FREQ).num_checkpoints(num_samples)
+        prior = np.ones((num_classes, 2)) / 2 * args.pseudocount
+        ground_truth = get_ground_truth(categories, observations, confidences, num_classes, args.metric, args.mode,
+                                        topk=args.topk)
+
+        # Per-call cost of sampling from the posterior fitted on the whole dataset, where most arms are past threshold.
+        timings = {}
+        for sampler in BETA_SAMPLERS:
+            model = BetaBernoulli(num_classes, prior, sampler=sampler, sampler_threshold=args.threshold)
+            model.update_batch(categories, observations)
+            timings[sampler] = time_sampler(model, args.num_repeats)
+
+        # Top-k identification of Thompson sampling, with the same seeds for both samplers.
+        curves = {}
+        run_times = {}
+        for sampler in BETA_SAMPLERS:
+            avg_num_agreement = np.zeros((args.num_runs, num_checkpoints))
+            mrr = np.zeros((args.num_runs, num_checkpoints))
+            start = time.perf_counter()
+            for r in range(args.num_runs):
+                np.random.seed(r)
+                sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices = \
+                    get_samples_topk(args, categories, observations, confidences, labels, indices, num_classes,
+                                     num_samples, sample_method='ts', prior=prior, random_seed=r, sampler=sampler,
+                                     sampler_threshold=args.threshold)
+                avg_num_agreement[r], mrr[r] = evaluate(args, sampled_categories, sampled_observations,
+                                                        sampled_scores, sampled_labels, sampled_indices,
+                                                        ground_truth, num_classes, prior=prior)
+            run_times[sampler] = (time.perf_counter() - start) / args.num_runs
+            curves[sampler] = (avg_num_agreement.mean(axis=0), mrr.mean(axis=0))
+
+        agreement_diff = np.max(np.abs(curves['normal'][0] - curves['exact'][0]))
+        mrr_diff = np.max(np.abs(curves['normal'][1] - curves['exact'][1]))
+        logger.info('%s :: sample() exact %.2e s, normal %.2e s :: run exact %.2f s, normal %.2f s :: '
+                    'max abs difference agreement %.4f, mrr %.4f', dataset, timings['exact'], timings['normal'],
+                    run_times['exact'], run_times['normal'], agreement_diff, mrr_diff)
+        rows.append([num_classes, timings['exact'], timings['normal'], run_times['exact'], run_times['normal'],
+                     agreement_diff, mrr_diff])
+
+    try:
+        os.stat(args.output)
+    except:
+        os.mkdir(args.output)
+
+    filename = args.output + "%s_top%d_threshold%d.csv" % (args.mode, args.topk, args.threshold)
+    header = 'num_classes, sample_time_exact, sample_time_normal, run_time_exact, run_time_normal, ' \
+             'max_abs_diff_agreement, max_abs_diff_mrr'
+    np.savetxt(filename, np.array(rows), delimiter=',', header='datasets: %s\n%s' % (' '.join(args.datasets), header))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--datasets', type=str, nargs='+', default=list(DATASET_NAMES), help='input datasets')
+    parser.add_argument('--output', type=str, default=OUTPUT_DIR, help='output prefix')
+    parser.add_argument('-topk', type=int, default=1, help='number of optimal arms to identify')
+    parser.add_argument('-pseudocount', type=float, default=2, help='strength of prior')
+    parser.add_argument('-mode', type=str, default='min', help='min or max, identify topk with highest/lowest reward')
+    parser.add_argument('--threshold', type=float, default=NORMAL_APPROXIMATION_THRESHOLD,
+                        help='minimum alpha + beta for the normal sampler to approximate a Beta posterior')
+    parser.add_argument('--num_runs', type=int, default=NUM_RUNS, help='number of sampling runs per sampler')
+    parser.add_argument('--num_repeats', type=int, default=NUM_TIMING_REPEATS, help='number of timed sample() calls')
+
+    add_checkpoint_arguments(parser)
+
+    args, _ = parser.parse_known_args()
+    logging.basicConfig(level=logging.INFO)
+
+    main(args)
@@ -0,0 +1,198 @@
+"""
+Checkpoint schedules for evaluation. A schedule decides after which labeled samples the model is evaluated, so the
+number of evaluations, and the length of every result array, is the number of checkpoints the schedule yields.
+A checkpoint at sample index idx is evaluated once samples 0, ..., idx have been labeled.
+"""
+import argparse
+from typing import List
+
+import numpy as np
+
+NUM_CHECKPOINTS = 50
+# arguments added by add_checkpoint_arguments
+CHECKPOINT_ARGS = ['checkpoints', 'checkpoint_freq', 'num_checkpoints', 'checkpoint_list', 'checkpoint_budget']
+
+
+class CheckpointSchedule:
+    """
+    Abstract base class to be inhereted by all checkpoint schedules.
+    Derived classes must implement an indices method.
+    """
+    name = None
+
+    def indices(self, num_samples: int) -> np.ndarray:
+        """
+        Sample indices after which the model is evaluated.
+        :param num_samples: int
+            The number of samples labeled in a run.
+        :return: np.ndarray
+            Sorted unique integer indices in [0, num_samples).
+        """
+        raise NotImplementedError
+
+    def num_checkpoints(self, num_samples: int) -> int:
+        """
+        Length of the result arrays of a run of num_samples samples.
+        """
+        return len(self.indices(num_samples))
+
+    def slots(self, num_samples: int) -> dict:
+        """
+        Maps the sample index of every checkpoint to its position in the result arrays.
+        """
+        return {idx: slot for slot, idx in enumerate(self.indices(num_samples).tolist())}
+
+
+class FixedSchedule(CheckpointSchedule):
+    """
+    Evaluate every freq samples, starting at sample start.
+    """
+    name = 'fixed'
+
+    def __init__(self, freq: int, start: int = 0):
+        """
+        :param freq: int
+            Number of samples between checkpoints.
+        :param start: int
+            Index of the first checkpoint. Default: 0, i.e. the prior is evaluated after the first label.
+        """
+        self.freq = freq
+        self.start = start
+
+    def indices(self, num_samples: int) -> np.ndarray:
+        return np.arange(self.start, num_samples, self.freq)
+
+
+class GeometricSchedule(CheckpointSchedule):
+    """
+    Log-spaced checkpoints, dense at the start of a run where the estimates change the most. Rounding to integer
+        indices merges checkpoints that fall on the same sample, so runs may have fewer than num_checkpoints.
+    """
+    name = 'geometric'
+
+    def __init__(self, num_checkpoints: int = NUM_CHECKPOINTS):
+        """
+        :param num_checkpoints: int
+            The maximum number of checkpoints. The first and last samples are always checkpoints.
+                Default: NUM_CHECKPOINTS.
+        """
+        self.num = num_checkpoints
+
+    def indices(self, num_samples: int) -> np.ndarray:
+        if num_samples < 1:
+            return np.zeros((0,), dtype=int)
+        return np.unique(np.round(np.geomspace(1, num_samples, self.num)).astype(int) - 1)
+
+
+class ExplicitSchedule(CheckpointSchedule):
+    """
+    Checkpoints at a given list of sample indices. Indices past the end of a run are dropped.
+    """
+    name = 'explicit'
+
+    def __init__(self, checkpoints: List[int]):
+        """
+        :param checkpoints: List[int]
+            Sample indices of the checkpoints.
+        """
+        self.checkpoints = np.unique(np.asarray(checkpoints, dtype=int))
+        if len(self.checkpoints) and self.checkpoints[0] < 0:
+            raise ValueError("%d is not a valid checkpoint index." % self.checkpoints[0])
+
+    def indices(self, num_samples: int) -> np.ndarray:
+        return self.checkpoints[self.checkpoints < num_samples]
+
+
+class BudgetCapped(CheckpointSchedule):
+    """
+    Restrict another schedule to the first fraction of each run. Plots only show the start of a run, so
+        checkpoints past the budget would be evaluated and never looked at.
+    """
+
+    def __init__(self, schedule: CheckpointSchedule, fraction: float):
+        """
+        :param schedule: CheckpointSchedule
+        :param fraction: float between 0 and 1
+            Fraction of the run that is evaluated.
+        """
+        if not 0 < fraction <= 1:
+            raise ValueError("%s is not a fraction in (0, 1]." % fraction)
+        self.schedule = schedule
+        self.fraction = fraction
+        self.name = schedule.name
+
+    def indices(self, num_samples: int) -> np.ndarray:
+        indices = self.schedule.indices(num_samples)
+        return indices[indices < int(np.ceil(num_samples * self.fraction))]
+
+
+class EndOfRun(CheckpointSchedule):
+    """
+    Extend another schedule by a checkpoint at the last sample of each run. Runs that stop at the last checkpoint,
+        like the cost simulations, then label their whole budget and log its final estimate.
+    """
+
+    def __init__(self, schedule: CheckpointSchedule):
+        """
+        :param schedule: CheckpointSchedule
+        """
+        self.schedule = schedule
+        self.name = schedule.name
+
+    def indices(self, num_samples: int) -> np.ndarray:
+        indices = self.schedule.indices(num_samples)
+        if num_samples < 1 or (len(indices) and indices[-1] == num_samples - 1):
+            return indices
+        return np.append(indices, num_samples - 1)
+
+
+CHECKPOINT_SCHEDULES = {
+    'fixed': FixedSchedule,
+    'geometric': GeometricSchedule,
+    'explicit': ExplicitSchedule,
+}
+
+
+def get_checkpoint_schedule(args: argparse.Namespace, freq: int, start: int = 0) -> CheckpointSchedule:
+    """
+    Build the checkpoint schedule requested on the command line. Scripts without the checkpoint arguments evaluate
+        every freq samples.
+    :param args: argparse.Namespace
+    :param freq: int
+        Number of samples between checkpoints of the fixed schedule, unless overridden by --checkpoint_freq.
+    :param start: int
+        Index of the first checkpoint of the fixed schedule. Default: 0.
+    :return: CheckpointSchedule
+    """
+    name = getattr(args, 'checkpoints', 'fixed')
+    if name == 'fixed':
+        schedule = FixedSchedule(getattr(args, 'checkpoint_freq', None) or freq, start=start)
+    elif name == 'geometric':
+        schedule = GeometricSchedule(args.num_checkpoints)
+    elif name == 'explicit':
+        if not getattr(args, 'checkpoint_list', None):
+            raise ValueError("The explicit checkpoint schedule requires --checkpoint_list.")
+        schedule = ExplicitSchedule(args.checkpoint_list)
+    else:
+        raise ValueError("%s is not an implemented checkpoint schedule." % name)
+
+    budget = getattr(args, 'checkpoint_budget', None)
+    if budget is not None:
+        schedule = BudgetCapped(schedule, budget)
+    return schedule
+
+
+def add_checkpoint_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the arguments read by get_checkpoint_schedule to a driver's parser.
+    """
+    parser.add_argument('--checkpoints', type=str, default='fixed', choices=list(CHECKPOINT_SCHEDULES),
+                        help='checkpoint schedule, after which labeled samples the model is evaluated')
+    parser.add_argument('--checkpoint_freq', type=int, default=None,
+                        help='samples between checkpoints of the fixed schedule, defaults to the log frequency')
+    parser.add_argument('--num_checkpoints', type=int, default=NUM_CHECKPOINTS,
+                        help='maximum number of checkpoints of the geometric schedule')
+    parser.add_argument('--checkpoint_list', type=int, nargs='+', default=None,
+                        help='sample indices of the explicit schedule')
+    parser.add_argument('--checkpoint_budget', type=float, default=None,
+                        help='only evaluate checkpoints within this fraction of each run')
@@ -185,13 +185,242 @@ def prepare_data(filename, four_column=False) -> Tuple[
     return categories, observations, confidences, idx2category, category2idx, labels
 
 
+class PredictionSet:
+    """
+    Predictions of a classifier on a dataset, stored as a structure of arrays. Indexing with a slice returns a view
+        that shares memory with the original set, indexing with an array of positions gathers a copy. Logits are only
+        read from disk when they are first accessed, and the loaded matrix is shared by all sets derived from the same
+        dataset.
+    """
+
+    def __init__(self,
+                 categories: np.ndarray,
+                 observations: np.ndarray,
+                 confidences: np.ndarray,
+                 labels: np.ndarray,
+                 indices: np.ndarray = None,
+                 logits_path: str = None,
+                 dtype=np.float64,
+                 _logits_cache: dict = None):
+        """
+        :param categories: np.ndarray (num_samples, )
+            Predicted classes.
+        :param observations: np.ndarray (num_samples, )
+            Whether the predicted class is the same as the true class.
+        :param confidences: np.ndarray (num_samples, )
+            Scores of the predicted classes.
+        :param labels: np.ndarray (num_samples, )
+            True classes.
+        :param indices: np.ndarray (num_samples, )
+            Indices of the samples in the raw file. Default: np.arange(num_samples).
+        :param logits_path: str
+            File with the logits of all samples in the raw file, e.g. an entry of LOGITSFILE_DICT. Default: None.
+        :param dtype: np.float32 or np.float64
+            Floating point type of confidences. Default: np.float64.
+        """
+        self.categories = np.asarray(categories, dtype=np.int32)
+        self.observations = np.asarray(observations, dtype=np.bool_)
+        self.confidences = np.asarray(confidences, dtype=dtype)
+        self.labels = np.asarray(labels, dtype=np.int32)
+        if indices is None:
+            indices = np.arange(len(self.categories))
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.logits_path = logits_path
+        self._logits_cache = {} if _logits_cache is None else _logits_cache
+
+    @classmethod
+    def from_file(cls, filename: str, logits_path: str = None, dtype=np.float64) -> 'PredictionSet':
+        """
+        Load predictions from a file with the true label followed by a vector of scores for each class in every row.
+        :param filename: str
+            An entry of DATAFILE_LIST.
+        :param logits_path: str
+            Default: None.
+        :param dtype: np.float32 or np.float64
+            Default: np.float64.
+        :return: PredictionSet
+        """
+        data = np.genfromtxt(filename)
+        categories = np.argmax(data[:, 1:], axis=1)
+        observations = categories == data[:, 0]
+        logger.debug("Dataset Accuracy: %.3f" % observations.mean())
+        return cls(categories, observations, np.max(data[:, 1:], axis=1), data[:, 0], logits_path=logits_path,
+                   dtype=dtype)
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def __getitem__(self, key) -> 'PredictionSet':
+        return PredictionSet(self.categories[key], self.observations[key], self.confidences[key], self.labels[key],
+                             self.indices[key], logits_path=self.logits_path, dtype=self.confidences.dtype,
+                             _logits_cache=self._logits_cache)
+
+    def prefix(self, num_samples: int) -> 'PredictionSet':
+        """
+        A view of the first num_samples samples.
+        :param num_samples: int
+        :return: PredictionSet
+        """
+        return self[:num_samples]
+
+    @property
+    def logits(self) -> np.ndarray:
+        """
+        Logits of the samples in the set, read from logits_path on first access.
+        :return: An (num_samples, num_classes) array, or None if the dataset has no logits file.
+        """
+        if self.logits_path is None:
+            return None
+        if 'logits' not in self._logits_cache:
+            self._logits_cache['logits'] = np.genfromtxt(self.logits_path)[:, 1:]
+        return self._logits_cache['logits'][self.indices]
+
+    def astuple(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: categories, observations, confidences, labels, indices
+        """
+        return self.categories, self.observations, self.confidences, self.labels, self.indices
+
+    def split(self, holdout_ratio: float = 0.2, stratify: bool = False,
+              random_state: np.random.RandomState = None) -> Tuple['PredictionSet', 'PredictionSet']:
+        """
+        Split into train and holdout with holdout_ratio. Both parts keep the order of the samples in the set. The
+            samples are gathered once, train and holdout are views of the gathered arrays.
+        :param holdout_ratio: float between 0 and 1. Default: 0.2.
+        :param stratify: bool
+            Hold out the same fraction of every predicted class. Default: False.
+        :param random_state: np.random.RandomState
+            Default: None, i.e. the global numpy random state.
+        :return: train, holdout
+        """
+        train_idx, holdout_idx = holdout_split_indices(len(self), holdout_ratio,
+                                                       categories=self.categories if stratify else None,
+                                                       random_state=random_state)
+        gathered = self[np.concatenate((train_idx, holdout_idx))]
+        return gathered[:len(train_idx)], gathered[len(train_idx):]
+
+
+def _split_order(num_samples: int, categories: np.ndarray, random_state) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Random order of the samples, grouped by predicted class if categories are given.
+    :return: order: (num_samples, ) array of sample indices.
+             rank: (num_samples, ) position of every entry of order within its class, or within all samples.
+    """
+    if random_state is None:
+        random_state = np.random
+    permutation = random_state.permutation(num_samples)
+    if categories is None:
+        return permutation, np.arange(num_samples)
+
+    categories = np.asarray(categories)
+    order = permutation[np.argsort(categories[permutation], kind='stable')]
+    counts = np.bincount(categories)
+    rank = np.arange(num_samples) - np.repeat(np.cumsum(counts) - counts, counts)
+    return order, rank
+
+
+def holdout_split_indices(num_samples: int,
+                          holdout_ratio: float = 0.2,
+                          categories: np.ndarray = None,
+                          random_state: np.random.RandomState = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Split the samples of a dataset into train and holdout. The returned indices can be applied to any array of the
+        dataset, or to a PredictionSet, by fancy indexing.
+    :param num_samples: int
+    :param holdout_ratio: float between 0 and 1. Default: 0.2.
+    :param categories: np.ndarray (num_samples, )
+        Predicted classes. If given, round(holdout_ratio * n) samples of every class with n samples are held out.
+        Default: None.
+    :param random_state: np.random.RandomState
+        Default: None, i.e. the global numpy random state.
+    :return: train_idx, holdout_idx
+        Sorted integer index arrays.
+    """
+    order, rank = _split_order(num_samples, categories, random_state)
+    if categories is None:
+        holdout = rank < int(num_samples * holdout_ratio)
+    else:
+        counts = np.bincount(np.asarray(categories))
+        holdout = rank < np.round(counts * holdout_ratio)[np.asarray(categories)[order]]
+
+    mask = indices_to_mask(order[holdout], num_samples)
+    return np.flatnonzero(~mask), np.flatnonzero(mask)
+
+
+def kfold_split_indices(num_samples: int,
+                        num_folds: int = 5,
+                        categories: np.ndarray = None,
+                        random_state: np.random.RandomState = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Split the samples of a dataset into num_folds folds, each of which is held out once.
+    :param num_samples: int
+    :param num_folds: int
+        Default: 5.
+    :param categories: np.ndarray (num_samples, )
+        Predicted classes. If given, the samples of every class are spread evenly over the folds. Default: None.
+    :param random_state: np.random.RandomState
+        Default: None, i.e. the global numpy random state.
+    :return: A list of num_folds (train_idx, holdout_idx) pairs of sorted integer index arrays.
+    """
+    order, _ = _split_order(num_samples, categories, random_state)
+    fold = np.empty(num_samples, dtype=int)
+    fold[order] = np.arange(num_samples) % num_folds
+    return [(np.flatnonzero(fold != i), np.flatnonzero(fold == i)) for i in range(num_folds)]
+
+
+def repeated_holdout_split_indices(num_samples: int,
+                                   holdout_ratio: float = 0.2,
+                                   num_repeats: int = 10,
+                                   categories: np.ndarray = None,
+                                   random_state: np.random.RandomState = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Independent holdout splits of the same dataset, e.g. to check the robustness of a result to the split.
+    :param num_repeats: int
+        Default: 10.
+    :return: A list of num_repeats (train_idx, holdout_idx) pairs, see holdout_split_indices.
+    """
+    return [holdout_split_indices(num_samples, holdout_ratio, categories, random_state) for _ in range(num_repeats)]
+
+
+def indices_to_mask(indices: np.ndarray, num_samples: int) -> np.ndarray:
+    """
+    :param indices: np.ndarray
+        Integer indices, e.g. holdout_idx of a split.
+    :param num_samples: int
+    :return: (num_samples, ) boolean mask that is True at indices.
+    """
+    mask = np.zeros(num_samples, dtype=np.bool_)
+    mask[indices] = True
+    return mask
+
+
+def get_budget(budget: float, num_samples: int) -> int:
+    """
+    Number of samples labeled in a run under a labeling budget.
+    :param budget: float
+        Values up to 1 are a fraction of the samples, larger values an absolute number of samples. None labels all
+            samples.
+    :param num_samples: int
+        Size of the pool samples are labeled from.
+    :return: int
+    """
+    if budget is None:
+        return num_samples
+    if budget <= 0:
+        raise ValueError("%s is not a positive budget." % budget)
+    if budget <= 1:
+        return int(np.ceil(budget * num_samples))
+    return min(int(budget), num_samples)
+
+
 def train_holdout_split(categories: List[int],
                         observations: List[bool],
                         confidences: List[float],
                         labels: List[int],
                         indices: List[int],
                         holdout_ratio: float = 0.2) -> Tuple[
-    List[int], List[bool], List[float], List[int], List[int], List[int], List[bool], List[float], List[int], List[int]]:
+    np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray,
+    np.ndarray]:
     """
     Split categories, observations and confidences into train and holdout with hold_ratio.
     :param categories: List[int], predicted class
@@ -200,28 +429,10 @@ def train_holdout_split(categories: List[int],
     :param labels: List[int], true label fo samples.
     :param indices: List[int], index of data in the raw file
     :param holdout_ratio: float between 0 and 1. Default: 0.2.
-    :return: train and eval partion of inputs.
+    :return: train and eval partion of inputs, as arrays.
     """
-    num_samples = len(categories)
-
-    permutation = np.random.permutation(num_samples)
-    mask = np.zeros(num_samples)
-    mask[permutation[:int(len(categories) * holdout_ratio)]] = 1
-
-    train_categories = [categories[idx] for idx in range(num_samples) if mask[idx] == 0]
-    train_observations = [observations[idx] for idx in range(num_samples) if mask[idx] == 0]
-    train_confidences = [confidences[idx] for idx in range(num_samples) if mask[idx] == 0]
-    train_labels = [labels[idx] for idx in range(num_samples) if mask[idx] == 0]
-    train_indices = [indices[idx] for idx in range(num_samples) if mask[idx] == 0]
-
-    holdout_categories = [categories[idx] for idx in range(num_samples) if mask[idx] == 1]
-    holdout_observations = [observations[idx] for idx in range(num_samples) if mask[idx] == 1]
-    holdout_confidences = [confidences[idx] for idx in range(num_samples) if mask[idx] == 1]
-    holdout_labels = [labels[idx] for idx in range(num_samples) if mask[idx] == 1]
-    holdout_indices = [indices[idx] for idx in range(num_samples) if mask[idx] == 1]
-
-    return train_categories, train_observations, train_confidences, train_labels, train_indices, holdout_categories, \
-           holdout_observations, holdout_confidences, holdout_labels, holdout_indices
+    train, holdout = PredictionSet(categories, observations, confidences, labels, indices).split(holdout_ratio)
+    return train.astuple() + holdout.astuple()
 
 
 def eval_ece(confidences: List[float], observations: List[bool], num_bins=10):
@@ -235,23 +446,38 @@ def eval_ece(confidences: List[float], observations: List[bool], num_bins=10):
         The number of bins used to estimate ECE. Default: 10
     :return: float
     """
-    confidences = np.array(confidences)
-    observations = np.array(observations) * 1.0
+    return batch_eval_ece(np.array(confidences), np.array(observations), num_bins)[()]
+
+
+def batch_eval_ece(confidences: np.ndarray, observations: np.ndarray, num_bins=10) -> np.ndarray:
+    """
+    Evaluate ECE of many sets of prediction scores of the same samples with equal-width binning, e.g. the recalibrated
+        holdout confidences at every checkpoint. All bins of all sets are counted with a single bincount.
+    :param confidences: np.ndarray (..., num_samples)
+        Prediction scores, one set per leading index.
+    :param observations: np.ndarray (num_samples, ) or (..., num_samples)
+        Boolean observations, shared by all sets or one per set.
+    :param num_bins: int
+        The number of bins used to estimate ECE. Default: 10
+    :return: An array of shape confidences.shape[:-1].
+    """
+    confidences = np.asarray(confidences, dtype=np.float64)
+    observations = np.broadcast_to(np.asarray(observations) * 1.0, confidences.shape)
+    num_samples = confidences.shape[-1]
+    num_sets = int(np.prod(confidences.shape[:-1]))
     bins = np.linspace(0, 1, num_bins + 1)
-    digitized = np.digitize(confidences, bins[1:-1])
-
-    w = np.array([(digitized == i).sum() for i in range(num_bins)])
-    w = w / sum(w)
-
-    with warnings.catch_warnings():
-        warnings.simplefilter('ignore')
-        confidence_bins = np.array([confidences[digitized == i].mean() for i in range(num_bins)])
-        accuracy_bins = np.array([observations[digitized == i].mean() for i in range(num_bins)])
-    confidence_bins[np.isnan(confidence_bins)] = 0
-    accuracy_bins[np.isnan(accuracy_bins)] = 0
-    diff = np.absolute(confidence_bins - accuracy_bins)
-    ece = np.inner(diff, w)
-    return ece
+
+    # bin index of every sample, offset so that every set has its own range of bins
+    digitized = np.digitize(confidences.reshape(num_sets, num_samples), bins[1:-1])
+    digitized += np.arange(num_sets).reshape(-1, 1) * num_bins
+    digitized = digitized.ravel()
+
+    confidence_sums = np.bincount(digitized, weights=confidences.ravel(), minlength=num_sets * num_bins)
+    accuracy_sums = np.bincount(digitized, weights=observations.ravel(), minlength=num_sets * num_bins)
+    diff = np.absolute(confidence_sums - accuracy_sums).reshape(num_sets, num_bins)
+    with np.errstate(invalid='ignore'):
+        ece = diff.sum(axis=-1) / num_samples
+    return ece.reshape(confidences.shape[:-1])
 
 
 def get_confidence_k(categories: List[int], confidences: List[float], num_classes: int) -> np.ndarray:
@@ -0,0 +1,109 @@
+import argparse
+import logging
+import os
+from collections import Counter
+
+from utils import *
+
+NUM_RUNS = 10
+DELTA = 0.05
+OUTPUT_DIR = RESULTS_DIR + "early_stopping/"
+# command line arguments of the parameters of every rule in STOPPING_RULES
+RULE_ARGUMENTS = {
+    'confidence': {'delta': 'delta'},
+    'budget': {'budget': 'label_budget'},
+    'time': {'max_seconds': 'max_time'},
+}
+RULE_CONSTANTS = {
+    'confidence': {'check_freq': LOG_FREQ},
+}
+
+logger = logging.getLogger(__name__)
+
+
+def build_stopping_rule(args: argparse.Namespace) -> StoppingRule:
+    """
+    Combine the stopping rules requested on the command line; labeling stops as soon as one of them fires.
+    :param args: argparse.Namespace
+    :return: StoppingRule
+    """
+    rules = []
+    for name in args.stopping_rules:
+        if name not in STOPPING_RULES:
+            raise ValueError("%s is not an implemented stopping rule." % name)
+        kwargs = dict(RULE_CONSTANTS.get(name, {}))
+        for param, arg in RULE_ARGUMENTS[name].items():
+            if getattr(args, arg, None) is None:
+                raise ValueError("The %s stopping rule requires --%s." % (name, arg))
+            kwargs[param] = getattr(args, arg)
+        rules.append(STOPPING_RULES[name](**kwargs))
+    return AnyOf(rules)
+
+
+def main(args: argparse.Namespace) -> None:
+    args.metric = 'accuracy'
+    args.precision = PRECISION
+    num_classes = NUM_CLASSES_DICT[args.dataset]
+    categories, observations, confidences, labels, indices = PredictionSet.from_file(
+        DATAFILE_LIST[args.dataset]).astuple()
+    num_samples = len(observations)
+    ground_truth = get_ground_truth(categories, observations, confidences, num_classes, args.metric, args.mode,
+                                    topk=args.topk)
+    prior = np.ones((num_classes, 2)) / 2 * args.pseudocount
+    stopping_rule = build_stopping_rule(args)
+
+    rows = []
+    reasons = Counter()
+    for r in range(args.num_runs):
+        np.random.seed(r)
+        sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices, reason = \
+            get_samples_topk(args, categories, observations, confidences, labels, indices, num_classes, num_samples,
+                             sample_method=args.sample_method, prior=prior, random_seed=r,
+                             stopping_rule=stopping_rule)
+        # topk classes reported at the time of stopping
+        model = BetaBernoulli(num_classes, prior)
+        model.update_batch(sampled_categories, sampled_observations)
+        if args.mode == 'min':
+            topk_indices = model.eval.argsort()[:args.topk]
+        elif args.mode == 'max':
+            topk_indices = model.eval.argsort()[-args.topk:]
+        reasons[reason] += 1
+        rows.append([len(sampled_categories), len(sampled_categories) / num_samples, ground_truth[topk_indices].mean()])
+
+    rows = np.array(rows)
+    logger.info('%s :: stopped after %.1f labels (%.3f of the dataset) on average, reasons %s, topk agreement %.3f',
+                args.dataset, rows[:, 0].mean(), rows[:, 1].mean(), dict(reasons), rows[:, 2].mean())
+
+    try:
+        os.stat(args.output)
+    except:
+        os.mkdir(args.output)
+
+    filename = args.output + "%s_%s_top%d_%s.csv" % (args.dataset, args.mode, args.topk,
+                                                     '_'.join(args.stopping_rules))
+    np.savetxt(filename, rows, delimiter=',', header='num_labeled, fraction_labeled, topk_agreement')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dataset', type=str, default='cifar100', help='input dataset')
+    parser.add_argument('--output', type=str, default=OUTPUT_DIR, help='output prefix')
+    parser.add_argument('-topk', type=int, default=1, help='number of optimal arms to identify')
+    parser.add_argument('-pseudocount', type=float, default=PRIOR_STRENGTH, help='strength of prior')
+    parser.add_argument('-mode', type=str, default='min', help='min or max, identify topk with highest/lowest reward')
+    parser.add_argument('--sample_method', type=str, default='ts', help='sampling method, a key of SAMPLE_CATEGORY')
+    parser.add_argument('--stopping_rules', type=str, nargs='+', default=['confidence'], choices=list(STOPPING_RULES),
+                        help='stop labeling as soon as one of these rules fires')
+    parser.add_argument('--delta', type=float, default=DELTA,
+                        help='confidence rule: stop once P(current topk set is correct) >= 1 - delta')
+    parser.add_argument('--label_budget', type=int, default=None, help='budget rule: maximum number of labels')
+    parser.add_argument('--max_time', type=float, default=None, help='time rule: maximum wall time in seconds')
+    parser.add_argument('--num_runs', type=int, default=NUM_RUNS, help='number of runs')
+
+    args, _ = parser.parse_known_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.dataset not in DATASET_LIST:
+        raise ValueError("%s is not in DATASET_LIST." % args.dataset)
+
+    main(args)
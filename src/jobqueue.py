@@ -0,0 +1,354 @@
+"""
+Work queue of a sweep on a shared filesystem, e.g. an NFS mount seen by several hosts. No scheduler or network service
+is needed: the queue is a directory, and every state change of a unit is an atomic rename of its entry file.
+
+    <queue>/sweep.pkl          arguments of the sweep
+    <queue>/todo/<unit>        units waiting for a worker
+    <queue>/claimed/<unit>     units being run, the mtime of the entry is the lease of its worker
+    <queue>/done/<unit>        units committed to the unit store of their configuration (see resumable)
+    <queue>/failed/<unit>      units that failed max_attempts times
+    <queue>/merged/<config>    configurations whose units are assembled into their result store
+
+A worker claims a unit by renaming its entry from todo/ to claimed/, only one of several concurrent renames succeeds.
+While the unit runs, a heartbeat thread touches the entry. Entries whose lease is older than LEASE_TIMEOUT belong to
+dead workers and are moved back to todo/ by any worker. Lease ages are measured against the clock of the filesystem, not
+of the host, so hosts do not need synchronized clocks. A unit that is run twice, e.g. by a worker that lost its lease,
+is committed twice with the same content.
+
+    python jobqueue.py enqueue /nfs/queue -experiments topk -datasets cifar100 ...    # once, on any host
+    python jobqueue.py work /nfs/queue --processes 16                                  # on every host
+    python jobqueue.py merge /nfs/queue                                                # once the queue is empty
+
+Workers must run in the same directory (src) on every host, with the datasets and --output on the shared filesystem.
+"""
+import copy
+import json
+import multiprocessing
+import os
+import pathlib
+import pickle
+import socket
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+
+import sweep
+from resumable import UnitStore
+from utils import *
+
+ARGS_FILE = 'sweep.pkl'
+TODO_DIR = 'todo'
+CLAIMED_DIR = 'claimed'
+DONE_DIR = 'done'
+FAILED_DIR = 'failed'
+MERGED_DIR = 'merged'
+CLOCK_DIR = 'clock'
+QUEUE_DIRS = [TODO_DIR, CLAIMED_DIR, DONE_DIR, FAILED_DIR, MERGED_DIR, CLOCK_DIR]
+# entries are named by the position of their unit, or of their configuration in merged/
+ENTRY_NAME = '%06d'
+
+LEASE_TIMEOUT = 300  # seconds without heartbeat after which a claimed unit is given to another worker
+HEARTBEAT_INTERVAL = 30
+POLL_INTERVAL = 10
+
+ACTIONS = ['enqueue', 'work', 'merge', 'status']
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """
+    Units of a sweep in a queue directory. Entries are named by the position of their unit in sweep.plan_units, every
+        host expands the same arguments into the same units.
+    """
+
+    def __init__(self, directory: pathlib.Path):
+        """
+        :param directory: pathlib.Path
+            Queue directory on the shared filesystem.
+        """
+        self.directory = pathlib.Path(directory)
+        for name in QUEUE_DIRS:
+            (self.directory / name).mkdir(parents=True, exist_ok=True)
+
+    @property
+    def owner(self) -> str:
+        # workers of a host are forked from one process
+        return '%s.%d' % (socket.gethostname(), os.getpid())
+
+    def entry(self, state: str, entry_name: str) -> pathlib.Path:
+        return self.directory / state / entry_name
+
+    def entries(self, state: str) -> List[str]:
+        return sorted(name for name in os.listdir(self.directory / state) if not name.startswith('.'))
+
+    def read(self, path: pathlib.Path) -> Dict[str, Any]:
+        return json.loads(path.read_text())
+
+    def write(self, path: pathlib.Path, entry: Dict[str, Any]) -> None:
+        tmp = path.parent / ('.%s.%s.tmp' % (path.name, self.owner))
+        tmp.write_text(json.dumps(entry, sort_keys=True))
+        os.replace(tmp, path)
+
+    def move(self, src_state: str, dst_state: str, entry_name: str) -> bool:
+        """
+        Atomically move an entry. Fails if another worker moved it first.
+        :return: bool
+            True if this call moved the entry.
+        """
+        try:
+            os.rename(self.entry(src_state, entry_name), self.entry(dst_state, entry_name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def now(self) -> float:
+        """
+        Current time of the filesystem, i.e. the mtime of a file touched by this worker.
+        """
+        path = self.entry(CLOCK_DIR, self.owner)
+        path.touch()
+        return os.stat(path).st_mtime
+
+    def save_args(self, args: argparse.Namespace) -> None:
+        with open(self.directory / ARGS_FILE, 'wb') as f:
+            pickle.dump(args, f)
+
+    def load_args(self) -> argparse.Namespace:
+        with open(self.directory / ARGS_FILE, 'rb') as f:
+            return pickle.load(f)
+
+    def claim(self) -> str:
+        """
+        :return: str
+            Name of the claimed entry, None if no unit is waiting.
+        """
+        for entry_name in self.entries(TODO_DIR):
+            # the lease starts with the rename, an entry that waited long must not look expired
+            try:
+                os.utime(self.entry(TODO_DIR, entry_name))
+            except FileNotFoundError:
+                continue
+            if self.move(TODO_DIR, CLAIMED_DIR, entry_name):
+                path = self.entry(CLAIMED_DIR, entry_name)
+                entry = self.read(path)
+                entry['owner'] = self.owner
+                self.write(path, entry)
+                return entry_name
+        return None
+
+    def release(self, entry_name: str, error: str, max_attempts: int, path: pathlib.Path = None) -> None:
+        """
+        Return a claimed unit whose attempt failed to the queue, or give up on it after max_attempts attempts.
+        :param path: pathlib.Path
+            Current path of the entry. Default: None, i.e. the claimed entry.
+        """
+        path = self.entry(CLAIMED_DIR, entry_name) if path is None else path
+        try:
+            entry = self.read(path)
+        except FileNotFoundError:
+            # the lease expired and the unit was released by another worker
+            return
+        entry['attempts'] = entry.get('attempts', 0) + 1
+        entry['error'] = error
+        self.write(path, entry)
+        if entry['attempts'] < max_attempts:
+            logger.warning('%s :: attempt %d failed :: %s' % (entry['name'], entry['attempts'], error))
+            state = TODO_DIR
+        else:
+            logger.error('%s :: giving up after %d attempts :: %s' % (entry['name'], entry['attempts'], error))
+            state = FAILED_DIR
+        try:
+            os.rename(path, self.entry(state, entry_name))
+        except FileNotFoundError:
+            pass
+
+    def expire_leases(self, max_attempts: int) -> int:
+        """
+        Release the claimed units whose workers stopped sending heartbeats.
+        :return: int
+            Number of units that are claimed by live workers.
+        """
+        now = self.now()
+        alive = 0
+        for entry_name in self.entries(CLAIMED_DIR):
+            path = self.entry(CLAIMED_DIR, entry_name)
+            try:
+                age = now - os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            if age < LEASE_TIMEOUT:
+                alive += 1
+                continue
+            # of the workers that notice an expired lease, the one whose rename succeeds releases the unit
+            expired = self.entry(CLAIMED_DIR, '.%s.%s.expired' % (entry_name, self.owner))
+            try:
+                os.rename(path, expired)
+            except FileNotFoundError:
+                continue
+            self.release(entry_name, 'lease expired after %d seconds' % age, max_attempts, path=expired)
+        return alive
+
+    def status(self) -> Dict[str, int]:
+        return {state: len(self.entries(state)) for state in [TODO_DIR, CLAIMED_DIR, DONE_DIR, FAILED_DIR]}
+
+
+def _heartbeat(path: pathlib.Path, stop: threading.Event) -> None:
+    while not stop.wait(HEARTBEAT_INTERVAL):
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # the lease expired, the unit is finished anyway and committed a second time
+            return
+
+
+def enqueue(queue: JobQueue, args: argparse.Namespace) -> None:
+    """
+    Queue the units of a sweep that are neither committed, queued nor claimed. Enqueuing the same sweep again requeues
+        failed units, e.g. after a bug is fixed.
+    :param queue: JobQueue
+    :param args: argparse.Namespace
+        Arguments of the sweep.
+    """
+    # units are enumerated when the sweep is enqueued, the number of runs cannot depend on the results
+    if args.ci_width is not None:
+        raise ValueError("--ci_width is not supported by the job queue.")
+    if args.output is not None:
+        args.output = args.output.resolve()
+    if (queue.directory / ARGS_FILE).is_file():
+        queued_args = vars(queue.load_args())
+        if any(queued_args.get(key) != value for key, value in vars(args).items() if key != 'processes'):
+            if queue.entries(TODO_DIR) or queue.entries(CLAIMED_DIR):
+                raise ValueError("%s holds the units of another sweep." % queue.directory)
+            for state in [DONE_DIR, FAILED_DIR, MERGED_DIR]:
+                for entry_name in queue.entries(state):
+                    queue.entry(state, entry_name).unlink()
+    queue.save_args(args)
+
+    configs = sweep.expand_grid(args)
+    units = sweep.plan_units(configs, args.methods)
+    merged = set(queue.entries(MERGED_DIR))
+    busy = set(queue.entries(TODO_DIR)) | set(queue.entries(CLAIMED_DIR))
+    num_queued = 0
+    for unit_idx, (store, name, (config_idx, _, _)) in enumerate(units):
+        entry_name = ENTRY_NAME % unit_idx
+        if ENTRY_NAME % config_idx in merged or entry_name in busy or name in store:
+            continue
+        # workers never see a store without manifest, see UnitStore
+        store.create()
+        for state in [DONE_DIR, FAILED_DIR]:
+            if queue.entry(state, entry_name).is_file():
+                queue.entry(state, entry_name).unlink()
+        queue.write(queue.entry(TODO_DIR, entry_name), {'name': '%s/%s' % (store.directory, name), 'attempts': 0})
+        num_queued += 1
+    logger.info('%d configurations, %d units, %d queued' % (len(configs), len(units), num_queued))
+
+
+def _work(queue: JobQueue, units: List[Tuple[UnitStore, str, Tuple[int, str, int]]], max_attempts: int) -> None:
+    """
+    Claim and run units until no unit is waiting or claimed by a live worker.
+    """
+    while True:
+        entry_name = queue.claim()
+        if entry_name is None:
+            alive = queue.expire_leases(max_attempts)
+            if not alive and not queue.entries(TODO_DIR):
+                return
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        store, name, task = units[int(entry_name)]
+        if name not in store:
+            logger.debug('%s :: running %s/%s' % (queue.owner, store.directory, name))
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_heartbeat, args=(queue.entry(CLAIMED_DIR, entry_name), stop),
+                                         daemon=True)
+            heartbeat.start()
+            try:
+                store.commit(name, sweep.run_unit(task))
+            except Exception as e:
+                queue.release(entry_name, repr(e), max_attempts)
+                continue
+            finally:
+                stop.set()
+        queue.move(CLAIMED_DIR, DONE_DIR, entry_name)
+
+
+def work(queue: JobQueue, processes: int) -> None:
+    """
+    Run units of the queue in processes workers on this host, until the queue is empty.
+    :param queue: JobQueue
+    :param processes: int
+        Number of worker processes.
+    """
+    args = queue.load_args()
+    # workers are forked after the contexts are built and inherit them
+    units = sweep.setup(args)
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_work, args=(queue, units, args.max_attempts)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    logger.info('Queue empty :: %s' % queue.status())
+
+
+def merge(queue: JobQueue) -> List[int]:
+    """
+    Assemble the result stores, trajectories and cost curves of every configuration whose units are all committed.
+    :param queue: JobQueue
+    :return: List[int]
+        Positions of the configurations that are not complete yet.
+    """
+    args = queue.load_args()
+    configs = sweep.expand_grid(args)
+    units = sweep.plan_units(configs, args.methods)
+    merged = set(queue.entries(MERGED_DIR))
+    incomplete = []
+    for config_idx in range(len(configs)):
+        if ENTRY_NAME % config_idx in merged:
+            continue
+        if all(name in store for store, name, task in units if task[0] == config_idx):
+            sweep.finalize(units, config_idx, configs, args.methods)
+            queue.write(queue.entry(MERGED_DIR, ENTRY_NAME % config_idx), {'directory': str(
+                sweep.experiment_directory(*configs[config_idx]))})
+        else:
+            incomplete.append(config_idx)
+    if incomplete:
+        logger.warning('%d of %d configurations are not complete :: %s' % (len(incomplete), len(configs),
+                                                                           queue.status()))
+    return incomplete
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('action', type=str, choices=ACTIONS,
+                        help='enqueue a sweep, work on its units, merge finished configurations, or show the status')
+    parser.add_argument('queue', type=pathlib.Path, help='queue directory on the shared filesystem')
+    # arguments of the sweep are read by enqueue, the other actions use the arguments of the queued sweep
+    sweep.add_arguments(parser)
+
+    args, _ = parser.parse_known_args()
+
+    if args.debug:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    logging.basicConfig(level=level)
+
+    queue = JobQueue(args.queue)
+    if args.action == 'enqueue':
+        for dataset in args.datasets:
+            if dataset not in DATASET_LIST:
+                raise ValueError("%s is not in DATASET_LIST." % dataset)
+        sweep_args = copy.copy(args)
+        del sweep_args.action, sweep_args.queue
+        enqueue(queue, sweep_args)
+    elif args.action == 'work':
+        work(queue, args.processes)
+    elif args.action == 'merge':
+        merge(queue)
+    elif args.action == 'status':
+        logger.info('%s :: %d configurations merged' % (queue.status(), len(queue.entries(MERGED_DIR))))
+    else:
+        raise ValueError("%s is not in ACTIONS." % args.action)
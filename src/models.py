@@ -8,6 +8,69 @@ from typing import List, Tuple
 import numpy as np
 from scipy.stats import beta
 
+BETA_SAMPLERS = ['exact', 'normal']
+NORMAL_APPROXIMATION_THRESHOLD = 1000
+GRID_SIZE = 1000
+
+
+def sample_beta(alphas: np.ndarray, betas: np.ndarray, num_samples: int = 1, sampler: str = 'exact',
+                threshold: float = NORMAL_APPROXIMATION_THRESHOLD, dtype=np.float64) -> np.ndarray:
+    """
+    Draw samples from independent Beta distributions.
+    :param alphas: np.ndarray (n, )
+        Alpha parameters of the Beta distributions.
+    :param betas: np.ndarray (n, )
+        Beta parameters of the Beta distributions.
+    :param num_samples: int
+        Number of samples to draw from each distribution. Default: 1.
+    :param sampler: str
+        'exact' draws Beta variates for every distribution. 'normal' replaces the Beta variates of distributions with
+            alphas + betas >= threshold by draws from the moment-matched normal distribution, clipped to [0, 1].
+            Default: 'exact'.
+    :param threshold: float
+        Minimum alphas + betas for the normal approximation to be used. Default: NORMAL_APPROXIMATION_THRESHOLD.
+    :param dtype: np.dtype
+        Floating point precision of the samples. The global RandomState only draws float64 variates, they are
+            converted as they are drawn and all further arithmetic is done in dtype. Default: np.float64.
+    :return: An (num_samples, n) array of samples.
+    """
+    if sampler == 'exact':
+        return np.random.beta(alphas, betas, size=(num_samples, alphas.shape[0])).astype(dtype, copy=False)
+    elif sampler != 'normal':
+        raise ValueError("%s is not an implemented Beta sampler." % sampler)
+
+    alphas = np.asarray(alphas, dtype=dtype)
+    betas = np.asarray(betas, dtype=dtype)
+    strength = alphas + betas
+    approximate = strength >= threshold
+    if not approximate.any():
+        return np.random.beta(alphas, betas, size=(num_samples, alphas.shape[0])).astype(dtype, copy=False)
+
+    # moment-matched normal for every arm is cheaper than selecting the approximated arms first
+    mean = alphas / strength
+    std = np.sqrt(mean * (1 - mean) / (strength + 1))
+    theta = np.random.standard_normal((num_samples, alphas.shape[0])).astype(dtype, copy=False)
+    theta *= std
+    theta += mean
+    np.minimum(np.maximum(theta, 0, out=theta), 1, out=theta)
+    if not approximate.all():
+        exact = np.invert(approximate)
+        theta[:, exact] = np.random.beta(alphas[exact], betas[exact], size=(num_samples, exact.sum()))
+    return theta
+
+
+def _add_class(distribution: np.ndarray, beat: np.ndarray) -> np.ndarray:
+    """
+    Add one class to the distribution of the number of classes beating each grid midpoint, truncated at topk.
+    :param distribution: np.ndarray (topk, grid_size)
+    :param beat: np.ndarray (grid_size, )
+        Probability that the added class beats each midpoint.
+    :return: np.ndarray (topk, grid_size)
+    """
+    added = distribution * (1 - beat)
+    added[1:] += distribution[:-1] * beat
+    return added
+
 
 class Model:
     """
@@ -39,19 +102,33 @@ class BetaBernoulli(Model):
     Model classwise accuracy with a Beta Bernoulli distribution for each predicted class.
     """
 
-    def __init__(self, k: int, prior=None):
+    def __init__(self, k: int, prior=None, dtype=np.float64, sampler: str = 'exact',
+                 sampler_threshold: float = NORMAL_APPROXIMATION_THRESHOLD):
         """
         :param k: int
             The number of classes.
         :param prior: np.ndarray (k, 2) or None
             alpha and beta parameters of prior Beta distributions. Default: None.
+        :param dtype: np.dtype
+            Floating point precision of the posterior parameters and samples. Default: np.float64.
+        :param sampler: str
+            Sampler used to draw from the posterior, one of BETA_SAMPLERS. See sample_beta. Default: 'exact'.
+        :param sampler_threshold: float
+            Minimum alpha + beta for the 'normal' sampler to approximate a class posterior. Default:
+                NORMAL_APPROXIMATION_THRESHOLD.
         """
         self._k = k
-        self._prior = prior
+        self._dtype = dtype
+        self._sampler = sampler
+        self._sampler_threshold = sampler_threshold
         if prior is None:
-            self._prior = np.ones((k, 2)) * 0.5
+            self._prior = np.ones((k, 2), dtype=dtype) * 0.5
+        else:
+            self._prior = np.asarray(prior, dtype=dtype)
 
         self._params = copy.deepcopy(self._prior)
+        # posterior summaries computed for the current parameters, cleared on every update
+        self._cache = {}
 
     @property
     def eval(self) -> np.ndarray:
@@ -85,6 +162,132 @@ class BetaBernoulli(Model):
         """
         return self._params
 
+    def quantiles(self, q: List[float]) -> np.ndarray:
+        """
+        Quantiles of the posterior classwise accuracies. Results are cached until the next update.
+        :param q: List[float]
+            Quantiles to compute, each between 0 and 1.
+        :return: An (k, len(q)) array of quantiles of posteriors of classwise accuracies.
+        """
+        key = ('quantiles', tuple(q))
+        if key not in self._cache:
+            self._cache[key] = beta.ppf(np.array(q)[np.newaxis, :], self._params[:, 0:1], self._params[:, 1:2])
+        return self._cache[key]
+
+    def credible_interval(self, level: float = 0.95) -> np.ndarray:
+        """
+        Equal-tailed credible intervals of the posterior classwise accuracies.
+        :param level: float
+            Probability mass of posteriors covered by the intervals. Default: 0.95.
+        :return: An (k, 2) array of lower and upper bounds of the credible intervals.
+        """
+        return self.quantiles([(1 - level) / 2, (1 + level) / 2])
+
+    def topk_membership_probability(self, topk: int, mode: str, grid_size: int = GRID_SIZE) -> np.ndarray:
+        """
+        Posterior probability of each class being among the topk classes with lowest/highest accuracy. The
+            probabilities are integrated numerically over a grid shared by all classes: for the grid cell that contains
+            theta_i, class i is in the topk if fewer than topk of the other classes beat the cell midpoint. The count of
+            other classes beating the midpoint is Poisson binomial, computed from prefix and suffix distributions
+            truncated at topk. Results are cached until the next update.
+        :param topk: int
+            The number of extreme classes.
+        :param mode: str
+            'min' or 'max'
+        :param grid_size: int
+            The number of grid cells. Default: GRID_SIZE.
+        :return: An (k, ) array of probabilities that sum to topk.
+        """
+        key = ('topk_membership_probability', topk, mode, grid_size)
+        if key in self._cache:
+            return self._cache[key]
+
+        alpha, beta_ = self._params[:, 0:1], self._params[:, 1:2]
+        # the grid covers the bulk of all posteriors, with outermost cells extended to 0 and 1
+        lower = beta.ppf(1e-6, alpha, beta_).min()
+        upper = beta.ppf(1 - 1e-6, alpha, beta_).max()
+        edges = np.linspace(lower, upper, grid_size + 1)
+        edges[0], edges[-1] = 0, 1
+        midpoints = (edges[:-1] + edges[1:]) / 2
+
+        mass = np.diff(beta.cdf(edges[np.newaxis, :], alpha, beta_), axis=1).astype(self._dtype)  # (k, grid_size)
+        cdf = beta.cdf(midpoints[np.newaxis, :], alpha, beta_).astype(self._dtype)
+        if mode == 'max':
+            beat = 1 - cdf
+        elif mode == 'min':
+            beat = cdf
+        else:
+            raise ValueError("%s is not a valid mode, choose 'min' or 'max'." % mode)
+
+        # suffix(i)[c]: probability that exactly c of classes i, ..., k - 1 beat the midpoint, for c < topk. Only the
+        # suffixes of every block-th class are kept, those within a block are recomputed from the end of the block
+        # when it is reached, so the tables take O(sqrt(k) * topk * grid_size) instead of O(k * topk * grid_size).
+        block = int(np.ceil(np.sqrt(self._k)))
+        suffix = np.zeros((topk, grid_size), dtype=self._dtype)
+        suffix[0] = 1
+        kept = {self._k: suffix}
+        for i in range(self._k - 1, -1, -1):
+            suffix = _add_class(suffix, beat[i])
+            if i % block == 0:
+                kept[i] = suffix
+
+        probability = np.zeros((self._k,), dtype=self._dtype)
+        prefix = kept[self._k].copy()
+        for start in range(0, self._k, block):
+            end = min(start + block, self._k)
+            # suffixes[j] is suffix(start + 1 + j)
+            suffixes = [kept[end]]
+            for i in range(end - 1, start, -1):
+                suffixes.append(_add_class(suffixes[-1], beat[i]))
+            suffixes.reverse()
+            for i in range(start, end):
+                # probability that fewer than topk of the other classes beat the midpoint
+                fewer = (prefix[::-1] * np.cumsum(suffixes[i - start], axis=0)).sum(axis=0)
+                probability[i] = np.dot(mass[i], fewer)
+                prefix = _add_class(prefix, beat[i])
+
+        self._cache[key] = probability
+        return probability
+
+    def topk_set_probability(self, topk_indices: List[int], mode: str, grid_size: int = GRID_SIZE) -> float:
+        """
+        Posterior probability that topk_indices is exactly the set of classes with lowest/highest accuracy, i.e. that
+            every class in the set is beaten by none of the other classes. For mode 'min' this is the integral of
+            d[prod_{i in set} F_i(t)] * prod_{j not in set} (1 - F_j(t)) over t, evaluated on a grid.
+        :param topk_indices: List[int]
+            Indices of the candidate set of extreme classes.
+        :param mode: str
+            'min' or 'max'
+        :param grid_size: int
+            The number of grid cells. Default: GRID_SIZE.
+        :return: float
+        """
+        key = ('topk_set_probability', tuple(sorted(topk_indices)), mode, grid_size)
+        if key in self._cache:
+            return self._cache[key]
+
+        alpha, beta_ = self._params[:, 0:1], self._params[:, 1:2]
+        lower = beta.ppf(1e-6, alpha, beta_).min()
+        upper = beta.ppf(1 - 1e-6, alpha, beta_).max()
+        edges = np.linspace(lower, upper, grid_size + 1)
+        edges[0], edges[-1] = 0, 1
+        midpoints = (edges[:-1] + edges[1:]) / 2
+
+        in_set = np.zeros((self._k,), dtype=np.bool_)
+        in_set[list(topk_indices)] = True
+        if mode == 'max':
+            # the set is the topk of highest accuracy iff it is the topk of lowest 1 - accuracy
+            alpha, beta_ = beta_, alpha
+            edges, midpoints = 1 - edges[::-1], 1 - midpoints[::-1]
+
+        # distribution of the largest accuracy within the set, and survival of the smallest accuracy outside of it
+        set_cdf = np.exp(beta.logcdf(edges[np.newaxis, :], alpha[in_set], beta_[in_set]).sum(axis=0))
+        rest_survival = np.exp(beta.logsf(midpoints[np.newaxis, :], alpha[~in_set], beta_[~in_set]).sum(axis=0))
+        probability = float(np.dot(np.diff(set_cdf), rest_survival))
+
+        self._cache[key] = probability
+        return probability
+
     def sample(self, num_samples: int = 1) -> np.ndarray:
         """
         Draw sample thetas from the posterior.
@@ -92,8 +295,9 @@ class BetaBernoulli(Model):
             Number of times to sample from posterior. Default: 1.
         :return: An (k, num_samples) array of samples of theta. If num_samples == 1 then last dimension is squeezed.
         """
-        theta = np.random.beta(self._params[:, 0], self._params[:, 1], size=(num_samples, self._k))
-        return np.array(theta).T.squeeze()
+        theta = sample_beta(self._params[:, 0], self._params[:, 1], num_samples, self._sampler,
+                            self._sampler_threshold, dtype=self._dtype)
+        return theta.T.squeeze()
 
     def update(self, category: int, observation: bool) -> None:
         """
@@ -107,6 +311,7 @@ class BetaBernoulli(Model):
             self._params[category, 0] += 1
         else:
             self._params[category, 1] += 1
+        self._cache.clear()
 
     def update_batch(self, categories: List[int], observations: List[bool]) -> None:
         """
@@ -117,11 +322,11 @@ class BetaBernoulli(Model):
             A list of boolean observations, each observation represents whether the predicted class agrees with the
                 true class label.
         """
-        for category, observation in zip(categories, observations):
-            if observation:
-                self._params[category, 0] += 1
-            else:
-                self._params[category, 1] += 1
+        categories = np.asarray(categories, dtype=int)
+        observations = np.asarray(observations, dtype=np.bool_)
+        # np.add.at accumulates repeated categories, unlike fancy-index assignment
+        np.add.at(self._params, (categories, np.invert(observations).astype(int)), 1)
+        self._cache.clear()
 
 
 class SumOfBetaEce(Model):
@@ -130,7 +335,8 @@ class SumOfBetaEce(Model):
     """
 
     def __init__(self, num_bins: int, weight: np.ndarray = None, pseudocount: int = 3, prior_alpha: np.ndarray = None,
-                 prior_beta: np.ndarray = None):
+                 prior_beta: np.ndarray = None, dtype=np.float64, sampler: str = 'exact',
+                 sampler_threshold: float = NORMAL_APPROXIMATION_THRESHOLD):
         """
         Init model parameters self._alpha and self._beta, either with pseudocount (put mean of beta on diagonal
         with prior strength pseudocount) or with given prior_alpha and prior_beta.
@@ -139,26 +345,32 @@ class SumOfBetaEce(Model):
         :param weight: np.ndarray (num_bins, ), weight of each bin.
         :param prior_alpha: np.ndarray (num_bins, ), alpha parameter of the Beta distribution for each bin
         :param prior_beta: np.ndarray (num_bins, ), beta parameter of the Beta distribution for each bin
+        :param dtype: np.dtype, floating point precision of the model parameters and samples. Default: np.float64.
+        :param sampler: str, sampler used to draw bin-wise accuracies, one of BETA_SAMPLERS. Default: 'exact'.
+        :param sampler_threshold: float, minimum alpha + beta for the 'normal' sampler to approximate a bin.
         """
         # constants
         self._num_bins = num_bins
-        self._weight = weight
-        self._diagonal = np.array([(i + 0.5) / num_bins for i in range(0, num_bins)])
+        self._dtype = dtype
+        self._sampler = sampler
+        self._sampler_threshold = sampler_threshold
+        self._weight = weight if weight is None else np.asarray(weight, dtype=dtype)
+        self._diagonal = np.array([(i + 0.5) / num_bins for i in range(0, num_bins)], dtype=dtype)
 
         # parameters to update:
-        self._counts = np.ones((num_bins, 2)) * 0.0001
-        self._confidence = np.array([(i + 0.5) / num_bins for i in range(0, num_bins)])
+        self._counts = np.ones((num_bins, 2), dtype=dtype) * 0.0001
+        self._confidence = np.array([(i + 0.5) / num_bins for i in range(0, num_bins)], dtype=dtype)
 
         # initialize the mode of each Beta distribution on diagonal
         if prior_alpha is None:
-            self._alpha = (np.arange(num_bins) + 0.5) * pseudocount / num_bins
+            self._alpha = ((np.arange(num_bins) + 0.5) * pseudocount / num_bins).astype(dtype)
         else:
-            self._alpha = np.copy(prior_alpha)
+            self._alpha = np.array(prior_alpha, dtype=dtype)
 
         if prior_beta is None:
-            self._beta = pseudocount - self._alpha
+            self._beta = (pseudocount - self._alpha).astype(dtype)
         else:
-            self._beta = np.copy(prior_beta)
+            self._beta = np.array(prior_beta, dtype=dtype)
 
     @property
     def beta_params_mpe(self) -> np.ndarray:
@@ -231,8 +443,8 @@ class SumOfBetaEce(Model):
         :return: An (num_samples, ) array of ECE. If n_samples == 1 then last dimension is squeezed.
         """
         # draw samples from each Beta distribution
-        theta = np.random.beta(self._alpha, self._beta,
-                               size=(num_samples, self._num_bins))
+        theta = sample_beta(self._alpha, self._beta, num_samples, self._sampler,
+                            self._sampler_threshold, dtype=self._dtype)
         # compute ECE with samples
         if self._weight is not None:  # pool weights
             weight = self._weight
@@ -335,7 +547,8 @@ class ClasswiseEce(Model):
     Model classwise ECE with a SumOfBetaECE for each predicted class.
     """
 
-    def __init__(self, k: int, num_bins: int, pseudocount: float, weight=None, prior=None) -> None:
+    def __init__(self, k: int, num_bins: int, pseudocount: float, weight=None, prior=None, dtype=np.float64,
+                 sampler: str = 'exact', sampler_threshold: float = NORMAL_APPROXIMATION_THRESHOLD) -> None:
         """
         :param k: int
             The number of classes
@@ -347,6 +560,12 @@ class ClasswiseEce(Model):
             Weight of each bin. Default: None.
         :param prior: an (number of classes, k, 2) array
             Alpha and beta parameters in the prior Beta distributions.
+        :param dtype: np.dtype
+            Floating point precision of the model parameters and samples. Default: np.float64.
+        :param sampler: str
+            Sampler used to draw bin-wise accuracies, one of BETA_SAMPLERS. Default: 'exact'.
+        :param sampler_threshold: float
+            Minimum alpha + beta for the 'normal' sampler to approximate a bin. Default: NORMAL_APPROXIMATION_THRESHOLD.
         """
         self._k = k
         self._num_bins = num_bins
@@ -358,13 +577,17 @@ class ClasswiseEce(Model):
             self._classwise_ece_models = [SumOfBetaEce(num_bins,
                                                        weight=weight[class_idx],
                                                        pseudocount=pseudocount,
-                                                       prior_alpha=None, prior_beta=None)
+                                                       prior_alpha=None, prior_beta=None,
+                                                       dtype=dtype, sampler=sampler,
+                                                       sampler_threshold=sampler_threshold)
                                           for class_idx in range(k)]
         else:
             self._classwise_ece_models = [SumOfBetaEce(num_bins,
                                                        weight=weight[class_idx],
                                                        prior_alpha=prior[class_idx, :, 0].squeeze(),
-                                                       prior_beta=prior[class_idx, :, 1].squeeze())
+                                                       prior_beta=prior[class_idx, :, 1].squeeze(),
+                                                       dtype=dtype, sampler=sampler,
+                                                       sampler_threshold=sampler_threshold)
                                           for class_idx in range(k)]
 
     @property
@@ -456,17 +679,24 @@ class DirichletMultinomialCost(Model):
         An array of shape (n_classes, n_classes) where each row parameterizes a single Dirichlet distribution.
     costs : np.ndarray
         An array of shape (n_classes, n_classes). The cost matrix.
+    dtype : np.dtype
+        Floating point precision of the posterior parameters and samples. Default: np.float64.
     """
 
-    def __init__(self, alphas: np.ndarray, costs: np.ndarray) -> None:
+    def __init__(self, alphas: np.ndarray, costs: np.ndarray, dtype=np.float64) -> None:
         assert alphas.shape == costs.shape
-        self._alphas = np.copy(alphas)
-        self._costs = np.copy(costs)
+        self._dtype = dtype
+        self._alphas = np.array(alphas, dtype=dtype)
+        self._costs = np.array(costs, dtype=dtype)
 
     def update(self, predicted_class: int, true_class: int) -> None:
         """Update the posterior of the model."""
         self._alphas[predicted_class, true_class] += 1
 
+    def update_batch(self, predicted_classes: List[int], true_classes: List[int]) -> None:
+        """Update the posterior of the model with a batch of observations."""
+        np.add.at(self._alphas, (np.asarray(predicted_classes, dtype=int), np.asarray(true_classes, dtype=int)), 1)
+
     def sample(self, n_samples: int = 1) -> np.ndarray:
         """
         Draw sample expected costs from the posterior.
@@ -480,7 +710,7 @@ class DirichletMultinomialCost(Model):
             for i, alpha in enumerate(self._alphas):
                 posterior_draw[i] = np.random.dirichlet(alpha)
         else:
-            posterior_draw = np.zeros((n_samples, *self._alphas.shape))
+            posterior_draw = np.zeros((n_samples, *self._alphas.shape), dtype=self._dtype)
             for i, alpha in enumerate(self._alphas):
                 posterior_draw[:, i, :] = np.random.dirichlet(alpha, size=(n_samples,))
 
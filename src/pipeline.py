@@ -0,0 +1,189 @@
+"""
+Content-addressed cache of the sample -> eval -> plot stages of the topk drivers. The artifacts of a stage are stored
+under CACHE_DIR/<stage>/<key>, where key is a hash of everything the stage depends on: its arguments, the digests of the
+data files and of the source files it runs, and the keys of its upstream stages. A stage whose key already has
+finished artifacts is skipped, so changing e.g. --calibration_model reruns evaluation and plotting without resampling.
+"""
+import argparse
+import copy
+import hashlib
+import inspect
+import json
+import logging
+import os
+import pathlib
+import shutil
+from typing import Any, Callable, Dict, List
+
+from checkpoints import CHECKPOINT_ARGS
+from data_utils import DATAFILE_LIST, LOGITSFILE_DICT, RESULTS_DIR
+
+CACHE_DIR = RESULTS_DIR + 'cache/'
+DONE_FILE = 'DONE'
+SRC_DIR = pathlib.Path(__file__).resolve().parent
+
+# source files whose code each stage runs, in addition to the driver
+SAMPLE_CODE = ['data_utils.py', 'models.py', 'sampling.py', 'stopping.py', 'trajectory.py', 'utils.py']
+EVAL_CODE = ['calibration.py', 'checkpoints.py', 'data_utils.py', 'models.py', 'result_store.py', 'trajectory.py',
+             'utils.py']
+PLOT_CODE = ['checkpoints.py', 'result_store.py', 'utils.py']
+
+# arguments that only affect evaluation, or none of the outputs
+EVAL_ARGS = ['calibration_model'] + CHECKPOINT_ARGS
+IGNORED_ARGS = ['output', 'processes', 'debug', 'cache', 'cache_dir']
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(path: str, cache_dir: pathlib.Path = None) -> str:
+    """
+    sha1 of the content of a file. Digests of large data files are remembered by path, size and modification time.
+    :param path: str
+    :param cache_dir: pathlib.Path
+        Directory of the remembered digests. Default: None, i.e. CACHE_DIR.
+    :return: str
+    """
+    cache_dir = pathlib.Path(CACHE_DIR if cache_dir is None else cache_dir)
+    stat = os.stat(path)
+    stamp = '%s:%d:%d' % (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digests_file = cache_dir / 'digests.json'
+    digests = json.loads(digests_file.read_text()) if digests_file.is_file() else {}
+    if stamp not in digests:
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        digests[stamp] = sha1.hexdigest()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        digests_file.write_text(json.dumps(digests, indent=1, sort_keys=True))
+    return digests[stamp]
+
+
+class Stage:
+    """
+    A step of the pipeline whose artifacts are stored under a key derived from its inputs.
+    """
+
+    def __init__(self,
+                 name: str,
+                 inputs: Dict[str, Any],
+                 upstream: List['Stage'] = (),
+                 code: List[str] = (),
+                 files: List[str] = (),
+                 cache_dir: pathlib.Path = None):
+        """
+        :param name: str
+        :param inputs: Dict[str, Any]
+            JSON serializable arguments of the stage.
+        :param upstream: List[Stage]
+            Stages whose artifacts this stage reads.
+        :param code: List[str]
+            Source files in SRC_DIR that the stage runs.
+        :param files: List[str]
+            Data files that the stage reads.
+        :param cache_dir: pathlib.Path
+            Default: None, i.e. CACHE_DIR.
+        """
+        self.name = name
+        self.cache_dir = pathlib.Path(CACHE_DIR if cache_dir is None else cache_dir)
+        self.upstream = list(upstream)
+        self.manifest = {
+            'stage': name,
+            'inputs': inputs,
+            'upstream': {stage.name: stage.key for stage in self.upstream},
+            'code': {filename: file_digest(SRC_DIR / filename, self.cache_dir) for filename in code},
+            'files': {str(filename): file_digest(filename, self.cache_dir) for filename in files},
+        }
+        self.key = hashlib.sha1(json.dumps(self.manifest, sort_keys=True, default=str).encode()).hexdigest()
+        self.directory = self.cache_dir / name / self.key
+
+    @property
+    def done(self) -> bool:
+        return (self.directory / DONE_FILE).is_file()
+
+    def run(self, fct: Callable[[pathlib.Path], None]) -> pathlib.Path:
+        """
+        Run the stage unless its artifacts exist. Artifacts of upstream stages are linked into the stage directory
+            first, so that fct finds all the files of an experiment in one place.
+        :param fct: Callable[[pathlib.Path], None]
+            Writes the artifacts of the stage to the given directory.
+        :return: The stage directory.
+        """
+        if self.done:
+            logger.info('%s :: %s :: up to date', self.name, self.key)
+            return self.directory
+
+        # remove artifacts of an interrupted run
+        if self.directory.is_dir():
+            shutil.rmtree(self.directory)
+        self.directory.mkdir(parents=True)
+        for stage in self.upstream:
+            _link_tree(stage.directory, self.directory)
+
+        logger.info('%s :: %s :: running', self.name, self.key)
+        fct(self.directory)
+        (self.directory / DONE_FILE).write_text(json.dumps(self.manifest, indent=1, sort_keys=True, default=str))
+        return self.directory
+
+
+def _link_tree(src: pathlib.Path, dst: pathlib.Path) -> None:
+    """
+    Hard link all files of src into dst, copying them where hard links are not supported.
+    """
+    for root, _, filenames in os.walk(src):
+        target = dst / pathlib.Path(root).relative_to(src)
+        target.mkdir(parents=True, exist_ok=True)
+        for filename in filenames:
+            if filename == DONE_FILE or (target / filename).exists():
+                continue
+            try:
+                os.link(pathlib.Path(root) / filename, target / filename)
+            except OSError:
+                shutil.copy2(pathlib.Path(root) / filename, target / filename)
+
+
+def run_topk_pipeline(args: argparse.Namespace,
+                      main_fct: Callable[..., None],
+                      num_runs: int,
+                      cache_dir: pathlib.Path = None) -> Dict[str, pathlib.Path]:
+    """
+    Run main_accuracy_topk or main_calibration_error_topk of a driver as cached sample, eval and plot stages.
+    :param args: argparse.Namespace
+        Arguments of the driver. args.output is replaced by the directory of each stage.
+    :param main_fct: Callable
+        Takes args and the sample, eval and plot flags.
+    :param num_runs: int
+        Number of runs of the driver.
+    :param cache_dir: pathlib.Path
+        Default: None, i.e. CACHE_DIR.
+    :return: The directory of every stage.
+    """
+    arguments = {key: value for key, value in vars(args).items() if key not in IGNORED_ARGS}
+    sample_inputs = {key: value for key, value in arguments.items() if key not in EVAL_ARGS}
+    driver = pathlib.Path(inspect.getsourcefile(inspect.unwrap(main_fct))).name
+    sample_inputs.update({'driver': driver, 'num_runs': num_runs})
+    eval_inputs = {key: arguments[key] for key in EVAL_ARGS if key in arguments}
+
+    eval_files = []
+    if args.metric == 'calibration_error' and args.dataset in LOGITSFILE_DICT \
+            and os.path.isfile(LOGITSFILE_DICT[args.dataset]):
+        eval_files.append(LOGITSFILE_DICT[args.dataset])
+
+    sample = Stage('sample', sample_inputs, code=SAMPLE_CODE + [driver], files=[DATAFILE_LIST[args.dataset]],
+                   cache_dir=cache_dir)
+    evaluate = Stage('eval', eval_inputs, upstream=[sample], code=EVAL_CODE + [driver], files=eval_files,
+                     cache_dir=cache_dir)
+    plot = Stage('plot', {}, upstream=[evaluate], code=PLOT_CODE + [driver], cache_dir=cache_dir)
+
+    def stage_fct(flags: Dict[str, bool]) -> Callable[[pathlib.Path], None]:
+        def fct(directory: pathlib.Path) -> None:
+            stage_args = copy.copy(args)
+            stage_args.output = directory
+            main_fct(stage_args, **flags)
+
+        return fct
+
+    sample.run(stage_fct({'sample': True, 'eval': False, 'plot': False}))
+    evaluate.run(stage_fct({'sample': False, 'eval': True, 'plot': False}))
+    plot.run(stage_fct({'sample': False, 'eval': False, 'plot': True}))
+    return {stage.name: stage.directory for stage in [sample, evaluate, plot]}
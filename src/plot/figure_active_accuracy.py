@@ -64,6 +64,7 @@ import numpy as np
 
 from data_utils import DATASIZE_DICT, FIGURE_DIR, RESULTS_DIR
 from data_utils import DATASET_NAMES, TOPK_DICT
+from result_store import load_checkpoints, load_summary
 
 RESULTS_DIR = RESULTS_DIR + 'active_learning_topk/'
 
@@ -107,9 +108,8 @@ def plot_topk_accuracy(ax: mpl.axes.Axes,
         method_list = {'non-active_no_prior', 'ts_uniform'}
 
     for method in method_list:
-        metric_eval = np.load(
-            RESULTS_DIR + experiment_name + ('%s_%s.npy' % (eval_metric, method))).mean(axis=0)
-        x = np.arange(len(metric_eval)) * LOG_FREQ / pool_size
+        metric_eval = load_summary(RESULTS_DIR + experiment_name, eval_metric, method, 'mean')
+        x = load_checkpoints(RESULTS_DIR + experiment_name, eval_metric, method, LOG_FREQ) / pool_size
         if topk == 1:
             if plot_informed:
                 label = method_list[method]
@@ -126,8 +126,9 @@ def plot_topk_accuracy(ax: mpl.axes.Axes,
                     cutoff = min(int(cutoff * 1.2), len(metric_eval) - 1)
                 else:
                     cutoff = len(metric_eval) - 1
+                xmax = x[cutoff]
 
-    ax.set_xlim(0, cutoff * LOG_FREQ / pool_size)
+    ax.set_xlim(0, xmax)
     ax.set_ylim(0, 1.0)
     xmin, xmax = ax.get_xlim()
     step = ((xmax - xmin) / 4.0001)
@@ -52,6 +52,7 @@ import numpy as np
 
 from data_utils import DATASIZE_DICT, FIGURE_DIR, RESULTS_DIR
 from data_utils import DATASET_NAMES, TOPK_DICT
+from result_store import load_checkpoints, load_summary
 
 RESULTS_DIR = RESULTS_DIR + 'active_learning_topk/'
 
@@ -87,9 +88,8 @@ def plot_topk_ece(ax: mpl.axes.Axes,
     benchmark = 'ts'
 
     for method in METHOD_NAME_DICT:
-        metric_eval = np.load(
-            RESULTS_DIR + experiment_name + ('%s_%s.npy' % (eval_metric, method))).mean(axis=0)
-        x = np.arange(len(metric_eval)) * LOG_FREQ / pool_size
+        metric_eval = load_summary(RESULTS_DIR + experiment_name, eval_metric, method, 'mean')
+        x = load_checkpoints(RESULTS_DIR + experiment_name, eval_metric, method, LOG_FREQ) / pool_size
 
         if topk == 1:
             label = METHOD_NAME_DICT[method]
@@ -107,8 +107,9 @@ def plot_topk_ece(ax: mpl.axes.Axes,
                 cutoff = min(int(cutoff * 1.5), len(metric_eval) - 1)
             else:
                 cutoff = len(metric_eval) - 1
+            xmax = x[cutoff]
 
-    ax.set_xlim(0, cutoff * LOG_FREQ / pool_size)
+    ax.set_xlim(0, xmax)
     ax.set_ylim(0, 1.0)
     xmin, xmax = ax.get_xlim()
     step = ((xmax - xmin) / 4.0001)
@@ -39,16 +39,17 @@ from models import BetaBernoulli, ClasswiseEce
 
 
 def plot_scatter(ax: mpl.axes.Axes,
-                 accuracy_samples: np.ndarray,
+                 accuracy_mean: np.ndarray,
+                 accuracy_std: np.ndarray,
                  ece_samples: np.ndarray,
                  limit=5,
                  plot_kwargs: Dict[str, Any] = {}) -> mpl.axes.Axes:
     _plot_kwargs = DEFAULT_PLOT_KWARGS.copy()
     _plot_kwargs.update(plot_kwargs)
     # plot
-    x = np.mean(accuracy_samples, axis=1)
+    x = accuracy_mean
     y = np.mean(ece_samples, axis=1)
-    xerr = np.std(accuracy_samples, axis=1)
+    xerr = accuracy_std
     yerr = np.std(ece_samples, axis=1)
 
     # most accuracy top k
@@ -96,12 +97,13 @@ def main() -> None:
             ece_model = ClasswiseEce(num_classes, num_bins=10, pseudocount=2)
             ece_model.update_batch(categories, observations, confidences)
 
-            # draw samples from posterior of classwise accuracy
-            accuracy_samples = accuracy_model.sample(num_samples)  # (num_categories, num_samples)
+            # posterior mean and std of classwise accuracy are exact; ECE posteriors are sampled
+            accuracy_mean = accuracy_model.eval
+            accuracy_std = np.sqrt(accuracy_model.variance)
             ece_samples = ece_model.sample(num_samples)  # (num_categories, num_samples)
 
             plot_kwargs = {}
-            axes[idx // 3, idx % 3] = plot_scatter(axes[idx // 3, idx % 3], accuracy_samples, ece_samples,
+            axes[idx // 3, idx % 3] = plot_scatter(axes[idx // 3, idx % 3], accuracy_mean, accuracy_std, ece_samples,
                                                    limit=TOPK_DICT[dataset], plot_kwargs=plot_kwargs)
             axes[idx // 3, idx % 3].set_title(DATASET_NAMES[dataset])
             idx += 1
@@ -163,13 +163,10 @@ def main():
     ece_model = ClasswiseEce(num_classes, num_bins=10, pseudocount=2)
     ece_model.update_batch(categories, observations, confidences)
 
-    # draw samples from posterior of classwise accuracy
-    accuracy_samples = accuracy_model.sample(num_samples)  # (num_categories, num_samples)
+    # posterior quantiles of classwise accuracy are exact; ECE posteriors have no closed form and are sampled
+    accuracy = accuracy_model.quantiles([0.025, 0.5, 0.975])  # (num_categories, 3)
     ece_samples = ece_model.sample(num_samples)  # (num_categories, num_samples)
 
-    accuracy = np.array([np.quantile(accuracy_samples, 0.025, axis=1),
-                         np.quantile(accuracy_samples, 0.5, axis=1),
-                         np.quantile(accuracy_samples, 0.975, axis=1)]).T
     ece = np.array([np.quantile(ece_samples, 0.025, axis=1),
                     np.quantile(ece_samples, 0.5, axis=1),
                     np.quantile(ece_samples, 0.975, axis=1)]).T
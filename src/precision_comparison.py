@@ -0,0 +1,111 @@
+import argparse
+import logging
+import os
+from collections import defaultdict
+
+from utils import *
+
+NUM_RUNS = 10
+OUTPUT_DIR = RESULTS_DIR + "precision_comparison/"
+
+logger = logging.getLogger(__name__)
+
+
+def run_precision(args: argparse.Namespace, precision: str) -> Dict[str, np.ndarray]:
+    """
+    Sample and evaluate args.num_runs runs of Thompson sampling with the given precision. Runs are seeded with the run
+        index so that float32 and float64 runs consume the same random streams.
+    :param args: argparse.Namespace
+    :param precision: str
+        'float32' or 'float64'
+    :return: Dict[str, np.ndarray]
+        Maps metric names to arrays of shape (num_runs, num_checkpoints).
+    """
+    args.precision = precision
+    num_classes = NUM_CLASSES_DICT[args.dataset]
+
+    dataset = PredictionSet.from_file(DATAFILE_LIST[args.dataset])
+    categories, observations, confidences, labels, indices = dataset.astuple()
+
+    if args.metric == 'calibration_error':
+        np.random.seed(0)
+        train_set, holdout_set = dataset.split(holdout_ratio=HOLDOUT_RATIO)
+        categories, observations, confidences, labels, indices = train_set.astuple()
+        holdout_categories, holdout_observations, holdout_confidences, holdout_labels, holdout_indices = \
+            holdout_set.astuple()
+        ground_truth = get_bayesian_ground_truth(categories, observations, confidences, num_classes, args.metric,
+                                                 args.mode, topk=args.topk, pseudocount=args.pseudocount)
+        holdout = HoldoutFeatures(holdout_categories, holdout_observations, holdout_confidences, holdout_indices,
+                                  ground_truth=ground_truth)
+    else:
+        ground_truth = get_ground_truth(categories, observations, confidences, num_classes, args.metric, args.mode,
+                                        topk=args.topk)
+    prior = np.ones((num_classes, 2)) / 2 * args.pseudocount
+
+    num_samples = len(observations)
+    results = defaultdict(list)
+    for r in range(args.num_runs):
+        np.random.seed(r)
+        sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices = \
+            get_samples_topk(args, categories, observations, confidences, labels, indices, num_classes, num_samples,
+                             sample_method='ts', prior=prior, random_seed=r)
+        if args.metric == 'accuracy':
+            agreement, mrr = evaluate(args, sampled_categories, sampled_observations, sampled_scores, sampled_labels,
+                                      sampled_indices, ground_truth, num_classes, prior=prior)
+        else:
+            agreement, ece, mrr = evaluate(args, sampled_categories, sampled_observations, sampled_scores,
+                                           sampled_labels, sampled_indices, ground_truth, num_classes,
+                                           holdout_categories=holdout_categories,
+                                           holdout_observations=holdout_observations,
+                                           holdout_confidences=holdout_confidences,
+                                           holdout_labels=holdout_labels,
+                                           holdout_indices=holdout_indices,
+                                           holdout=holdout)
+            results['holdout_ece'].append(ece)
+        results['avg_num_agreement'].append(agreement)
+        results['mrr'].append(mrr)
+
+    return {metric: np.array(value) for metric, value in results.items()}
+
+
+def main(args: argparse.Namespace) -> None:
+    results_64 = run_precision(args, 'float64')
+    results_32 = run_precision(args, 'float32')
+
+    try:
+        os.stat(args.output)
+    except:
+        os.mkdir(args.output)
+
+    for metric in results_64:
+        curve_64 = results_64[metric].mean(axis=0)
+        curve_32 = results_32[metric].astype(np.float64).mean(axis=0)
+        max_abs_diff = np.max(np.abs(curve_64 - curve_32))
+        logger.info('%s :: max abs difference between float32 and float64 curves: %.6f', metric, max_abs_diff)
+
+        filename = args.output + "%s_%s_%s_top%d_%s.csv" % (args.dataset, args.metric, args.mode, args.topk, metric)
+        np.savetxt(filename, np.array([curve_64, curve_32, np.abs(curve_64 - curve_32)]).T, delimiter=',',
+                   header='float64, float32, abs_diff')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dataset', type=str, default='cifar100', help='input dataset')
+    parser.add_argument('--output', type=str, default=OUTPUT_DIR, help='output prefix')
+    parser.add_argument('-topk', type=int, default=1, help='number of optimal arms to identify')
+    parser.add_argument('-metric', type=str, default='accuracy', help='accuracy or calibration_error')
+    parser.add_argument('-pseudocount', type=float, default=PRIOR_STRENGTH, help='strength of prior')
+    parser.add_argument('-mode', type=str, default='min', help='min or max, identify topk with highest/lowest reward')
+    parser.add_argument('--calibration_model', type=str, default=CALIBRATION_MODEL,
+                        help='calibration models to apply on holdout data')
+    parser.add_argument('--num_runs', type=int, default=NUM_RUNS, help='number of runs per precision')
+
+    add_checkpoint_arguments(parser)
+
+    args, _ = parser.parse_known_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.dataset not in DATASET_LIST:
+        raise ValueError("%s is not in DATASET_LIST." % args.dataset)
+
+    main(args)
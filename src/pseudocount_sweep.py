@@ -0,0 +1,70 @@
+import argparse
+import logging
+import pathlib
+
+from utils import *
+
+PSEUDOCOUNTS = [0.1, 0.5, 1, 2, 3, 5, 10, 20, 50]
+
+logger = logging.getLogger(__name__)
+
+
+def main(args: argparse.Namespace) -> None:
+    """
+    Evaluate the accuracy samples of an existing experiment under uniform and informed priors of every pseudocount.
+        The samples do not change with the prior, so no sampling is repeated; for each run the checkpoint counts are
+        computed once and shared by all priors.
+    """
+    args.metric = 'accuracy'
+    args.precision = PRECISION
+    num_classes = NUM_CLASSES_DICT[args.dataset]
+    dataset = PredictionSet.from_file(DATAFILE_LIST[args.dataset])
+    categories, observations, confidences, labels, indices = dataset.astuple()
+    ground_truth = get_ground_truth(categories, observations, confidences, num_classes, args.metric, args.mode,
+                                    topk=args.topk)
+
+    confidence = get_confidence_k(categories, confidences, num_classes)
+    uniform_prior = np.ones((num_classes, 2)) / 2
+    informed_prior = np.array([confidence, 1 - confidence]).T
+    priors = np.array([uniform_prior * pseudocount for pseudocount in args.pseudocounts] +
+                      [informed_prior * pseudocount for pseudocount in args.pseudocounts])
+
+    trajectory = load_trajectory(args.experiment, args.method, dataset)
+    sampled_categories, sampled_observations = trajectory.categories, trajectory.observations
+    num_runs, num_samples = sampled_categories.shape
+    num_checkpoints = get_checkpoint_schedule(args, LOG_FREQ).num_checkpoints(num_samples)
+
+    avg_num_agreement = np.zeros((num_runs, len(priors), num_checkpoints))
+    mrr = np.zeros((num_runs, len(priors), num_checkpoints))
+    for r in range(num_runs):
+        avg_num_agreement[r], mrr[r] = evaluate_priors(args, sampled_categories[r], sampled_observations[r],
+                                                       ground_truth, num_classes, priors)
+
+    header = ', '.join(['uniform_%g' % pseudocount for pseudocount in args.pseudocounts] +
+                       ['informed_%g' % pseudocount for pseudocount in args.pseudocounts])
+    for metric, value in [('avg_num_agreement', avg_num_agreement), ('mrr', mrr)]:
+        curves = value.mean(axis=0)
+        for name, curve in zip(header.split(', '), curves):
+            logger.info('%s :: %s :: %s prior :: mean over checkpoints %.4f', args.method, metric, name, curve.mean())
+        np.savetxt(args.experiment / ('pseudocount_sweep_%s_%s.csv' % (metric, args.method)), curves.T,
+                   delimiter=',', header=header)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dataset', type=str, default='cifar100', help='input dataset')
+    parser.add_argument('experiment', type=pathlib.Path, help='experiment directory with sampled trajectories')
+    parser.add_argument('--method', type=str, default='non-active', help='sampled method to evaluate')
+    parser.add_argument('-topk', type=int, default=1, help='number of optimal arms to identify')
+    parser.add_argument('-mode', type=str, default='min', help='min or max, identify topk with highest/lowest reward')
+    parser.add_argument('--pseudocounts', type=float, nargs='+', default=PSEUDOCOUNTS, help='prior strengths')
+
+    add_checkpoint_arguments(parser)
+
+    args, _ = parser.parse_known_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.dataset not in DATASET_LIST:
+        raise ValueError("%s is not in DATASET_LIST." % args.dataset)
+
+    main(args)
@@ -0,0 +1,234 @@
+"""
+Evaluation results of an experiment in a single HDF5 file. Every metric of every method is a chunked
+(num_runs, num_checkpoints) dataset with one chunk per run, so workers write the row of a run as soon as it is
+evaluated and readers fetch only the runs and checkpoints they need. Summary statistics over runs are written when the
+store is finalized.
+"""
+import pathlib
+from multiprocessing import Lock
+from typing import Any, Dict, List, Union
+
+import h5py
+import numpy as np
+import scipy.stats
+
+RESULT_FILE = 'results.h5'
+QUANTILES = [0.025, 0.25, 0.5, 0.75, 0.975]
+STATISTICS = ['mean', 'std', 'quantiles']
+CI_LEVEL = 0.95
+
+
+class ResultStore:
+    """
+    Per-run evaluation curves of an experiment, e.g. avg_num_agreement, mrr or holdout_ece_<calibration_model> of
+        every method. The file is opened for every operation while holding a lock, so that worker processes that share
+        the lock can write to the same store.
+    """
+
+    def __init__(self, directory: Union[str, pathlib.Path], num_runs: int, lock: Lock = None, dtype=np.float64):
+        """
+        :param directory: str or pathlib.Path
+            Experiment directory.
+        :param num_runs: int
+            Number of rows allocated for every curve. Rows of runs that were not written are NaN.
+        :param lock: multiprocessing.Lock
+            Lock shared by all processes writing to the store. Default: None, i.e. a new lock.
+        :param dtype: np.dtype
+            Floating point precision of the curves and their summaries. Default: np.float64.
+        """
+        self.path = pathlib.Path(directory) / RESULT_FILE
+        self.num_runs = num_runs
+        self.dtype = dtype
+        self._lock = Lock() if lock is None else lock
+
+    def write_run(self, metric: str, method: str, run_idx: int, values: np.ndarray,
+                  checkpoints: np.ndarray = None) -> None:
+        """
+        Write the curve of a single run.
+        :param metric: str
+        :param method: str
+        :param run_idx: int
+        :param values: np.ndarray (num_checkpoints, )
+        :param checkpoints: np.ndarray (num_checkpoints, )
+            Sample indices the values were evaluated at, stored with the curve. Default: None.
+        """
+        values = np.asarray(values, dtype=self.dtype)
+        with self._lock, h5py.File(self.path, 'a') as f:
+            group = f.require_group('%s/%s' % (metric, method))
+            if 'runs' not in group:
+                group.create_dataset('runs', shape=(self.num_runs, len(values)), maxshape=(None, len(values)),
+                                     chunks=(1, len(values)), dtype=self.dtype, fillvalue=np.nan)
+            if checkpoints is not None:
+                group.attrs['checkpoints'] = np.asarray(checkpoints, dtype=np.int64)
+            runs = group['runs']
+            if runs.shape[1] != len(values) or runs.dtype != values.dtype:
+                raise ValueError("%s/%s holds curves of %d checkpoints in %s, not %d in %s. Remove it before writing "
+                                 "the runs of another evaluation." % (metric, method, runs.shape[1], runs.dtype,
+                                                                      len(values), values.dtype))
+            if run_idx >= runs.shape[0]:
+                runs.resize(run_idx + 1, axis=0)
+            runs[run_idx] = values
+            # summaries are stale until the store is finalized again
+            for statistic in STATISTICS:
+                if statistic in group:
+                    del group[statistic]
+
+    def write_runs(self, metric: str, method: str, values: np.ndarray) -> None:
+        """
+        Write the curves of all runs at once.
+        :param values: np.ndarray (num_runs, num_checkpoints)
+        """
+        for run_idx, row in enumerate(values):
+            self.write_run(metric, method, run_idx, row)
+
+    def remove(self, metric: str, method: str) -> None:
+        """
+        Remove the curves of a method, e.g. before they are rewritten from scratch.
+        """
+        if (metric, method) not in self:
+            return
+        with self._lock, h5py.File(self.path, 'a') as f:
+            del f[metric][method]
+
+    def finalize(self, quantiles: List[float] = QUANTILES) -> None:
+        """
+        Write the mean, standard deviation and quantiles over the finished runs of every curve.
+        :param quantiles: List[float]
+            Default: QUANTILES.
+        """
+        with self._lock, h5py.File(self.path, 'a') as f:
+            for metric in f:
+                for method in f[metric]:
+                    group = f[metric][method]
+                    runs = group['runs'][()]
+                    runs = runs[~np.isnan(runs).all(axis=1)]
+                    for statistic, value in _summarize(runs, quantiles).items():
+                        if statistic in group:
+                            del group[statistic]
+                        group.create_dataset(statistic, data=value.astype(runs.dtype, copy=False))
+                    group['quantiles'].attrs['q'] = quantiles
+                    group.attrs['num_finished'] = len(runs)
+
+    def read(self, metric: str, method: str, runs=slice(None), checkpoints=slice(None)) -> np.ndarray:
+        """
+        Read a slice of the per-run curves.
+        :param runs: slice or index array. Default: all runs.
+        :param checkpoints: slice or index array. Default: all checkpoints.
+        :return: np.ndarray
+        """
+        with h5py.File(self.path, 'r') as f:
+            return f[metric][method]['runs'][runs, checkpoints]
+
+    def write_metadata(self, **metadata) -> None:
+        """
+        Attributes of the whole experiment, e.g. the labeling budget, stored next to the curves.
+        """
+        with self._lock, h5py.File(self.path, 'a') as f:
+            f.attrs.update(metadata)
+
+    def metadata(self) -> Dict[str, Any]:
+        """
+        Attributes written by write_metadata.
+        """
+        if not self.path.is_file():
+            return {}
+        with h5py.File(self.path, 'r') as f:
+            return dict(f.attrs)
+
+    def checkpoints(self, metric: str, method: str) -> np.ndarray:
+        """
+        Sample indices of the checkpoints of a curve, or None if they were not stored.
+        """
+        with h5py.File(self.path, 'r') as f:
+            group = f[metric][method]
+            if 'checkpoints' in group.attrs:
+                return group.attrs['checkpoints'][()]
+        return None
+
+    def summary(self, metric: str, method: str, statistic: str = 'mean') -> np.ndarray:
+        """
+        A summary statistic over runs, as written by finalize. Computed from the runs if the store was not finalized.
+        :param statistic: str
+            'mean', 'std' or 'quantiles'. Default: 'mean'.
+        :return: (num_checkpoints, ) array, or (len(QUANTILES), num_checkpoints) for 'quantiles'.
+        """
+        if statistic not in STATISTICS:
+            raise ValueError("%s is not in STATISTICS." % statistic)
+        with h5py.File(self.path, 'r') as f:
+            group = f[metric][method]
+            if statistic in group:
+                return group[statistic][()]
+            runs = group['runs'][()]
+        return _summarize(runs[~np.isnan(runs).all(axis=1)], QUANTILES)[statistic]
+
+    def __contains__(self, key) -> bool:
+        """
+        :param key: (metric, method)
+        """
+        if not self.path.is_file():
+            return False
+        with h5py.File(self.path, 'r') as f:
+            return '%s/%s' % key in f
+
+
+def _summarize(runs: np.ndarray, quantiles: List[float]) -> Dict[str, np.ndarray]:
+    return {
+        'mean': runs.mean(axis=0),
+        'std': runs.std(axis=0),
+        'quantiles': np.quantile(runs, quantiles, axis=0),
+    }
+
+
+def ci_width(runs: np.ndarray, level: float = CI_LEVEL) -> np.ndarray:
+    """
+    Width of the Student t confidence interval of the mean curve over runs, at every checkpoint.
+    :param runs: np.ndarray (num_runs, num_checkpoints)
+    :param level: float
+        Confidence level. Default: CI_LEVEL.
+    :return: np.ndarray (num_checkpoints, ), infinite with fewer than two runs.
+    """
+    num_runs = len(runs)
+    if num_runs < 2:
+        return np.full(runs.shape[1:], np.inf)
+    t = scipy.stats.t.ppf((1 + level) / 2, num_runs - 1)
+    return 2 * t * runs.std(axis=0, ddof=1) / np.sqrt(num_runs)
+
+
+def load_runs(directory: Union[str, pathlib.Path], metric: str, method: str) -> np.ndarray:
+    """
+    Per-run curves of a metric, from the result store of an experiment or from a %s_%s.npy file of earlier versions.
+    :return: (num_runs, num_checkpoints) array.
+    """
+    store = ResultStore(directory, 0)
+    if (metric, method) in store:
+        return store.read(metric, method)
+    return np.load(pathlib.Path(directory) / ('%s_%s.npy' % (metric, method)))
+
+
+def load_summary(directory: Union[str, pathlib.Path], metric: str, method: str, statistic: str = 'mean') -> np.ndarray:
+    """
+    A summary statistic of a metric over runs, without reading the per-run curves if the store was finalized. Falls
+        back to the %s_%s.npy files of earlier versions.
+    :return: See ResultStore.summary.
+    """
+    store = ResultStore(directory, 0)
+    if (metric, method) in store:
+        return store.summary(metric, method, statistic)
+    runs = np.load(pathlib.Path(directory) / ('%s_%s.npy' % (metric, method)))
+    return _summarize(runs, QUANTILES)[statistic]
+
+
+def load_checkpoints(directory: Union[str, pathlib.Path], metric: str, method: str, freq: int) -> np.ndarray:
+    """
+    Sample indices of the checkpoints of a metric. Curves stored without their checkpoints were evaluated every freq
+        samples.
+    :param freq: int
+        Checkpoint frequency of curves stored without checkpoints.
+    :return: (num_checkpoints, ) array.
+    """
+    store = ResultStore(directory, 0)
+    if (metric, method) in store:
+        checkpoints = store.checkpoints(metric, method)
+        if checkpoints is not None:
+            return checkpoints
+    return np.arange(len(load_summary(directory, metric, method))) * freq
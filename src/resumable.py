@@ -0,0 +1,257 @@
+"""
+Crash-safe execution of independent units of work, e.g. one run of one method. Workers commit the arrays of every
+finished unit to its own file with an atomic rename, and the parent records finished units and failed attempts in a
+manifest. A rerun after a crash only schedules the units without a file. Units that raise, or whose worker dies, are
+retried up to a bounded number of attempts.
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import pathlib
+import shutil
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+UNIT_DIR = 'units'
+MANIFEST_FILE = 'manifest.json'
+MAX_ATTEMPTS = 3
+
+logger = logging.getLogger(__name__)
+
+
+class UnitStore:
+    """
+    Committed units of one stage of an experiment, under <directory>/units/<kind>. The manifest holds a fingerprint of
+        the arguments the units were computed with; units of other arguments are discarded.
+    """
+
+    def __init__(self, directory: pathlib.Path, kind: str, fingerprint: Dict[str, Any] = None):
+        """
+        :param directory: pathlib.Path
+            Experiment directory.
+        :param kind: str
+            Name of the stage, e.g. 'sample' or 'eval'.
+        :param fingerprint: Dict[str, Any]
+            Arguments that determine the content of the units. Default: None.
+        """
+        self.directory = pathlib.Path(directory) / UNIT_DIR / kind
+        fingerprint = json.loads(json.dumps(fingerprint, sort_keys=True, default=str))
+
+        # the directory is created with the first unit, stores of finished stages leave no trace
+        manifest_path = self.directory / MANIFEST_FILE
+        manifest = json.loads(manifest_path.read_text()) if manifest_path.is_file() else None
+        if manifest is not None and manifest.get('fingerprint') == fingerprint:
+            self.manifest = manifest
+        else:
+            if manifest is not None:
+                logger.info('%s :: arguments changed, discarding units' % self.directory)
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.manifest = {'fingerprint': fingerprint, 'completed': [], 'attempts': {}, 'errors': {}}
+
+    def path(self, name: str) -> pathlib.Path:
+        return self.directory / ('%s.npz' % name)
+
+    def __contains__(self, name: str) -> bool:
+        # a worker may have committed a unit that the parent did not record before it died
+        return name in self.manifest['completed'] or self.path(name).is_file()
+
+    def commit(self, name: str, arrays: Dict[str, np.ndarray]) -> None:
+        """
+        Write the arrays of a unit. The file appears under its final name only once it is complete.
+        """
+        self.create()
+        tmp = self.directory / ('.%s.%d.tmp' % (name, os.getpid()))
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path(name))
+
+    def load(self, name: str) -> Dict[str, np.ndarray]:
+        with np.load(self.path(name)) as data:
+            return {key: data[key] for key in data.files}
+
+    def record_done(self, name: str) -> None:
+        self.create()
+        if name not in self.manifest['completed']:
+            self.manifest['completed'].append(name)
+            self._write_manifest()
+
+    def record_failure(self, name: str, error: str) -> int:
+        """
+        :return: Number of failed attempts of the unit so far.
+        """
+        self.create()
+        self.manifest['attempts'][name] = self.manifest['attempts'].get(name, 0) + 1
+        self.manifest['errors'][name] = error
+        self._write_manifest()
+        return self.manifest['attempts'][name]
+
+    def clear(self) -> None:
+        """
+        Remove all units and the manifest, e.g. once their results are written to the experiment directory.
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+        try:
+            self.directory.parent.rmdir()
+        except OSError:
+            # units of other stages remain
+            pass
+
+    def create(self) -> None:
+        """
+        Create the directory and manifest of the store, if they do not exist yet.
+        """
+        if not (self.directory / MANIFEST_FILE).is_file():
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._write_manifest()
+
+    def _write_manifest(self) -> None:
+        tmp = self.directory / ('.%s.%d.tmp' % (MANIFEST_FILE, os.getpid()))
+        tmp.write_text(json.dumps(self.manifest, indent=1, sort_keys=True))
+        os.replace(tmp, self.directory / MANIFEST_FILE)
+
+
+def array_digest(*arrays: np.ndarray) -> str:
+    """
+    sha1 of the content of arrays, e.g. of the trajectories a stage evaluates.
+    """
+    sha1 = hashlib.sha1()
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        sha1.update(('%s%s' % (array.dtype, array.shape)).encode())
+        sha1.update(array.tobytes())
+    return sha1.hexdigest()
+
+
+# Set by run_units before the pool is forked, read by the workers.
+_FCT = None
+_STARTED = None
+
+
+def _run_unit(unit_idx: int, store: UnitStore, name: str, task: Any) -> None:
+    _STARTED.put(unit_idx)
+    store.commit(name, _FCT(task))
+
+
+def run_units(fct: Callable[[Any], Dict[str, np.ndarray]],
+              units: List[Tuple[UnitStore, str, Any]],
+              processes: int,
+              max_attempts: int = MAX_ATTEMPTS,
+              on_done: Callable[[int], List[Tuple[UnitStore, str, Any]]] = None) -> List[int]:
+    """
+    Run all units that are not committed yet in a pool of forked workers. fct may be a closure, workers inherit it.
+    :param fct: Callable[[Any], Dict[str, np.ndarray]]
+        Computes the arrays of a unit from its task.
+    :param units: List[Tuple[UnitStore, str, Any]]
+        Store, name and task of every unit.
+    :param processes: int
+        Number of worker processes.
+    :param max_attempts: int
+        Number of times a unit is attempted before it is given up. Default: MAX_ATTEMPTS.
+    :param on_done: Callable[[int], List[Tuple[UnitStore, str, Any]]]
+        Called in the parent with the position of every committed unit, including units committed by earlier runs. The
+            units it returns, e.g. a further batch of runs, are appended to units and run as well.
+    :return: Positions of the units that failed max_attempts times.
+    """
+    global _FCT, _STARTED
+    context = multiprocessing.get_context('fork')
+    _FCT, _STARTED = fct, context.SimpleQueue()
+
+    pending = deque()
+    failed = []
+    num_committed = [0]
+
+    def done(unit_idx: int) -> None:
+        store, name, _ = units[unit_idx]
+        store.record_done(name)
+        more = on_done(unit_idx) if on_done is not None else None
+        if more:
+            units.extend(more)
+            add(len(units) - len(more))
+
+    def add(first: int) -> None:
+        for unit_idx in range(first, len(units)):
+            store, name, _ = units[unit_idx]
+            if name in store:
+                num_committed[0] += 1
+                done(unit_idx)
+            else:
+                pending.append(unit_idx)
+
+    def retry(unit_idx: int, error: str) -> None:
+        store, name, _ = units[unit_idx]
+        attempts = store.record_failure(name, error)
+        if attempts < max_attempts:
+            logger.warning('%s :: attempt %d failed :: %s' % (name, attempts, error))
+            pending.append(unit_idx)
+        else:
+            logger.error('%s :: giving up after %d attempts :: %s' % (name, attempts, error))
+            failed.append(unit_idx)
+
+    add(0)
+    if num_committed[0]:
+        logger.info('Resuming, %d units are committed' % num_committed[0])
+
+    progress = tqdm(total=0)
+    started = set()
+
+    def drain_started() -> None:
+        # drained continuously, workers block once the pipe is full
+        while not _STARTED.empty():
+            started.add(_STARTED.get())
+
+    while pending:
+        interrupted = []
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+            futures = {}
+
+            def submit() -> None:
+                while pending:
+                    unit_idx = pending.popleft()
+                    futures[executor.submit(_run_unit, unit_idx, *units[unit_idx])] = unit_idx
+                    progress.total += 1
+                progress.refresh()
+
+            submit()
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                drain_started()
+                for future in finished:
+                    unit_idx = futures.pop(future)
+                    try:
+                        future.result()
+                    except BrokenProcessPool:
+                        interrupted.append(unit_idx)
+                        continue
+                    except Exception as e:
+                        started.discard(unit_idx)
+                        retry(unit_idx, repr(e))
+                        continue
+                    finally:
+                        progress.update()
+                    started.discard(unit_idx)
+                    done(unit_idx)
+                # retried units and units added by on_done run in the same pool, unless it is broken
+                if not interrupted:
+                    submit()
+
+        if interrupted:
+            # a worker died, e.g. killed for running out of memory. Only the units that had started are charged an
+            # attempt, the others were waiting in the queue of the broken pool.
+            drain_started()
+            for unit_idx in interrupted:
+                if unit_idx in started:
+                    started.discard(unit_idx)
+                    retry(unit_idx, 'worker process died')
+                else:
+                    pending.append(unit_idx)
+    progress.close()
+    return failed
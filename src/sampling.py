@@ -6,18 +6,149 @@ import numpy as np
 
 from models import BetaBernoulli
 
+TTTS_BLOCK_SIZE = 1
 
-def random_sampling(deques: List[deque], topk: int = 1, **kwargs) -> Union[int, List[int]]:
+
+class FenwickTree:
+    """
+    Binary indexed tree over non-negative weights, with O(log n) weight updates and O(log n) sampling of an index with
+        probability proportional to its weight.
+    """
+
+    def __init__(self, weights: List[float]):
+        """
+        :param weights: List[float]
+            Initial weights.
+        """
+        self._n = len(weights)
+        self._weights = list(weights)
+        self._tree = [0] + list(weights)
+        for i in range(1, self._n + 1):
+            parent = i + (i & -i)
+            if parent <= self._n:
+                self._tree[parent] += self._tree[i]
+        self._total = sum(self._weights)
+        self._top_bit = 1 << (self._n.bit_length() - 1) if self._n > 0 else 0
+
+    def __len__(self):
+        return self._n
+
+    def __getitem__(self, i: int) -> float:
+        return self._weights[i]
+
+    @property
+    def total(self) -> float:
+        return self._total
+
+    def add(self, i: int, delta: float) -> None:
+        """
+        Add delta to the weight of index i.
+        """
+        self._weights[i] += delta
+        self._total += delta
+        i += 1
+        while i <= self._n:
+            self._tree[i] += delta
+            i += i & -i
+
+    def set(self, i: int, weight: float) -> None:
+        """
+        Set the weight of index i.
+        """
+        if weight != self._weights[i]:
+            self.add(i, weight - self._weights[i])
+
+    def find(self, u: float) -> int:
+        """
+        The smallest index i such that the sum of weights 0, ..., i exceeds u.
+        :param u: float
+            Between 0 and total.
+        """
+        position = 0
+        step = self._top_bit
+        while step:
+            if position + step <= self._n and self._tree[position + step] <= u:
+                position += step
+                u -= self._tree[position]
+            step >>= 1
+        return min(position, self._n - 1)
+
+    def sample(self) -> int:
+        """
+        Draw an index with probability proportional to its weight, using the random module.
+        """
+        return self.find(random.random() * self._total)
+
+
+class ArmWeights(FenwickTree):
     """
-    Draw topk samples with random sampling.
+    Sampling weights of arms, either uniform over arms with samples left or proportional to the number of samples left.
+        The weights are updated with update after every pop from a deque.
+    """
+
+    def __init__(self, deques: List[deque], proportional: bool = False):
+        """
+        :param deques: List[deque]
+            A list of deques, each contains a deque of samples from one predicted class.
+        :param proportional: bool
+            Whether weights are proportional to the number of samples left in each deque. Default: False.
+        """
+        self._proportional = proportional
+        super().__init__([self._weight(len(_deque)) for _deque in deques])
+        self.num_live = sum(len(_deque) > 0 for _deque in deques)
+
+    def _weight(self, remaining: int) -> int:
+        return remaining if self._proportional else min(remaining, 1)
+
+    def update(self, category: int, remaining: int) -> None:
+        """
+        Update the weight of an arm.
+        :param category: int
+            The index of the arm.
+        :param remaining: int
+            The number of samples left in the deque of the arm.
+        """
+        if self[category] > 0 and remaining == 0:
+            self.num_live -= 1
+        self.set(category, self._weight(remaining))
+
+    def sample_without_replacement(self, topk: int) -> List[int]:
+        """
+        Draw topk distinct arms, each draw proportional to the weights of the arms not drawn yet.
+        :param topk: int
+            At most num_live.
+        """
+        categories_list = []
+        drawn_weights = []
+        for _ in range(topk):
+            category = self.sample()
+            categories_list.append(category)
+            drawn_weights.append(self[category])
+            self.add(category, -self[category])
+        # restore the weights of drawn arms, the caller updates them once their samples are popped
+        for category, weight in zip(categories_list, drawn_weights):
+            self.add(category, weight)
+        return categories_list
+
+
+def random_sampling(deques: List[deque], topk: int = 1, arm_weights: ArmWeights = None,
+                    **kwargs) -> Union[int, List[int]]:
+    """
+    Draw topk samples with random sampling, uniformly over classes with samples left.
     :param deques: List[deque]
         A list of deques, each contains a deque of samples from one predicted class.
     :param topk: int
         The number of extreme classes to identify. Default: 1.
+    :param arm_weights: ArmWeights
+        Uniform weights over classes with samples left, kept up to date by the caller. Arms are drawn from the tree in
+            O(log k) instead of by rejection. Default: None.
     :param kwargs:
     :return: Union[int, List[int]]
         A list of index if topk > 1 and topk < number of non-empty deques; else return one index.
     """
+    if arm_weights is not None:
+        return _sample_arm_weights(arm_weights, topk)
+
     while True:
         # select each class randomly
         if topk == 1:
@@ -30,7 +161,34 @@ def random_sampling(deques: List[deque], topk: int = 1, **kwargs) -> Union[int,
             if len(candidates) < topk:
                 return random_sampling(deques, topk=1)
             else:  # there are less than topk available arms to play
-                return random.sample(candidates, topk)
+                return random.sample(sorted(candidates), topk)
+
+
+def random_pool_sampling(deques: List[deque], topk: int = 1, arm_weights: ArmWeights = None,
+                         **kwargs) -> Union[int, List[int]]:
+    """
+    Draw topk samples with random sampling, with classes drawn in proportion to their number of samples left. Since
+        deques are shuffled, this draws samples uniformly from the remaining pool.
+    :param deques: List[deque]
+        A list of deques, each contains a deque of samples from one predicted class.
+    :param topk: int
+        The number of extreme classes to identify. Default: 1.
+    :param arm_weights: ArmWeights
+        Weights proportional to the samples left in each class, kept up to date by the caller. If None, the weights are
+            built from the deques in O(k). Default: None.
+    :param kwargs:
+    :return: Union[int, List[int]]
+        A list of index if topk > 1 and topk < number of non-empty deques; else return one index.
+    """
+    if arm_weights is None:
+        arm_weights = ArmWeights(deques, proportional=True)
+    return _sample_arm_weights(arm_weights, topk)
+
+
+def _sample_arm_weights(arm_weights: ArmWeights, topk: int) -> Union[int, List[int]]:
+    if topk == 1 or arm_weights.num_live < topk:
+        return arm_weights.sample()
+    return arm_weights.sample_without_replacement(topk)
 
 
 def thompson_sampling(deques: List[deque],
@@ -76,9 +234,33 @@ def thompson_sampling(deques: List[deque],
                         return categories_list
 
 
+def _extreme_arms(samples: np.ndarray, live: np.ndarray, mode: str, topk: int) -> np.ndarray:
+    """
+    The topk arms with lowest/highest sampled values among arms with samples left, for each of a block of samples.
+    :param samples: np.ndarray
+        A (k, ) sample or an (k, num_samples) block of samples.
+    :param live: np.ndarray (k, )
+        Whether each arm has samples left.
+    :param mode: str
+        'min' or 'max'
+    :param topk: int
+    :return: An (topk, num_samples) array of arm indices, sorted along the first axis.
+    """
+    samples = samples.reshape(live.shape[0], -1)
+    if mode == 'max':
+        samples = -samples
+    elif mode == 'min':
+        samples = samples.copy()
+    samples[np.invert(live)] = np.inf
+    if topk == 1:
+        return samples.argmin(axis=0)[np.newaxis, :]
+    return np.sort(np.argpartition(samples, topk - 1, axis=0)[:topk], axis=0)
+
+
 def top_two_thompson_sampling(deques: List[deque],
                               model: BetaBernoulli,
                               mode: str,
+                              topk: int = 1,
                               max_ttts_trial=50,
                               ttts_beta: float = 0.5,
                               **kwargs) -> Union[int, List[int]]:
@@ -86,12 +268,18 @@ def top_two_thompson_sampling(deques: List[deque],
     Draw topk samples with Top Two Thompson sampling.
         Russo, D.  Simple Bayesian algorithms for best arm iden-tification. InConference on Learning Theory,
             pp. 1417–1418, 2016.
+    The leader is the topk set of one posterior sample. With probability 1 - ttts_beta the challenger is played instead:
+        the topk set of the first of up to max_ttts_trial posterior samples whose topk set differs from the leader.
+        Samples are drawn and ranked in vectorized blocks of doubling size starting at TTTS_BLOCK_SIZE, so a step makes
+        O(log max_ttts_trial) calls to model.sample.
     :param deques: List[deque]
         A list of deques, each contains a deque of samples from one predicted class.
     :param model: BetaBernoulli
         A model for classwise accuracy.
     :param mode: str
         'min' or 'max'
+    :param topk: int
+        The number of extreme classes to identify. Default: 1.
     :param max_ttts_trial: int
         The number of trials to draw a different arm. Default: 50.
     :param ttts_beta: float
@@ -100,21 +288,29 @@ def top_two_thompson_sampling(deques: List[deque],
     :return: Union[int, List[int]]
         A list of index if topk > 1 and topk < number of non-empty deques; else return one index.
     """
-    category_1 = thompson_sampling(deques, model, mode)
+    live = np.array([len(_deque) > 0 for _deque in deques])
+    if live.sum() < topk:
+        topk = 1
+
+    selected = _extreme_arms(model.sample(), live, mode, topk)[:, 0]
     # toss a coin with probability beta
     B = np.random.binomial(1, ttts_beta)
-    if B == 1:
-        return category_1
-    else:
-        count = 0
-        while True:
-            category_2 = thompson_sampling(deques, model, mode)
-            if category_2 != category_1:
-                return category_2
-            else:
-                count += 1
-                if count == max_ttts_trial:
-                    return category_1
+    if B == 0:
+        num_trials = 0
+        block_size = TTTS_BLOCK_SIZE
+        while num_trials < max_ttts_trial:
+            block_size = min(block_size, max_ttts_trial - num_trials)
+            challengers = _extreme_arms(model.sample(block_size), live, mode, topk)
+            differs = np.any(challengers != selected[:, np.newaxis], axis=0)
+            if differs.any():
+                selected = challengers[:, differs.argmax()]
+                break
+            num_trials += block_size
+            block_size *= 2
+
+    if topk == 1:
+        return int(selected[0])
+    return selected.tolist()
 
 
 def epsilon_greedy(deques: List[deque],
@@ -218,8 +414,161 @@ def bayesian_UCB(deques: List[deque],
 
 SAMPLE_CATEGORY = {
     'random': random_sampling,
+    'random_pool': random_pool_sampling,
     'ts': thompson_sampling,
     'ttts': top_two_thompson_sampling,
     'epsilon_greedy': epsilon_greedy,
     'bayesian_ucb': bayesian_UCB
 }
+
+
+def thompson_sampling_batch(deques: List[deque],
+                            model: BetaBernoulli,
+                            mode: str,
+                            batch_size: int,
+                            topk: int = 1,
+                            **kwargs) -> List[int]:
+    """
+    Draw a batch of samples with independent Thompson draws from a posterior that stays frozen for the whole batch.
+        All draws are made with a single call to model.sample. Each draw selects up to topk distinct arms, and an arm
+        is never selected more often than it has samples left.
+    :param deques: List[deque]
+        A list of deques, each contains a deque of samples from one predicted class.
+    :param model: BetaBernoulli
+        A model for classwise accuracy.
+    :param mode: str
+        'min' or 'max'
+    :param batch_size: int
+        The number of samples to select.
+    :param topk: int
+        The number of extreme classes to identify. Default: 1.
+    :param kwargs:
+    :return: List[int]
+        A list of at most batch_size indices.
+    """
+    remaining = np.array([len(_deque) for _deque in deques])
+    batch_size = min(batch_size, remaining.sum())
+    num_draws = -(-batch_size // topk)
+    samples = model.sample(num_draws).reshape(len(deques), num_draws)
+    if mode == 'max':
+        ranked = np.argsort(-samples, axis=0)
+    elif mode == 'min':
+        ranked = np.argsort(samples, axis=0)
+
+    categories_list = []
+    for draw in ranked.T:
+        num_selected = 0
+        for category in draw:
+            if remaining[category] > 0:
+                categories_list.append(category)
+                remaining[category] -= 1
+                num_selected += 1
+                if num_selected == topk or len(categories_list) == batch_size:
+                    break
+        if len(categories_list) == batch_size:
+            break
+    return categories_list
+
+
+def select_batch(sample_method: str,
+                 deques: List[deque],
+                 model: BetaBernoulli,
+                 mode: str,
+                 batch_size: int,
+                 topk: int = 1,
+                 **kwargs) -> List[int]:
+    """
+    Select a batch of samples against a posterior that stays frozen for the whole batch, the labels are only used to
+        update the model once the batch is complete. Methods in BATCH_SAMPLE_CATEGORY select the batch at once, any
+        other method in SAMPLE_CATEGORY is called repeatedly while the selected samples are counted as taken.
+    :param sample_method: str
+        A key of SAMPLE_CATEGORY.
+    :param deques: List[deque]
+        A list of deques, each contains a deque of samples from one predicted class.
+    :param model: BetaBernoulli
+        A model for classwise accuracy.
+    :param mode: str
+        'min' or 'max'
+    :param batch_size: int
+        The number of samples to select.
+    :param topk: int
+        The number of extreme classes to identify. Default: 1.
+    :param kwargs:
+        Passed to the sampling method.
+    :return: List[int]
+        A list of at most batch_size indices.
+    """
+    if sample_method in BATCH_SAMPLE_CATEGORY:
+        return BATCH_SAMPLE_CATEGORY[sample_method](deques=deques, model=model, mode=mode, batch_size=batch_size,
+                                                    topk=topk, **kwargs)
+
+    # sampling methods only look at the number of samples left in each deque
+    remaining = [range(len(_deque)) for _deque in deques]
+    batch_size = min(batch_size, sum(len(_range) for _range in remaining))
+    categories_list = []
+    while len(categories_list) < batch_size:
+        selected = SAMPLE_CATEGORY[sample_method](deques=remaining, model=model, mode=mode, topk=topk, **kwargs)
+        if type(selected) != list:
+            selected = [selected]
+            topk = 1
+        for category in selected[:batch_size - len(categories_list)]:
+            categories_list.append(category)
+            remaining[category] = range(len(remaining[category]) - 1)
+    return categories_list
+
+
+BATCH_SAMPLE_CATEGORY = {
+    'ts': thompson_sampling_batch,
+}
+
+
+def exhaustion_schedule(categories: np.ndarray, num_runs: int, random_state: np.random.RandomState) -> np.ndarray:
+    """
+    Orders in which samples are drawn by random sampling with topk == 1, i.e. by repeatedly drawing a class uniformly
+        among classes with samples left and taking the next sample of its shuffled deque, for num_runs runs at once.
+        Every class emits its samples at the arrival times of a rate 1 Poisson process. At any time the next emission
+        comes uniformly from the classes with samples left, so sorting all emissions by time yields the same process.
+    :param categories: np.ndarray (num_samples, )
+        Predicted classes of the samples.
+    :param num_runs: int
+    :param random_state: np.random.RandomState
+    :return: An (num_runs, num_samples) array of sample indices in the order they are drawn.
+    """
+    categories = np.asarray(categories)
+    num_samples = categories.shape[0]
+    # group samples by class, in random order within each class
+    grouped = np.argsort(categories[np.newaxis, :] + random_state.random_sample((num_runs, num_samples)), axis=1)
+    grouped_categories = np.sort(categories)
+    # emission times: cumulative sums of exponential waiting times within each class
+    times = np.cumsum(random_state.standard_exponential((num_runs, num_samples)), axis=1)
+    starts = np.flatnonzero(np.r_[True, grouped_categories[1:] != grouped_categories[:-1]])
+    offsets = np.zeros((num_runs, starts.shape[0]))
+    offsets[:, 1:] = times[:, starts[1:] - 1]
+    times -= np.repeat(offsets, np.diff(np.r_[starts, num_samples]), axis=1)
+    return np.take_along_axis(grouped, np.argsort(times, axis=1), axis=1)
+
+
+def pool_permutation(categories: np.ndarray, num_runs: int, random_state: np.random.RandomState) -> np.ndarray:
+    """
+    Orders in which samples are drawn by random_pool sampling with topk == 1, i.e. uniformly from the remaining pool,
+        for num_runs runs at once.
+    :param categories: np.ndarray (num_samples, )
+        Predicted classes of the samples.
+    :param num_runs: int
+    :param random_state: np.random.RandomState
+    :return: An (num_runs, num_samples) array of sample indices in the order they are drawn.
+    """
+    return np.argsort(random_state.random_sample((num_runs, len(categories))), axis=1)
+
+
+# sampling methods that do not depend on the model, mapped to functions generating whole runs at once for topk == 1
+SAMPLE_SCHEDULE = {
+    'random': exhaustion_schedule,
+    'random_pool': pool_permutation,
+}
+
+# sampling methods that draw arms from ArmWeights, mapped to whether weights are proportional to the samples left
+ARM_WEIGHTS = {
+    'random': False,
+    'random_pool': True,
+}
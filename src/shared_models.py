@@ -0,0 +1,363 @@
+"""
+Shared-memory backends for the Bayesian assessment models, for labels ingested by several worker processes.
+The sufficient statistics of every model live in one multiprocessing.shared_memory block with a shard per worker.
+A worker only ever writes its own shard, so updates need no locks. A reader sums the shards and builds a regular
+model from the sum. Beta and Dirichlet counts are additive, so the merged model is the same model that would have
+seen every label in one process.
+"""
+import time
+from multiprocessing import shared_memory
+from typing import List, Tuple
+
+import numpy as np
+
+from models import Model, BetaBernoulli, ClasswiseEce, DirichletMultinomialCost, NORMAL_APPROXIMATION_THRESHOLD
+
+# dtype of the shards; integer counts are exact in float64 up to 2 ** 53
+SHARD_DTYPE = np.float64
+
+
+class SharedCounts:
+    """
+    An (num_workers, *shape) array of counts in a shared memory block, one shard per worker.
+    Pickling a SharedCounts pickles the name of the block, so worker processes attach to the same block whether they
+        are forked or spawned. Workers should be started with multiprocessing: they then share the resource tracker of
+        the creating process, while an unrelated process that attaches would unlink the block when it exits.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], num_workers: int, name: str = None):
+        """
+        :param shape: Tuple[int, ...]
+            Shape of the counts of a single worker.
+        :param num_workers: int
+            The number of shards.
+        :param name: str
+            Name of an existing block to attach to. Default: None, a new block is created.
+        """
+        if num_workers < 1:
+            raise ValueError("%s is not a valid number of workers." % num_workers)
+        self.shape = tuple(shape)
+        self.num_workers = num_workers
+        nbytes = max(int(np.prod((num_workers,) + self.shape)) * np.dtype(SHARD_DTYPE).itemsize, 1)
+        self._owner = name is None
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._shards = np.ndarray((num_workers,) + self.shape, dtype=SHARD_DTYPE, buffer=self._shm.buf)
+        if self._owner:
+            self._shards[:] = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def shard(self, worker: int) -> np.ndarray:
+        """
+        The counts written by one worker.
+        :param worker: int
+            Index of the worker in [0, num_workers).
+        :return: A view of shape self.shape into the shared block.
+        """
+        if not 0 <= worker < self.num_workers:
+            raise ValueError("%s is not a worker in [0, %d)." % (worker, self.num_workers))
+        return self._shards[worker]
+
+    def total(self) -> np.ndarray:
+        """
+        Sum of the counts of all workers. Shards are read while workers may be writing, so the sum can miss the labels
+            of updates in flight, but never counts a label twice.
+        :return: An array of shape self.shape.
+        """
+        return self._shards.sum(axis=0)
+
+    def close(self) -> None:
+        """
+        Detach this process from the block.
+        """
+        self._shards = None
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """
+        Free the block. Call once, from the process that created it, after every worker has closed it.
+        """
+        self._shm.unlink()
+
+    def __getstate__(self):
+        return {'shape': self.shape, 'num_workers': self.num_workers, 'name': self.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['shape'], state['num_workers'], name=state['name'])
+
+
+class SharedModel(Model):
+    """
+    Abstract base class of the shared-memory models. Workers call bind once and then update / update_batch, readers
+        call merge, or eval / sample which merge on demand.
+    Derived classes must implement an update, update_batch and _merge method.
+    """
+
+    def __init__(self, counts: SharedCounts, refresh: float = None):
+        """
+        :param counts: SharedCounts
+            The shared counts of the model.
+        :param refresh: float
+            Seconds a merged model is reused for by eval and sample before the shards are merged again.
+                Default: None, every call merges.
+        """
+        self.counts = counts
+        self.refresh = refresh
+        self._worker = None
+        self._shard = None
+        self._merged = None
+        self._merged_at = None
+
+    def bind(self, worker: int) -> 'SharedModel':
+        """
+        Direct the updates of this process to the shard of a worker. Two processes must never bind the same worker.
+        :param worker: int
+            Index of the worker in [0, num_workers).
+        :return: self
+        """
+        self._shard = self.counts.shard(worker)
+        self._worker = worker
+        return self
+
+    def _check_bound(self) -> np.ndarray:
+        if self._shard is None:
+            raise ValueError("%s is not bound to a worker, call bind first." % type(self).__name__)
+        return self._shard
+
+    def _merge(self, total: np.ndarray) -> Model:
+        raise NotImplementedError
+
+    def merge(self) -> Model:
+        """
+        Merge the shards of all workers into a regular model.
+        :return: Model
+            A model with the prior of this model and the labels of all workers.
+        """
+        self._merged = self._merge(self.counts.total())
+        self._merged_at = time.monotonic()
+        return self._merged
+
+    @property
+    def model(self) -> Model:
+        """
+        The last merged model, merged again if it is older than refresh seconds.
+        """
+        if self._merged is None or self.refresh is None or time.monotonic() - self._merged_at >= self.refresh:
+            self.merge()
+        return self._merged
+
+    @property
+    def eval(self):
+        return self.model.eval
+
+    def sample(self, num_samples: int = 1) -> np.ndarray:
+        return self.model.sample(num_samples)
+
+    def close(self) -> None:
+        self.counts.close()
+
+    def unlink(self) -> None:
+        self.counts.unlink()
+
+    def __getstate__(self):
+        # the merged model is local to a process, and a bound shard belongs to a single process
+        state = self.__dict__.copy()
+        state.update(_worker=None, _shard=None, _merged=None, _merged_at=None)
+        return state
+
+
+class SharedBetaBernoulli(SharedModel):
+    """
+    BetaBernoulli with the counts of correct and incorrect predictions per predicted class in shared memory.
+    """
+
+    def __init__(self, k: int, num_workers: int, prior=None, dtype=np.float64, sampler: str = 'exact',
+                 sampler_threshold: float = NORMAL_APPROXIMATION_THRESHOLD, refresh: float = None):
+        """
+        :param k: int
+            The number of classes.
+        :param num_workers: int
+            The number of worker processes updating the model.
+        :param prior: np.ndarray (k, 2) or None
+            alpha and beta parameters of prior Beta distributions. Default: None.
+        :param dtype: np.dtype
+            Floating point precision of the merged model. Default: np.float64.
+        :param sampler: str
+            Sampler of the merged model, one of BETA_SAMPLERS. Default: 'exact'.
+        :param sampler_threshold: float
+            Minimum alpha + beta for the 'normal' sampler. Default: NORMAL_APPROXIMATION_THRESHOLD.
+        :param refresh: float
+            See SharedModel. Default: None.
+        """
+        super().__init__(SharedCounts((k, 2), num_workers), refresh=refresh)
+        self._k = k
+        self._prior = prior
+        self._dtype = dtype
+        self._sampler = sampler
+        self._sampler_threshold = sampler_threshold
+
+    def _merge(self, total: np.ndarray) -> BetaBernoulli:
+        model = BetaBernoulli(self._k, prior=self._prior, dtype=self._dtype, sampler=self._sampler,
+                              sampler_threshold=self._sampler_threshold)
+        model._params += total.astype(self._dtype)
+        return model
+
+    @property
+    def variance(self) -> np.ndarray:
+        return self.model.variance
+
+    def get_params(self) -> np.ndarray:
+        return self.model.get_params()
+
+    def update(self, category: int, observation: bool) -> None:
+        """
+        Count one label in the shard of this worker. See BetaBernoulli.update.
+        """
+        self._check_bound()[category, 0 if observation else 1] += 1
+
+    def update_batch(self, categories: List[int], observations: List[bool]) -> None:
+        """
+        Count a batch of labels in the shard of this worker. See BetaBernoulli.update_batch.
+        """
+        categories = np.asarray(categories, dtype=int)
+        observations = np.asarray(observations, dtype=np.bool_)
+        np.add.at(self._check_bound(), (categories, np.invert(observations).astype(int)), 1)
+
+
+class SharedClasswiseEce(SharedModel):
+    """
+    ClasswiseEce with the counts of correct and incorrect predictions and the sum of scores per predicted class and bin
+        in shared memory. SumOfBetaEce keeps the running mean score of each bin, which is recovered from the sum.
+    """
+
+    def __init__(self, k: int, num_bins: int, pseudocount: float, num_workers: int, weight=None, prior=None,
+                 dtype=np.float64, sampler: str = 'exact', sampler_threshold: float = NORMAL_APPROXIMATION_THRESHOLD,
+                 refresh: float = None):
+        """
+        :param k: int
+            The number of classes.
+        :param num_bins: int
+            The number of bins for evaluating ECE.
+        :param pseudocount: float
+            The strength of priors for accuracy of each bin.
+        :param num_workers: int
+            The number of worker processes updating the model.
+        :param weight: a list of (num_bins, ) arrays of length k
+            Weight of each bin. Default: None.
+        :param prior: an (number of classes, k, 2) array
+            Alpha and beta parameters in the prior Beta distributions. Default: None.
+        :param dtype: np.dtype
+            Floating point precision of the merged model. Default: np.float64.
+        :param sampler: str
+            Sampler of the merged model, one of BETA_SAMPLERS. Default: 'exact'.
+        :param sampler_threshold: float
+            Minimum alpha + beta for the 'normal' sampler. Default: NORMAL_APPROXIMATION_THRESHOLD.
+        :param refresh: float
+            See SharedModel. Default: None.
+        """
+        # correct count, incorrect count and sum of scores per class and bin
+        super().__init__(SharedCounts((k, num_bins, 3), num_workers), refresh=refresh)
+        self._k = k
+        self._num_bins = num_bins
+        self._pseudocount = pseudocount
+        self._weight = weight
+        self._prior = prior
+        self._dtype = dtype
+        self._sampler = sampler
+        self._sampler_threshold = sampler_threshold
+
+    def _merge(self, total: np.ndarray) -> ClasswiseEce:
+        model = ClasswiseEce(self._k, self._num_bins, self._pseudocount, weight=self._weight, prior=self._prior,
+                             dtype=self._dtype, sampler=self._sampler, sampler_threshold=self._sampler_threshold)
+        total = total.astype(self._dtype)
+        for category, ece_model in enumerate(model._classwise_ece_models):
+            # SumOfBetaEce.update keeps confidence * counts equal to the initial value plus the sum of scores
+            initial = ece_model._confidence * ece_model._counts.sum(axis=1)
+            ece_model._alpha += total[category, :, 0]
+            ece_model._beta += total[category, :, 1]
+            ece_model._counts += total[category, :, :2]
+            ece_model._confidence = (initial + total[category, :, 2]) / ece_model._counts.sum(axis=1)
+        return model
+
+    @property
+    def variance(self) -> np.ndarray:
+        return self.model.variance
+
+    @property
+    def beta_params_mpe(self) -> np.ndarray:
+        return self.model.beta_params_mpe
+
+    def _bins(self, scores: np.ndarray) -> np.ndarray:
+        # same binning as SumOfBetaEce.update, a score of 1 falls in the last bin
+        return np.minimum(np.floor(scores * self._num_bins).astype(int), self._num_bins - 1)
+
+    def update(self, category: int, observation: bool, score: float) -> None:
+        """
+        Count one label in the shard of this worker. See ClasswiseEce.update.
+        """
+        self.update_batch([category], [observation], [score])
+
+    def update_batch(self, categories: List[int], observations: List[bool], scores: List[float]) -> None:
+        """
+        Count a batch of labels in the shard of this worker. See ClasswiseEce.update_batch.
+        """
+        shard = self._check_bound()
+        categories = np.asarray(categories, dtype=int)
+        observations = np.asarray(observations, dtype=np.bool_)
+        scores = np.asarray(scores, dtype=SHARD_DTYPE)
+        bins = self._bins(scores)
+        np.add.at(shard, (categories, bins, np.invert(observations).astype(int)), 1)
+        np.add.at(shard, (categories, bins, 2), scores)
+
+
+class SharedDirichletMultinomialCost(SharedModel):
+    """
+    DirichletMultinomialCost with the confusion counts in shared memory.
+    """
+
+    def __init__(self, alphas: np.ndarray, costs: np.ndarray, num_workers: int, dtype=np.float64,
+                 refresh: float = None):
+        """
+        :param alphas: np.ndarray (n_classes, n_classes)
+            Prior Dirichlet parameters, one row per predicted class.
+        :param costs: np.ndarray (n_classes, n_classes)
+            The cost matrix.
+        :param num_workers: int
+            The number of worker processes updating the model.
+        :param dtype: np.dtype
+            Floating point precision of the merged model. Default: np.float64.
+        :param refresh: float
+            See SharedModel. Default: None.
+        """
+        super().__init__(SharedCounts(np.shape(alphas), num_workers), refresh=refresh)
+        self._alphas = np.array(alphas, dtype=dtype)
+        self._costs = np.array(costs, dtype=dtype)
+        self._dtype = dtype
+
+    def _merge(self, total: np.ndarray) -> DirichletMultinomialCost:
+        return DirichletMultinomialCost(self._alphas + total.astype(self._dtype), self._costs, dtype=self._dtype)
+
+    @property
+    def eval(self) -> np.ndarray:
+        return self.model.mpe()
+
+    def mpe(self) -> np.ndarray:
+        return self.model.mpe()
+
+    def update(self, predicted_class: int, true_class: int) -> None:
+        """
+        Count one label in the shard of this worker. See DirichletMultinomialCost.update.
+        """
+        self._check_bound()[predicted_class, true_class] += 1
+
+    def update_batch(self, predicted_classes: List[int], true_classes: List[int]) -> None:
+        """
+        Count a batch of labels in the shard of this worker. See DirichletMultinomialCost.update_batch.
+        """
+        np.add.at(self._check_bound(), (np.asarray(predicted_classes, dtype=int), np.asarray(true_classes, dtype=int)),
+                  1)
@@ -0,0 +1,187 @@
+"""
+Stopping rules for active assessment. A stopping rule is checked after every labeled sample and ends the labeling loop
+once the topk classes are identified with enough confidence, or when a resource budget is exhausted.
+"""
+import time
+from typing import List
+
+import numpy as np
+
+from models import Model
+
+CONFIDENCE_CHECK_FREQ = 100
+CONFIDENCE_NUM_SAMPLES = 1000
+
+
+class StoppingRule:
+    """
+    Abstract base class to be inhereted by all stopping rules.
+    Derived classes must implement a should_stop method and set a name, which is reported as the stopping reason.
+    """
+    name = None
+
+    def reset(self) -> None:
+        """
+        Called once before the first sample is labeled.
+        """
+        pass
+
+    def should_stop(self, model: Model, num_labeled: int, mode: str, topk: int) -> bool:
+        """
+        Decide whether to stop labeling.
+        :param model: Model
+            The model of classwise performance, updated with all labeled samples.
+        :param num_labeled: int
+            The number of samples labeled so far.
+        :param mode: str
+            'min' or 'max'
+        :param topk: int
+            The number of extreme classes to identify.
+        :return: bool
+        """
+        raise NotImplementedError
+
+    @property
+    def reason(self) -> str:
+        """
+        Stopping reason reported when this rule fires.
+        """
+        return self.name
+
+
+class PosteriorConfidence(StoppingRule):
+    """
+    Stop once the posterior probability that the current MPE topk set is the true topk set exceeds 1 - delta.
+    """
+    name = 'confidence'
+
+    def __init__(self, delta: float = 0.05, check_freq: int = CONFIDENCE_CHECK_FREQ,
+                 num_samples: int = CONFIDENCE_NUM_SAMPLES):
+        """
+        :param delta: float
+            Allowed posterior probability of the topk set being wrong. Default: 0.05.
+        :param check_freq: int
+            The probability is only computed every check_freq labels. Default: CONFIDENCE_CHECK_FREQ.
+        :param num_samples: int
+            Number of posterior samples for the Monte Carlo estimate, used for models without a closed form
+                topk_set_probability. Default: CONFIDENCE_NUM_SAMPLES.
+        """
+        self.delta = delta
+        self.check_freq = check_freq
+        self.num_samples = num_samples
+        self.probability = None
+        self._last_check = 0
+
+    def reset(self) -> None:
+        self.probability = None
+        self._last_check = 0
+
+    def should_stop(self, model: Model, num_labeled: int, mode: str, topk: int) -> bool:
+        # batched labeling may step over multiples of check_freq
+        if num_labeled - self._last_check < self.check_freq:
+            return False
+        self._last_check = num_labeled
+        self.probability = topk_set_probability(model, mode, topk, self.num_samples)
+        return self.probability >= 1 - self.delta
+
+
+class LabelBudget(StoppingRule):
+    """
+    Stop after a fixed number of labels.
+    """
+    name = 'budget'
+
+    def __init__(self, budget: int):
+        """
+        :param budget: int
+            The maximum number of labeled samples.
+        """
+        self.budget = budget
+
+    def should_stop(self, model: Model, num_labeled: int, mode: str, topk: int) -> bool:
+        return num_labeled >= self.budget
+
+
+class WallTime(StoppingRule):
+    """
+    Stop once the labeling loop has run for longer than a time limit.
+    """
+    name = 'time'
+
+    def __init__(self, max_seconds: float):
+        """
+        :param max_seconds: float
+            The maximum wall time of the labeling loop in seconds.
+        """
+        self.max_seconds = max_seconds
+        self._start = None
+
+    def reset(self) -> None:
+        self._start = time.perf_counter()
+
+    def should_stop(self, model: Model, num_labeled: int, mode: str, topk: int) -> bool:
+        return time.perf_counter() - self._start >= self.max_seconds
+
+
+class AnyOf(StoppingRule):
+    """
+    Stop as soon as one of several stopping rules fires. The reason is the name of the first rule that fired.
+    """
+
+    def __init__(self, rules: List[StoppingRule]):
+        """
+        :param rules: List[StoppingRule]
+            Rules checked in order.
+        """
+        self.rules = rules
+        self.name = None
+
+    def reset(self) -> None:
+        self.name = None
+        for rule in self.rules:
+            rule.reset()
+
+    def should_stop(self, model: Model, num_labeled: int, mode: str, topk: int) -> bool:
+        for rule in self.rules:
+            if rule.should_stop(model, num_labeled, mode, topk):
+                self.name = rule.reason
+                return True
+        return False
+
+
+def topk_set_probability(model: Model, mode: str, topk: int, num_samples: int = CONFIDENCE_NUM_SAMPLES) -> float:
+    """
+    Posterior probability that the topk classes under the MPE of the model are the true topk classes. Computed in
+        closed form if the model provides topk_set_probability, otherwise estimated from posterior samples.
+    :param model: Model
+    :param mode: str
+        'min' or 'max'
+    :param topk: int
+        The number of extreme classes.
+    :param num_samples: int
+        Number of posterior samples for the Monte Carlo estimate. Default: CONFIDENCE_NUM_SAMPLES.
+    :return: float
+    """
+    metric_val = model.eval
+    if mode == 'min':
+        topk_indices = metric_val.argsort()[:topk]
+    elif mode == 'max':
+        topk_indices = metric_val.argsort()[-topk:]
+
+    if hasattr(model, 'topk_set_probability'):
+        return model.topk_set_probability(topk_indices, mode)
+
+    samples = model.sample(num_samples).reshape(len(metric_val), num_samples)  # (k, num_samples)
+    in_set = np.zeros((len(metric_val),), dtype=np.bool_)
+    in_set[topk_indices] = True
+    if mode == 'min':
+        return float(np.mean(samples[in_set].max(axis=0) < samples[~in_set].min(axis=0)))
+    elif mode == 'max':
+        return float(np.mean(samples[in_set].min(axis=0) > samples[~in_set].max(axis=0)))
+
+
+STOPPING_RULES = {
+    'confidence': PosteriorConfidence,
+    'budget': LabelBudget,
+    'time': WallTime,
+}
@@ -0,0 +1,563 @@
+"""
+Run a grid of topk, baseline and cost experiments in one process pool, instead of one backgrounded driver per
+configuration. Every dataset is parsed once and the immutable arrays of all configurations (predictions, priors, ground
+truth, holdout features) are built before the pool is forked, so workers share them copy-on-write. A unit of work is
+one sampled method of one run of one configuration: it samples a trajectory, evaluates it and commits the result to a
+file of its own (see resumable). An interrupted sweep resumes from the committed units. Once all units of a
+configuration are committed they are assembled into its result store and trajectories. Plots are made from the stored
+results with the plot stage of the drivers. With --ci_width, a configuration starts with a batch of runs and more
+batches are added until the confidence intervals of all its curves are narrower than the target.
+"""
+import os
+
+# the pool provides the parallelism, BLAS and OpenMP threads are pinned before numpy is imported
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                   'NUMEXPR_NUM_THREADS']
+for var in THREAD_ENV_VARS:
+    os.environ[var] = '1'
+
+import copy
+import itertools
+import pathlib
+from typing import Any, Dict, List, Tuple
+
+import active_learning_costs
+from checkpoints import EndOfRun
+from models import DirichletMultinomialCost
+from result_store import CI_LEVEL, ci_width
+from resumable import MAX_ATTEMPTS, run_units, UnitStore
+from utils import *
+
+EXPERIMENTS = ['topk', 'baselines', 'costs']
+TOPK_OUTPUT_DIR = RESULTS_DIR + 'active_learning_topk'
+
+# sampled method -> (sample_method of get_samples_topk, prior used for sampling, {result method: evaluation prior})
+# accuracy trajectories are evaluated under several priors at once, calibration error models take no prior.
+METHODS = {
+    ('topk', 'accuracy'): {
+        'non-active': ('random', 'no_prior', {'non-active_no_prior': 'no_prior',
+                                              'non-active_uniform': 'uniform',
+                                              'non-active_informed': 'informed'}),
+        'ts_uniform': ('ts', 'uniform', {'ts_uniform': 'uniform'}),
+        'ts_informed': ('ts', 'informed', {'ts_informed': 'informed'}),
+    },
+    ('topk', 'calibration_error'): {
+        'non-active': ('random', None, {'non-active': None}),
+        'ts': ('ts', None, {'ts': None}),
+    },
+    ('baselines', 'accuracy'): {
+        'epsilon_greedy': ('epsilon_greedy', 'no_prior', {'epsilon_greedy_no_prior': 'no_prior',
+                                                          'epsilon_greedy_uniform': 'uniform',
+                                                          'epsilon_greedy_informed': 'informed'}),
+        'bayesian_ucb': ('bayesian_ucb', 'no_prior', {'bayesian_ucb_no_prior': 'no_prior',
+                                                      'bayesian_ucb_uniform': 'uniform',
+                                                      'bayesian_ucb_informed': 'informed'}),
+    },
+    ('baselines', 'calibration_error'): {
+        'epsilon_greedy': ('epsilon_greedy', None, {'epsilon_greedy': None}),
+        'bayesian_ucb': ('bayesian_ucb', None, {'bayesian_ucb': None}),
+    },
+}
+# cost method -> (choice function, prior), named as in active_learning_costs.main
+COST_METHODS = {
+    'random_no_prior': (active_learning_costs.random_choice_fn, 'no_prior'),
+    'random_uniform': (active_learning_costs.random_choice_fn, 'uniform'),
+    'random_informed': (active_learning_costs.random_choice_fn, 'informed'),
+    'active': (active_learning_costs.max_choice_fn, 'uniform'),
+    'active_informed': (active_learning_costs.max_choice_fn, 'informed'),
+}
+COST_METRIC_NAMES = {'avg_num_agreement': 'success', 'mrr': 'mrr'}
+# runs added at a time when the number of runs is adaptive, at most RUNS or N_SIMULATIONS in total
+RUN_BATCH = 10
+
+logger = logging.getLogger(__name__)
+
+# Built by the parent before the pool is forked, read by the workers.
+_CONFIGS = []  # type: List[Tuple[str, argparse.Namespace]]
+_CONTEXTS = {}  # type: Dict[int, Dict[str, Any]]
+
+
+def expand_grid(args: argparse.Namespace) -> List[Tuple[str, argparse.Namespace]]:
+    """
+    All configurations of the sweep, as arguments of the drivers.
+    :param args: argparse.Namespace
+        Arguments of the sweep.
+    :return: List of (experiment, driver arguments).
+    """
+    configs = []
+    # the checkpoint schedule of every configuration, missing from queues enqueued before schedules existed
+    checkpoint_args = {key: value for key, value in vars(args).items() if key in CHECKPOINT_ARGS}
+    budget = getattr(args, 'budget', None)
+    for experiment in args.experiments:
+        if experiment not in EXPERIMENTS:
+            raise ValueError("%s is not in EXPERIMENTS." % experiment)
+        if experiment == 'costs':
+            for dataset, type_cost, topk, pseudocount in itertools.product(args.datasets, args.type_costs, args.topk,
+                                                                           args.pseudocounts):
+                output = pathlib.Path(active_learning_costs.OUTPUT_DIR if args.output is None else args.output)
+                output = output / type_cost
+                if args.batch_size > 1:
+                    output = output.parent / ('%s_batch%d' % (output.name, args.batch_size))
+                if budget is not None:
+                    output = output.parent / ('%s_budget%g' % (output.name, budget))
+                configs.append((experiment, argparse.Namespace(
+                    dataset=dataset, output=output, topk=topk, seed=args.seed, type_cost=type_cost,
+                    pseudocount=pseudocount, k=args.k, superclass=False, precision=args.precision,
+                    batch_size=args.batch_size, budget=budget, **checkpoint_args)))
+            continue
+
+        for dataset, metric, mode, topk, pseudocount in itertools.product(args.datasets, args.metrics, args.modes,
+                                                                          args.topk, args.pseudocounts):
+            if (experiment, metric) not in METHODS:
+                raise ValueError("%s is not a supported metric." % metric)
+            configs.append((experiment, argparse.Namespace(
+                dataset=dataset, output=pathlib.Path(TOPK_OUTPUT_DIR if args.output is None else args.output),
+                topk=topk, metric=metric, pseudocount=pseudocount, mode=mode, calibration_model=args.calibration_model,
+                processes=1, precision=args.precision, beta_sampler=args.beta_sampler,
+                beta_sampler_threshold=args.beta_sampler_threshold, batch_size=args.batch_size, debug=False,
+                budget=budget, **checkpoint_args)))
+    return configs
+
+
+def get_methods(experiment: str, config: argparse.Namespace, methods: List[str] = None) -> List[str]:
+    """
+    Sampled methods of a configuration, restricted to methods if given.
+    """
+    if experiment == 'costs':
+        all_methods = list(COST_METHODS)
+    else:
+        all_methods = list(METHODS[(experiment, config.metric)])
+    if methods is None:
+        return all_methods
+    return [method for method in all_methods if method in methods]
+
+
+def build_contexts(configs: List[Tuple[str, argparse.Namespace]]) -> Dict[int, Dict[str, Any]]:
+    """
+    Immutable inputs of every configuration. Datasets, holdout splits and ground truths are computed once and shared
+        by all configurations that use them.
+    :return: Dict maps the position of a configuration to its context.
+    """
+    datasets = {}
+    splits = {}
+    shared = {}
+    contexts = {}
+    for config_idx, (experiment, config) in enumerate(configs):
+        if experiment == 'costs':
+            key = ('costs', config.dataset, config.type_cost, config.topk, config.pseudocount, config.k)
+            if key not in shared:
+                if ('costs', config.dataset) not in datasets:
+                    datasets[('costs', config.dataset)] = active_learning_costs.load_dataset(config)
+                dataset = datasets[('costs', config.dataset)]
+                costs = active_learning_costs.get_costs(config, dataset)
+                expected_costs = (dataset.confusion_probs * costs).sum(axis=-1)
+                shared[key] = {
+                    'dataset': dataset,
+                    'costs': costs,
+                    'ground_truth': expected_costs.argsort()[-config.topk:][::-1].tolist(),
+                    'priors': {
+                        'no_prior': np.ones((dataset.num_classes, dataset.num_classes)) * 1e-3,
+                        'uniform': np.ones((dataset.num_classes, dataset.num_classes)) * config.pseudocount /
+                                   dataset.num_classes,
+                        'informed': config.pseudocount * dataset.confusion_prior,
+                    },
+                }
+            contexts[config_idx] = shared[key]
+            continue
+
+        key = (config.dataset, config.metric, config.mode, config.topk, config.pseudocount, config.calibration_model)
+        if key in shared:
+            contexts[config_idx] = shared[key]
+            continue
+
+        if config.dataset not in datasets:
+            logger.info('Loading %s' % config.dataset)
+            datasets[config.dataset] = PredictionSet.from_file(DATAFILE_LIST[config.dataset],
+                                                               logits_path=LOGITSFILE_DICT.get(config.dataset, None))
+        dataset = datasets[config.dataset]
+        num_classes = NUM_CLASSES_DICT[config.dataset]
+
+        if config.metric == 'accuracy':
+            categories, observations, confidences, labels, indices = dataset.astuple()
+            uniform_prior = np.ones((num_classes, 2)) / 2 * config.pseudocount
+            confidence = get_confidence_k(categories, confidences, num_classes)
+            shared[key] = {
+                'dataset': dataset,
+                'train': (categories, observations, confidences, labels, indices),
+                'num_classes': num_classes,
+                'priors': {'no_prior': uniform_prior * 1e-6,
+                           'uniform': uniform_prior,
+                           'informed': np.array([confidence, 1 - confidence]).T * config.pseudocount},
+                'ground_truth': get_ground_truth(categories, observations, confidences, num_classes, config.metric,
+                                                 config.mode, topk=config.topk),
+            }
+        else:
+            # all calibration configurations of a dataset are evaluated on the same holdout set
+            if config.dataset not in splits:
+                splits[config.dataset] = dataset.split(
+                    holdout_ratio=HOLDOUT_RATIO, random_state=np.random.RandomState(HOLDOUT_SEED))
+            train_set, holdout_set = splits[config.dataset]
+            categories, observations, confidences, labels, indices = train_set.astuple()
+            logits = dataset.logits if config.calibration_model in ['platt_scaling', 'temperature_scaling'] else None
+            ground_truth = get_bayesian_ground_truth(categories, observations, confidences, num_classes,
+                                                     config.metric, config.mode, topk=config.topk,
+                                                     pseudocount=config.pseudocount)
+            shared[key] = {
+                'dataset': dataset,
+                'train': (categories, observations, confidences, labels, indices),
+                'num_classes': num_classes,
+                'logits': logits,
+                'ground_truth': ground_truth,
+                'holdout': HoldoutFeatures.from_set(holdout_set, ground_truth=ground_truth, logits=logits),
+            }
+        contexts[config_idx] = shared[key]
+    return contexts
+
+
+def run_unit(task: Tuple[int, str, int]) -> Dict[str, np.ndarray]:
+    """
+    Sample and evaluate one run of one method of a configuration. Runs in a worker of the pool.
+    :param task: (position of the configuration, sampled method, run index)
+    :return: The curve of every metric and result method under 'curve:<metric>:<method>', the sampled 'indices' and
+        'observations' for the trajectory, and the pool size 'num_samples' and number of labeled samples 'budget'.
+    """
+    config_idx, method, run_idx = task
+    experiment, config = _CONFIGS[config_idx]
+    context = _CONTEXTS[config_idx]
+    if experiment == 'costs':
+        return _run_cost_unit(config, context, method, run_idx)
+
+    dtype = PRECISION_DICT[config.precision]
+    categories, observations, confidences, labels, indices = context['train']
+    num_classes = context['num_classes']
+    sample_method, sample_prior, eval_priors = METHODS[(experiment, config.metric)][method]
+    budget = get_budget(config.budget, len(observations))
+
+    if sample_method == 'random' and config.topk == 1:
+        # non-active sampling does not depend on the model
+        sampled = get_samples_schedule(categories, observations, confidences, labels, indices, 1,
+                                       sample_method='random', random_seed=run_idx, dtype=dtype, num_samples=budget)
+        sampled = [column[0] for column in sampled]
+    else:
+        sampled = get_samples_topk(config,
+                                   categories,
+                                   observations,
+                                   confidences,
+                                   labels,
+                                   indices,
+                                   num_classes,
+                                   budget,
+                                   sample_method=sample_method,
+                                   prior=None if sample_prior is None else context['priors'][sample_prior],
+                                   random_seed=run_idx,
+                                   sampler=config.beta_sampler,
+                                   sampler_threshold=config.beta_sampler_threshold,
+                                   batch_size=config.batch_size)
+    sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices = sampled
+
+    arrays = {'indices': sampled_indices, 'observations': sampled_observations, 'num_samples': len(observations),
+              'budget': budget}
+    if config.metric == 'accuracy':
+        priors = np.array([context['priors'][prior] for prior in eval_priors.values()])
+        avg_num_agreement, mrr = evaluate_priors(config, sampled_categories, sampled_observations,
+                                                 context['ground_truth'], num_classes, priors)
+        for p, key in enumerate(eval_priors):
+            arrays['curve:avg_num_agreement:%s' % key] = avg_num_agreement[p]
+            arrays['curve:mrr:%s' % key] = mrr[p]
+    else:
+        agreement, ece, mrr = evaluate(config,
+                                       sampled_categories,
+                                       sampled_observations,
+                                       sampled_scores,
+                                       sampled_labels,
+                                       sampled_indices,
+                                       context['ground_truth'],
+                                       num_classes,
+                                       logits=context['logits'],
+                                       holdout=context['holdout'])
+        arrays['curve:avg_num_agreement:%s' % method] = agreement
+        arrays['curve:holdout_ece_%s:%s' % (config.calibration_model, method)] = ece
+        arrays['curve:mrr:%s' % method] = mrr
+    return arrays
+
+
+def _run_cost_unit(config: argparse.Namespace, context: Dict[str, Any], method: str,
+                   run_idx: int) -> Dict[str, np.ndarray]:
+    """
+    One simulation of active_learning_costs.main. All methods of a run shuffle the dataset with the same seed.
+    """
+    dtype = PRECISION_DICT[config.precision]
+    choice_fn, prior = COST_METHODS[method]
+    np.random.seed([config.seed, run_idx])
+    # shuffling replaces the arrays of the dataset, a shallow copy keeps the shared dataset intact
+    dataset = copy.copy(context['dataset'])
+    model = DirichletMultinomialCost(context['priors'][prior], context['costs'], dtype=dtype)
+    schedule = get_checkpoint_schedule(config, active_learning_costs.LOG_FREQ, start=active_learning_costs.LOG_FREQ - 1)
+    if config.budget is not None:
+        schedule = EndOfRun(schedule)
+    budget = get_budget(config.budget, len(dataset))
+    mpe, confusion_log = active_learning_costs.select_and_label(dataset=dataset,
+                                                                model=model,
+                                                                topk=config.topk,
+                                                                choice_fn=choice_fn,
+                                                                dtype=dtype,
+                                                                batch_size=config.batch_size,
+                                                                schedule=schedule,
+                                                                budget=budget)
+    result = active_learning_costs.eval(mpe[np.newaxis], context['ground_truth'], config.topk)
+    arrays = {'curve:%s:%s' % (metric, method): value for metric, value in result.items()}
+    arrays['confusion_log'] = confusion_log
+    arrays['checkpoints'] = schedule.indices(budget)
+    arrays['num_samples'] = len(dataset)
+    arrays['budget'] = budget
+    return arrays
+
+
+def experiment_directory(experiment: str, config: argparse.Namespace) -> pathlib.Path:
+    """
+    Directory of the result store of a configuration. Cost experiments of a cost type share an output directory, so
+        each configuration gets its own store in a subdirectory.
+    """
+    if experiment == 'costs':
+        return config.output / ('top%d_pseudocount%s' % (config.topk, config.pseudocount))
+    return config.output / get_experiment_name(config)
+
+
+def finalize_config(experiment: str, config: argparse.Namespace, units: UnitStore, methods: List[str],
+                    num_runs: int) -> None:
+    """
+    Assemble the committed units of a finished configuration into its result store, trajectories and cost curves, and
+        remove the units. The outputs are rebuilt from scratch, so a crash while finalizing is repaired by a rerun.
+    """
+    directory = experiment_directory(experiment, config)
+    store = ResultStore(directory, num_runs, dtype=PRECISION_DICT[config.precision])
+
+    trajectories = {}
+    confusion_logs = {}
+    for method in methods:
+        for run_idx in range(num_runs):
+            arrays = units.load('%s_run%d' % (method, run_idx))
+            for key, curve in arrays.items():
+                if key.startswith('curve:'):
+                    _, metric, result_method = key.split(':')
+                    if not run_idx:
+                        # topk and baseline experiments share a store, only the curves of this one are replaced
+                        store.remove(metric, result_method)
+                    checkpoints = arrays.get('checkpoints')
+                    if checkpoints is None and 'indices' in arrays:
+                        checkpoints = metric_checkpoints(config, metric, len(arrays['indices']))
+                    store.write_run(metric, result_method, run_idx, curve, checkpoints=checkpoints)
+            if 'indices' in arrays:
+                if method not in trajectories:
+                    trajectories[method] = (np.empty((num_runs, len(arrays['indices'])), dtype=int),
+                                            np.empty((num_runs, len(arrays['indices'])), dtype=bool))
+                trajectories[method][0][run_idx] = arrays['indices']
+                trajectories[method][1][run_idx] = arrays['observations']
+            if 'confusion_log' in arrays and run_idx == num_runs - 1:
+                confusion_logs[method] = arrays['confusion_log']
+    store.finalize()
+    if 'budget' in arrays:
+        store.write_metadata(num_samples=int(arrays['num_samples']), budget=int(arrays['budget']))
+
+    for method, (sampled_indices, sampled_observations) in trajectories.items():
+        save_trajectory(directory, method, sampled_indices, sampled_observations)
+
+    if experiment == 'costs':
+        # mean curves and the confusion log of the last run, named as by active_learning_costs.main
+        suffix = 'top%d_pseudocount%s.npy' % (config.topk, config.pseudocount)
+        for metric, name in COST_METRIC_NAMES.items():
+            for method in methods:
+                np.save(config.output / ('%s_%s_%s' % (method, name, suffix)), store.summary(metric, method, 'mean'))
+        for method, confusion_log in confusion_logs.items():
+            np.save(config.output / ('%s_confusion_log_%s' % (method, suffix)), confusion_log)
+
+    units.clear()
+
+
+def get_num_runs(experiment: str) -> int:
+    return active_learning_costs.N_SIMULATIONS if experiment == 'costs' else RUNS
+
+
+def config_units(store: UnitStore, config_idx: int, methods: List[str],
+                 runs: range) -> List[Tuple[UnitStore, str, Tuple[int, str, int]]]:
+    """
+    The units of a range of runs of a configuration.
+    """
+    return [(store, '%s_run%d' % (method, run_idx), (config_idx, method, run_idx))
+            for run_idx in runs for method in methods]
+
+
+def plan_units(configs: List[Tuple[str, argparse.Namespace]],
+               methods: List[str] = None,
+               num_runs: int = None) -> List[Tuple[UnitStore, str, Tuple[int, str, int]]]:
+    """
+    The units of all configurations, scheduled one configuration after the other so that configurations finish early.
+        Units of an interrupted sweep are kept if their configuration is unchanged.
+    :param configs: List[Tuple[str, argparse.Namespace]]
+        Configurations of the sweep, see expand_grid.
+    :param methods: List[str]
+        Sampled methods to run. Default: None, i.e. all methods of each experiment.
+    :param num_runs: int
+        Number of runs planned per configuration, at most get_num_runs. Default: None, i.e. all runs.
+    :return: Store, name and task of every unit.
+    """
+    units = []
+    for config_idx, (experiment, config) in enumerate(configs):
+        max_runs = get_num_runs(experiment)
+        directory = experiment_directory(experiment, config)
+        directory.mkdir(parents=True, exist_ok=True)
+        # runs are seeded by their index, units of any number of runs are reused
+        fingerprint = {key: value for key, value in vars(config).items() if key not in ['output', 'processes']}
+        fingerprint.update({'experiment': experiment, 'num_runs': max_runs})
+        store = UnitStore(directory, experiment, fingerprint=fingerprint)
+        runs = range(max_runs if num_runs is None else min(num_runs, max_runs))
+        units.extend(config_units(store, config_idx, get_methods(experiment, config, methods), runs))
+    return units
+
+
+def setup(args: argparse.Namespace, num_runs: int = None) -> List[Tuple[UnitStore, str, Tuple[int, str, int]]]:
+    """
+    Expand the grid and build the contexts that run_unit reads. Must be called before workers are forked.
+    :return: The units of the sweep, see plan_units.
+    """
+    global _CONFIGS, _CONTEXTS
+    _CONFIGS = expand_grid(args)
+    _CONTEXTS = build_contexts(_CONFIGS)
+    return plan_units(_CONFIGS, args.methods, num_runs=num_runs)
+
+
+def curves_ci_width(store: UnitStore, methods: List[str], num_runs: int, level: float = CI_LEVEL) -> float:
+    """
+    Largest confidence interval width of the mean of any curve of a configuration, over all checkpoints.
+    :param store: UnitStore
+        Committed units of the configuration.
+    :param methods: List[str]
+    :param num_runs: int
+        Number of committed runs.
+    :param level: float
+        Confidence level. Default: CI_LEVEL.
+    :return: float
+    """
+    curves = {}
+    for method in methods:
+        for run_idx in range(num_runs):
+            for key, curve in store.load('%s_run%d' % (method, run_idx)).items():
+                if key.startswith('curve:'):
+                    curves.setdefault(key, []).append(curve)
+    return max(np.nanmax(ci_width(np.array(runs), level)) for runs in curves.values())
+
+
+def finalize(units: List[Tuple[UnitStore, str, Tuple[int, str, int]]], config_idx: int,
+             configs: List[Tuple[str, argparse.Namespace]], methods: List[str] = None, num_runs: int = None) -> None:
+    """
+    Call finalize_config for a configuration all of whose units are committed.
+    :param num_runs: int
+        Number of runs of the configuration. Default: None, i.e. get_num_runs.
+    """
+    experiment, config = configs[config_idx]
+    store = next(store for store, _, task in units if task[0] == config_idx)
+    num_runs = get_num_runs(experiment) if num_runs is None else num_runs
+    finalize_config(experiment, config, store, get_methods(experiment, config, methods), num_runs)
+    logger.info('%s :: %s :: finished after %d runs' % (experiment, experiment_directory(experiment, config), num_runs))
+
+
+def main(args: argparse.Namespace) -> None:
+    # with a target width, configurations start with a batch of runs and add batches until their curves are precise
+    units = setup(args, num_runs=None if args.ci_width is None else args.run_batch)
+    num_runs = {}
+    remaining = {}
+    for _, _, (config_idx, _, run_idx) in units:
+        num_runs[config_idx] = max(num_runs.get(config_idx, 0), run_idx + 1)
+        remaining[config_idx] = remaining.get(config_idx, 0) + 1
+    logger.info('%d configurations, %d units' % (len(_CONFIGS), len(units)))
+
+    def on_done(unit_idx: int) -> List[Tuple[UnitStore, str, Tuple[int, str, int]]]:
+        store, _, (config_idx, _, _) = units[unit_idx]
+        remaining[config_idx] -= 1
+        if remaining[config_idx]:
+            return []
+
+        experiment, config = _CONFIGS[config_idx]
+        methods = get_methods(experiment, config, args.methods)
+        max_runs = get_num_runs(experiment)
+        if args.ci_width is not None and num_runs[config_idx] < max_runs:
+            width = curves_ci_width(store, methods, num_runs[config_idx])
+            if width > args.ci_width:
+                runs = range(num_runs[config_idx], min(num_runs[config_idx] + args.run_batch, max_runs))
+                logger.info('%s :: %d runs :: CI width %.4f > %.4f, adding %d runs' % (
+                    experiment_directory(experiment, config), num_runs[config_idx], width, args.ci_width, len(runs)))
+                num_runs[config_idx] = runs.stop
+                remaining[config_idx] = len(runs) * len(methods)
+                return config_units(store, config_idx, methods, runs)
+        finalize(units, config_idx, _CONFIGS, args.methods, num_runs=num_runs[config_idx])
+        return []
+
+    # workers are forked after the contexts are built and inherit them
+    failed = run_units(run_unit, units, args.processes, max_attempts=args.max_attempts, on_done=on_done)
+    if failed:
+        raise RuntimeError("%d units failed, rerun the sweep to retry them: %s" % (
+            len(failed), ', '.join('%s/%s' % (units[i][0].directory, units[i][1]) for i in failed)))
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Arguments of a sweep, shared with the job queue.
+    """
+    parser.add_argument('-experiments', type=str, nargs='+', default=['topk'], choices=EXPERIMENTS,
+                        help='drivers whose experiments are run')
+    parser.add_argument('-datasets', type=str, nargs='+', default=['cifar100'], help='input datasets')
+    parser.add_argument('-metrics', type=str, nargs='+', default=['accuracy'], help='accuracy or calibration_error')
+    parser.add_argument('-modes', type=str, nargs='+', default=['min'],
+                        help='min or max, identify topk with highest/lowest reward')
+    parser.add_argument('-topk', type=int, nargs='+', default=[1], help='numbers of optimal arms to identify')
+    parser.add_argument('-pseudocounts', type=float, nargs='+', default=[PRIOR_STRENGTH], help='strengths of prior')
+    parser.add_argument('-methods', type=str, nargs='+', default=None,
+                        help='sampled methods to run. Default: all methods of each experiment')
+    parser.add_argument('-type_costs', type=str, nargs='+', default=['human'],
+                        help='human or superclass, cost types of the cost experiments')
+    parser.add_argument('-k', type=float, default=2, help='relative cost of the cost experiments')
+    parser.add_argument('-s', '--seed', type=int, default=1337, help='random seed of the cost experiments')
+    parser.add_argument('--output', type=pathlib.Path, default=None,
+                        help='output prefix. Default: the output directory of each driver')
+    parser.add_argument('--calibration_model', type=str, default=CALIBRATION_MODEL,
+                        help='calibration models to apply on holdout data')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--ci_width', type=float, default=None,
+                        help='add runs in batches until the confidence interval of the mean of every curve is '
+                             'narrower. Default: a fixed number of runs')
+    parser.add_argument('--run_batch', type=int, default=RUN_BATCH,
+                        help='number of runs added at a time with --ci_width')
+    parser.add_argument('--max_attempts', type=int, default=MAX_ATTEMPTS,
+                        help='number of times a failing unit is attempted before the sweep gives up on it')
+    parser.add_argument('--precision', type=str, default=PRECISION, choices=list(PRECISION_DICT),
+                        help='floating point precision of models, sample buffers and results')
+    parser.add_argument('--beta_sampler', type=str, default=BETA_SAMPLER, choices=BETA_SAMPLERS,
+                        help='exact or normal, sampler used to draw from Beta posteriors')
+    parser.add_argument('--beta_sampler_threshold', type=float, default=NORMAL_APPROXIMATION_THRESHOLD,
+                        help='minimum alpha + beta for the normal sampler to approximate a Beta posterior')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='number of samples labeled per round, selected against the same posterior')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='number of samples labeled per run, or a fraction of the dataset if at most 1. '
+                             'Default: all samples')
+    parser.add_argument('--debug', action='store_true', help='Enables debug statements')
+    add_checkpoint_arguments(parser)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+
+    args, _ = parser.parse_known_args()
+
+    if args.debug:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    logging.basicConfig(level=level)
+
+    for dataset in args.datasets:
+        if dataset not in DATASET_LIST:
+            raise ValueError("%s is not in DATASET_LIST." % dataset)
+
+    main(args)
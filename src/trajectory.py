@@ -0,0 +1,184 @@
+"""
+Compact storage of sampled trajectories. A trajectory of a method holds, for every run, the dataset indices of the
+samples in the order they were labeled. Indices are stored as uint32 and observations are bit-packed, the predicted
+classes, scores and labels are gathered from the dataset when they are accessed. Trajectories saved as five
+sampled_*.npy files by earlier versions are migrated on load.
+"""
+import argparse
+import logging
+import pathlib
+
+from data_utils import *
+
+TRAJECTORY_FILE = 'trajectory_%s.npz'
+LEGACY_COLUMNS = ['categories', 'observations', 'scores', 'labels', 'indices']
+LEGACY_FILE = 'sampled_%s_%s.npy'
+
+logger = logging.getLogger(__name__)
+
+
+class Trajectory:
+    """
+    Sampled trajectories of all runs of a method.
+    """
+
+    def __init__(self, indices: np.ndarray, dataset: PredictionSet, observations: np.ndarray = None):
+        """
+        :param indices: np.ndarray (num_runs, num_samples)
+            Indices of the sampled data points in the raw file, i.e. positions in dataset.
+        :param dataset: PredictionSet
+            The whole dataset loaded from the raw file, see PredictionSet.from_file.
+        :param observations: np.ndarray (num_runs, num_samples)
+            Observations revealed by the oracle. Default: None, i.e. the observations of the dataset.
+        """
+        self.indices = np.asarray(indices)
+        self.dataset = dataset
+        self._observations = observations
+
+    @property
+    def categories(self) -> np.ndarray:
+        return self.dataset.categories[self.indices]
+
+    @property
+    def observations(self) -> np.ndarray:
+        if self._observations is None:
+            return self.dataset.observations[self.indices]
+        return self._observations
+
+    @property
+    def scores(self) -> np.ndarray:
+        return self.dataset.confidences[self.indices]
+
+    @property
+    def labels(self) -> np.ndarray:
+        return self.dataset.labels[self.indices]
+
+    def astuple(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices
+            As returned by get_samples_topk, with an additional leading dimension of runs.
+        """
+        return self.categories, self.observations, self.scores, self.labels, self.indices
+
+
+def save_trajectory(directory: pathlib.Path,
+                    method: str,
+                    sampled_indices: np.ndarray,
+                    sampled_observations: np.ndarray = None) -> None:
+    """
+    :param directory: pathlib.Path
+        Experiment directory.
+    :param method: str
+    :param sampled_indices: np.ndarray (num_runs, num_samples)
+    :param sampled_observations: np.ndarray (num_runs, num_samples)
+        Stored bit-packed if given. Default: None.
+    """
+    sampled_indices = np.asarray(sampled_indices)
+    if sampled_indices.size and sampled_indices.max() > np.iinfo(np.uint32).max:
+        raise ValueError("%d is not a uint32 index." % sampled_indices.max())
+    arrays = {'indices': sampled_indices.astype(np.uint32)}
+    if sampled_observations is not None:
+        arrays['observations'] = np.packbits(np.asarray(sampled_observations, dtype=np.bool_), axis=-1)
+    np.savez(directory / (TRAJECTORY_FILE % method), **arrays)
+
+
+def load_trajectory(directory: pathlib.Path, method: str, dataset: PredictionSet) -> Trajectory:
+    """
+    Load the trajectory of a method, migrating legacy sampled_*.npy files if no trajectory file exists.
+    :param directory: pathlib.Path
+        Experiment directory.
+    :param method: str
+    :param dataset: PredictionSet
+        The whole dataset loaded from the raw file.
+    :return: Trajectory
+    """
+    if not (directory / (TRAJECTORY_FILE % method)).is_file():
+        return migrate_trajectory(directory, method, dataset)
+
+    with np.load(directory / (TRAJECTORY_FILE % method)) as data:
+        indices = data['indices'].astype(np.int64)
+        observations = None
+        if 'observations' in data:
+            observations = np.unpackbits(data['observations'], axis=-1, count=indices.shape[-1]).astype(np.bool_)
+    return Trajectory(indices, dataset, observations=observations)
+
+
+def _synthesize_indices(sampled_categories: np.ndarray,
+                        sampled_observations: np.ndarray,
+                        dataset: PredictionSet) -> np.ndarray:
+    """
+    Accuracy runs of earlier versions did not record the sampled indices. Any assignment of dataset samples with the
+        same predicted class and observation reproduces the categories and observations of a run, which are all that
+        accuracy experiments use.
+    :return: (num_runs, num_samples) array of indices.
+    """
+    keys = dataset.categories.astype(np.int64) * 2 + dataset.observations
+    order = np.argsort(keys, kind='stable')
+    indices = np.empty(sampled_categories.shape, dtype=np.int64)
+    for r in range(len(sampled_categories)):
+        sampled_keys = sampled_categories[r].astype(np.int64) * 2 + sampled_observations[r]
+        if not np.array_equal(np.bincount(sampled_keys, minlength=2 * (keys.max() + 1)),
+                              np.bincount(keys, minlength=2 * (keys.max() + 1))):
+            raise ValueError("Run %d is not a permutation of the dataset." % r)
+        indices[r, np.argsort(sampled_keys, kind='stable')] = order
+    return indices
+
+
+def migrate_trajectory(directory: pathlib.Path, method: str, dataset: PredictionSet,
+                       remove: bool = False) -> Trajectory:
+    """
+    Convert the legacy sampled_*.npy files of a method into a trajectory file. The trajectory is checked against the
+        legacy columns before it is saved.
+    :param directory: pathlib.Path
+        Experiment directory.
+    :param method: str
+    :param dataset: PredictionSet
+        The whole dataset loaded from the raw file.
+    :param remove: bool
+        Delete the legacy files after migration. Default: False.
+    :return: Trajectory
+    """
+    legacy = {column: np.load(directory / (LEGACY_FILE % (column, method))) for column in LEGACY_COLUMNS}
+    indices = legacy['indices']
+    if legacy['categories'].shape[-1] > 1 and not indices.any():
+        logger.info('%s :: %s :: indices were not recorded, assigning dataset samples by class and observation',
+                    directory, method)
+        indices = _synthesize_indices(legacy['categories'], legacy['observations'], dataset)
+
+    trajectory = Trajectory(indices, dataset, observations=legacy['observations'].astype(np.bool_))
+    if not np.array_equal(trajectory.categories, legacy['categories']):
+        raise ValueError("%s of %s does not match the dataset." % (LEGACY_FILE % ('categories', method), directory))
+    # scores and labels of accuracy runs were not recorded
+    if legacy['scores'].any() and not np.allclose(trajectory.scores, legacy['scores'], rtol=1e-6):
+        raise ValueError("%s of %s does not match the dataset." % (LEGACY_FILE % ('scores', method), directory))
+
+    save_trajectory(directory, method, trajectory.indices, trajectory.observations)
+    if remove:
+        for column in LEGACY_COLUMNS:
+            (directory / (LEGACY_FILE % (column, method))).unlink()
+    return trajectory
+
+
+def main(args: argparse.Namespace) -> None:
+    dataset = PredictionSet.from_file(DATAFILE_LIST[args.dataset])
+    for experiment in args.experiments:
+        for path in sorted(experiment.glob(LEGACY_FILE % ('indices', '*'))):
+            method = path.name[len('sampled_indices_'):-len('.npy')]
+            migrate_trajectory(experiment, method, dataset, remove=args.remove)
+            logger.info('%s :: %s :: migrated', experiment, method)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dataset', type=str, default='cifar100', help='input dataset')
+    parser.add_argument('experiments', type=pathlib.Path, nargs='+',
+                        help='experiment directories with sampled_*.npy files')
+    parser.add_argument('--remove', action='store_true', help='delete the sampled_*.npy files after migration')
+
+    args, _ = parser.parse_known_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.dataset not in DATASET_LIST:
+        raise ValueError("%s is not in DATASET_LIST." % args.dataset)
+
+    main(args)
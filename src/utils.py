@@ -4,13 +4,19 @@ import random
 from collections import deque
 from functools import reduce
 from multiprocessing import Array
+from typing import Union
 
 import matplotlib.pyplot as plt
 
 from calibration import CALIBRATION_MODELS
+from checkpoints import add_checkpoint_arguments, CHECKPOINT_ARGS, CheckpointSchedule, CHECKPOINT_SCHEDULES, \
+    get_checkpoint_schedule
 from data_utils import *
-from models import BetaBernoulli
-from sampling import SAMPLE_CATEGORY
+from models import BetaBernoulli, BETA_SAMPLERS, NORMAL_APPROXIMATION_THRESHOLD
+from sampling import ARM_WEIGHTS, ArmWeights, SAMPLE_CATEGORY, SAMPLE_SCHEDULE, select_batch
+from stopping import AnyOf, LabelBudget, PosteriorConfidence, StoppingRule, STOPPING_RULES, WallTime
+from result_store import load_runs, load_summary, ResultStore
+from trajectory import load_trajectory, save_trajectory, Trajectory
 
 COLUMN_WIDTH = 3.25  # Inches
 GOLDEN_RATIO = 1.61803398875
@@ -19,12 +25,40 @@ FONT_SIZE = 8
 RUNS = 100
 LOG_FREQ = 100
 CALIBRATION_FREQ = 100
+# curves are plotted over the first PLOT_FRACTION of the samples
+PLOT_FRACTION = 0.5
 PRIOR_STRENGTH = 3
 CALIBRATION_MODEL = 'classwise_histogram_binning'
 HOLDOUT_RATIO = 0.1
+# the same holdout set is used by every stage and every rerun of an experiment
+HOLDOUT_SEED = 0
+# arrays returned by get_samples_topk, in order
+SAMPLE_COLUMNS = ['categories', 'observations', 'scores', 'labels', 'indices']
+PRECISION = 'float64'
+BETA_SAMPLER = 'exact'
+PRECISION_DICT = {
+    'float32': np.float32,
+    'float64': np.float64,
+}
 
 
 #########################SAMPLE AND EVAL FOR ACTIVE TOPK##########################
+def get_experiment_name(args: argparse.Namespace) -> str:
+    """
+    Name of the experiment directory of the topk drivers.
+    :param args: argparse.Namespace
+        Arguments of active_learning_topk or active_learning_topk_baselines.
+    :return: str
+    """
+    experiment_name = '%s_%s_%s_top%d_runs%d_pseudocount%.2f' % (
+        args.dataset, args.metric, args.mode, args.topk, RUNS, args.pseudocount)
+    if args.batch_size > 1:
+        experiment_name += '_batch%d' % args.batch_size
+    if getattr(args, 'budget', None) is not None:
+        experiment_name += '_budget%g' % args.budget
+    return experiment_name
+
+
 def get_samples_topk(args: argparse.Namespace,
                      categories: List[int],
                      observations: List[bool],
@@ -36,37 +70,101 @@ def get_samples_topk(args: argparse.Namespace,
                      sample_method: str,
                      prior=None,
                      weight=None,
-                     random_seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+                     random_seed: int = 0,
+                     sampler: str = BETA_SAMPLER,
+                     sampler_threshold: float = NORMAL_APPROXIMATION_THRESHOLD,
+                     stopping_rule: StoppingRule = None,
+                     batch_size: int = 1) -> Tuple[np.ndarray, ...]:
+    """
+    Actively select and label samples until num_samples samples are labeled, or until stopping_rule fires.
+    :param num_samples: int
+        The number of samples to label, at most the number of samples in the pool, e.g. a labeling budget.
+    :param batch_size: int
+        The number of samples selected per round. With batch_size > 1 the whole batch is selected against the posterior
+            at the start of the round (see select_batch) and the model is updated with update_batch once all labels of
+            the round are in. Default: 1.
+    :param stopping_rule: StoppingRule
+        Checked after every labeled sample. If given, the sampled arrays are truncated to the labeled samples and the
+            stopping reason is returned as an additional last element: the name of the rule that fired, or
+            'exhausted' if all samples were labeled. Default: None.
+    :return: sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices[, reason]
+    """
     # prepare model, deques, thetas, choices
 
+    # common random numbers: all methods of a run shuffle the pool alike and start their posterior draws from the
+    # same numpy state, so differences between methods are not masked by independent noise. The fast path of
+    # get_samples_schedule draws a run from the same seed, but in its own order.
     random.seed(random_seed)
+    np.random.seed(random_seed)
+    dtype = PRECISION_DICT[args.precision]
 
     if args.metric == 'accuracy':
-        model = BetaBernoulli(num_classes, prior)
+        model = BetaBernoulli(num_classes, prior, dtype=dtype, sampler=sampler, sampler_threshold=sampler_threshold)
     elif args.metric == 'calibration_error':
-        model = ClasswiseEce(num_classes, num_bins=10, pseudocount=args.pseudocount, weight=weight, prior=None)
+        model = ClasswiseEce(num_classes, num_bins=10, pseudocount=args.pseudocount, weight=weight, prior=None,
+                             dtype=dtype, sampler=sampler, sampler_threshold=sampler_threshold)
 
     deques = [deque() for _ in range(num_classes)]
     for category, score, observation, label, index in zip(categories, confidences, observations, labels, indices):
-        if args.metric == 'accuracy':
-            deques[category].append(observation)
-        elif args.metric == 'calibration_error':
-            deques[category].append((observation, score, label, index))
+        deques[category].append((observation, score, label, index))
     for _deque in deques:
         random.shuffle(_deque)
 
     sampled_categories = np.zeros((num_samples,), dtype=np.int)
     sampled_observations = np.zeros((num_samples,), dtype=np.int)
-    sampled_scores = np.zeros((num_samples,), dtype=np.float)
+    sampled_scores = np.zeros((num_samples,), dtype=dtype)
     sampled_labels = np.zeros((num_samples,), dtype=np.int)
     sampled_indices = np.zeros((num_samples,), dtype=np.int)
 
     sample_fct = SAMPLE_CATEGORY[sample_method]
+    if sample_method in ARM_WEIGHTS and batch_size == 1:
+        arm_weights = ArmWeights(deques, proportional=ARM_WEIGHTS[sample_method])
+    else:
+        arm_weights = None
 
     topk = args.topk
     idx = 0
+    reason = 'exhausted'
+    if stopping_rule is not None:
+        stopping_rule.reset()
 
     while idx < num_samples:
+        if batch_size > 1:
+            # select a batch against the posterior frozen at the start of the round
+            categories_list = select_batch(sample_method,
+                                           deques=deques,
+                                           model=model,
+                                           mode=args.mode,
+                                           batch_size=min(batch_size, num_samples - idx),
+                                           topk=topk,
+                                           random_seed=random_seed,
+                                           max_ttts_trial=50,
+                                           ttts_beta=0.5,
+                                           epsilon=0.1,
+                                           ucb_c=1)
+            batch_start = idx
+
+            for category in categories_list:
+                observation, score, label, index = deques[category].pop()
+                sampled_scores[idx] = score
+                sampled_labels[idx] = label
+                sampled_indices[idx] = index
+                sampled_categories[idx] = category
+                sampled_observations[idx] = observation
+                idx += 1
+
+            # labels of the round arrive together
+            if args.metric == 'accuracy':
+                model.update_batch(sampled_categories[batch_start:idx], sampled_observations[batch_start:idx])
+            elif args.metric == 'calibration_error':
+                model.update_batch(sampled_categories[batch_start:idx], sampled_observations[batch_start:idx],
+                                   sampled_scores[batch_start:idx])
+
+            if stopping_rule is not None and stopping_rule.should_stop(model, idx, args.mode, args.topk):
+                reason = stopping_rule.reason
+                break
+            continue
+
         # sampling process:
         # if there are less than k available arms to play, switch to top 1.
         # If the sampling method has been switched to top1, then the return 'category_list' is an int
@@ -80,7 +178,8 @@ def get_samples_topk(args: argparse.Namespace,
                                      max_ttts_trial=50,
                                      ttts_beta=0.5,
                                      epsilon=0.1,
-                                     ucb_c=1)
+                                     ucb_c=1,
+                                     arm_weights=arm_weights)
 
         if type(categories_list) != list:
             categories_list = [categories_list]
@@ -89,161 +188,277 @@ def get_samples_topk(args: argparse.Namespace,
 
         # update model, deques, thetas, choices
         for category in categories_list:
+            observation, score, label, index = deques[category].pop()
             if args.metric == 'accuracy':
-                observation = deques[category].pop()
                 model.update(category, observation)
-
             elif args.metric == 'calibration_error':
-                observation, score, label, index = deques[category].pop()
                 model.update(category, observation, score)
-                sampled_scores[idx] = score
-                sampled_labels[idx] = label
-                sampled_indices[idx] = index
 
+            sampled_scores[idx] = score
+            sampled_labels[idx] = label
+            sampled_indices[idx] = index
             sampled_categories[idx] = category
             sampled_observations[idx] = observation
+            if arm_weights is not None:
+                arm_weights.update(category, len(deques[category]))
 
             idx += 1
 
-    return sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices
+            if stopping_rule is not None and stopping_rule.should_stop(model, idx, args.mode, args.topk):
+                reason = stopping_rule.reason
+                break
+            # the budget may end within a round of topk samples
+            if idx == num_samples:
+                break
+
+        if reason != 'exhausted':
+            break
+
+    if stopping_rule is None:
+        return sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices
+    return sampled_categories[:idx], sampled_observations[:idx], sampled_scores[:idx], sampled_labels[:idx], \
+           sampled_indices[:idx], reason
+
+
+def get_samples_schedule(categories: List[int],
+                         observations: List[bool],
+                         confidences: List[float],
+                         labels: List[int],
+                         indices: List[int],
+                         num_runs: int,
+                         sample_method: str,
+                         random_seed: int = 0,
+                         dtype=np.float64,
+                         num_samples: int = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fast path of get_samples_topk for sampling methods in SAMPLE_SCHEDULE with topk == 1. These methods do not depend
+        on the model, so the order of all runs is generated with array operations and no model is updated.
+    :param num_runs: int
+        The number of runs.
+    :param sample_method: str
+        A key of SAMPLE_SCHEDULE.
+    :param random_seed: int
+        Seed of the first run, run r is drawn with seed random_seed + r like the other methods of that run, so a run
+            is the same whether it is generated alone or together with other runs. Default: 0.
+    :param dtype: np.dtype
+        Floating point precision of sampled scores. Default: np.float64.
+    :param num_samples: int
+        The number of samples labeled in each run, e.g. a labeling budget. Default: None, i.e. all samples.
+    :return: sampled_categories, sampled_observations, sampled_scores, sampled_labels, sampled_indices
+        Each an (num_runs, num_samples) array, row r holds the same statistical process as run r of get_samples_topk.
+    """
+    categories = np.asarray(categories)
+    schedule = SAMPLE_SCHEDULE[sample_method]
+    order = np.concatenate([schedule(categories, 1, np.random.RandomState(random_seed + r))[:, :num_samples]
+                            for r in range(num_runs)])
+    return categories[order], np.asarray(observations, dtype=np.int)[order], \
+           np.asarray(confidences, dtype=dtype)[order], np.asarray(labels, dtype=np.int)[order], \
+           np.asarray(indices, dtype=np.int)[order]
+
+
+class HoldoutFeatures:
+    """
+    Holdout features used to recalibrate and evaluate the holdout set in evaluate. They only depend on the dataset
+        split, so they are computed once and shared by all runs and worker processes.
+    """
+
+    def __init__(self,
+                 holdout_categories: List[int],
+                 holdout_observations: List[bool],
+                 holdout_confidences: List[float],
+                 holdout_indices: List[int],
+                 ground_truth: np.ndarray = None,
+                 logits: np.ndarray = None,
+                 num_bins: int = 10):
+        """
+        :param holdout_categories: List[int]
+        :param holdout_observations: List[bool]
+        :param holdout_confidences: List[float]
+        :param holdout_indices: List[int]
+            Indices of the holdout samples in the dataset, used to look up their logits.
+        :param ground_truth: np.ndarray (num_classes, )
+            Binary indicator of the ground truth topk classes, splits the holdout set into two groups for
+            two_group_histogram_binning. Default: None.
+        :param logits: np.ndarray (num_samples, num_classes)
+            Logits of the whole dataset, for platt_scaling and temperature_scaling. Default: None.
+        :param num_bins: int
+            The number of equal-width confidence bins. Default: 10.
+        """
+        self.categories = np.array(holdout_categories, dtype=np.int)
+        self.observations = np.array(holdout_observations, dtype=np.bool_)
+        self.confidences = np.array(holdout_confidences, dtype=np.float64)
+        self.X = np.array([1 - self.confidences, self.confidences]).T
+        self.bin_idx = np.minimum(np.floor(self.confidences * num_bins).astype(int), num_bins - 1)
+
+        self.group_mask = None
+        if ground_truth is not None:
+            self.group_mask = np.asarray(ground_truth, dtype=np.bool_)[self.categories]
+
+        self.logits = None
+        if logits is not None:
+            self.logits = logits[np.array(holdout_indices, dtype=np.int)]
+
+        self.ece = eval_ece(self.confidences, self.observations, num_bins=num_bins)
+
+    @classmethod
+    def from_set(cls, holdout_set: PredictionSet, ground_truth: np.ndarray = None,
+                 logits: np.ndarray = None) -> 'HoldoutFeatures':
+        """
+        :param holdout_set: PredictionSet
+        :param ground_truth: np.ndarray (num_classes, ). Default: None.
+        :param logits: np.ndarray (num_samples, num_classes)
+            Logits of the whole dataset. Default: None.
+        :return: HoldoutFeatures
+        """
+        return cls(holdout_set.categories, holdout_set.observations, holdout_set.confidences, holdout_set.indices,
+                   ground_truth=ground_truth, logits=logits)
 
 
 def evaluate(args: argparse.Namespace,
-             categories: List[int],
-             observations: List[bool],
-             confidences: List[float],
-             labels: List[int],
-             indices: List[int],
+             categories: np.ndarray,
+             observations: np.ndarray,
+             confidences: np.ndarray,
+             labels: np.ndarray,
+             indices: np.ndarray,
              ground_truth: np.ndarray,
              num_classes: int,
-             holdout_categories: List[int] = None,  # will be used if train classwise calibration model
-             holdout_observations: List[bool] = None,
-             holdout_confidences: List[float] = None,
-             holdout_labels: List[int] = None,
-             holdout_indices: List[int] = None,
+             holdout_categories: np.ndarray = None,  # will be used if train classwise calibration model
+             holdout_observations: np.ndarray = None,
+             holdout_confidences: np.ndarray = None,
+             holdout_labels: np.ndarray = None,
+             holdout_indices: np.ndarray = None,
              prior=None,
              weight=None,
-             logits=None) -> Tuple[np.ndarray, ...]:
+             logits=None,
+             holdout: Union[HoldoutFeatures, PredictionSet] = None) -> Tuple[np.ndarray, ...]:
     """
     Evaluate topk ground truth agains predictions made by the model, which is trained on actively or
-        non-actively selected samples.
-    :return avg_num_agreement: (num_samples // LOG_FREQ, ) array.
-            Average number of agreement between selected topk and ground truth topk at each step.
-    :return holdout_calibrated_ece: (num_samples // CALIBRATION_FREQ , ) array.
-            ECE evaluated on recalibrated holdout set.
-    :return mrr: (num_samples // LOG_FREQ, ) array.
-            MRR of ground truth topk at each step.
+        non-actively selected samples. The model is updated with the samples between two checkpoints at once.
+    :param categories, observations, confidences, labels, indices: np.ndarray (num_samples, )
+        The sampled sequence, e.g. the columns of a PredictionSet or of a trajectory.
+    :param holdout: HoldoutFeatures or PredictionSet
+        Precomputed features of the holdout set, or the holdout set they are computed from. Built from the holdout
+            arrays if None. Default: None.
+    :return avg_num_agreement: (num_checkpoints, ) array.
+            Average number of agreement between selected topk and ground truth topk at each checkpoint of
+            get_checkpoint_schedule(args, LOG_FREQ).
+    :return holdout_calibrated_ece: (num_calibrations, ) array.
+            ECE evaluated on recalibrated holdout set at each checkpoint of
+            get_checkpoint_schedule(args, CALIBRATION_FREQ).
+    :return mrr: (num_checkpoints, ) array.
+            MRR of ground truth topk at each checkpoint.
     """
     num_samples = len(categories)
+    dtype = PRECISION_DICT[args.precision]
+    categories = np.asarray(categories, dtype=int)
+    observations = np.asarray(observations, dtype=np.bool_)
 
     if args.metric == 'accuracy':
-        model = BetaBernoulli(num_classes, prior)
+        model = BetaBernoulli(num_classes, prior, dtype=dtype)
     elif args.metric == 'calibration_error':
-        model = ClasswiseEce(num_classes, num_bins=10, pseudocount=args.pseudocount, weight=weight)
+        model = ClasswiseEce(num_classes, num_bins=10, pseudocount=args.pseudocount, weight=weight, dtype=dtype)
 
-    avg_num_agreement = np.zeros((num_samples // LOG_FREQ + 1,))
-    mrr = np.zeros((num_samples // LOG_FREQ + 1,))
+    log_slots = get_checkpoint_schedule(args, LOG_FREQ).slots(num_samples)
+    avg_num_agreement = np.zeros((len(log_slots),), dtype=dtype)
+    mrr = np.zeros((len(log_slots),), dtype=dtype)
+    calibration_slots = {}
 
     if args.metric == 'calibration_error':
 
-        holdout_calibrated_ece = np.zeros((num_samples // CALIBRATION_FREQ + 1,))
-
-        if args.calibration_model in ['histogram_binning', 'isotonic_regression', 'bayesian_binning_quantiles',
-                                      'classwise_histogram_binning', 'two_group_histogram_binning']:
-            holdout_X = np.array(holdout_confidences)
-            holdout_X = np.array([1 - holdout_X, holdout_X]).T
-
-        elif args.calibration_model in ['platt_scaling', 'temperature_scaling']:
-            holdout_indices_array = np.array(holdout_indices, dtype=np.int)
-            holdout_X = logits[holdout_indices_array]
-
-    topk_arms = np.zeros((num_classes,), dtype=np.bool_)
-
-    for idx, (category, observation, confidence, label, index) in enumerate(
-            zip(categories, observations, confidences, labels, indices)):
+        calibration_slots = get_checkpoint_schedule(args, CALIBRATION_FREQ).slots(num_samples)
+        num_calibrations = len(calibration_slots)
+        holdout_calibrated_ece = np.zeros((num_calibrations,), dtype=dtype)
+
+        if holdout is None:
+            holdout = HoldoutFeatures(holdout_categories, holdout_observations, holdout_confidences, holdout_indices,
+                                      ground_truth=ground_truth, logits=logits)
+        elif isinstance(holdout, PredictionSet):
+            holdout = HoldoutFeatures.from_set(holdout, ground_truth=ground_truth, logits=logits)
+        if args.calibration_model in ['platt_scaling', 'temperature_scaling']:
+            holdout_X = holdout.logits
+            holdout_pred_array = holdout.categories.reshape(-1, 1)
+        else:
+            holdout_X = holdout.X
+        # the ECE of all checkpoints is evaluated at once after sampling
+        if args.calibration_model == 'classwise_histogram_binning':
+            calibration_maps = np.zeros((num_calibrations, num_classes, 10))
+        else:
+            calibrated_holdout_confidences = np.zeros((num_calibrations, len(holdout.confidences)))
+
+        # features of the labeled samples, sliced at every recalibration
+        train_confidences = np.array(confidences, dtype=np.float64)
+        train_X = np.array([1 - train_confidences, train_confidences]).T
+        train_y = observations * 1
+        train_labels = np.asarray(labels, dtype=np.int)
+        train_indices = np.asarray(indices, dtype=np.int)
+        if args.calibration_model == 'two_group_histogram_binning':
+            train_mask = np.asarray(ground_truth, dtype=np.bool_)[categories]
+
+    # samples after the last checkpoint are never evaluated
+    start = 0
+    for idx in sorted(set(log_slots) | set(calibration_slots)):
 
         if args.metric == 'accuracy':
-            model.update(category, observation)
+            model.update_batch(categories[start:idx + 1], observations[start:idx + 1])
         elif args.metric == 'calibration_error':
-            model.update(category, observation, confidence)
+            model.update_batch(categories[start:idx + 1], observations[start:idx + 1], confidences[start:idx + 1])
+        start = idx + 1
 
-        if idx % LOG_FREQ == 0:
-            # select TOPK arms
-            topk_arms[:] = 0
+        if idx in log_slots:
             metric_val = model.eval
-            if args.mode == 'min':
-                topk_indices = metric_val.argsort()[:args.topk]
-            elif args.mode == 'max':
-                topk_indices = metric_val.argsort()[-args.topk:]
-            topk_arms[topk_indices] = 1
-            # evaluation
-            avg_num_agreement[idx // LOG_FREQ] = topk_arms[ground_truth == 1].mean()
-
-            # MRR
-            mrr[idx // LOG_FREQ] = mean_reciprocal_rank(metric_val, ground_truth, args.mode)
+            avg_num_agreement[log_slots[idx]] = topk_agreement(metric_val, ground_truth, args.mode, args.topk)
+            mrr[log_slots[idx]] = mean_reciprocal_rank(metric_val, ground_truth, args.mode)
 
         ########RECALIBRATION#############
-        if args.metric == 'calibration_error' and idx % CALIBRATION_FREQ == 0:
-            # before calibration
-            if idx == 0:
-                holdout_calibrated_ece[idx] = eval_ece(holdout_confidences, holdout_observations, num_bins=10)
-
-            else:
+        if args.metric == 'calibration_error' and idx in calibration_slots:
+            slot = calibration_slots[idx]
+            # a checkpoint at sample 0 is the uncalibrated holdout ECE
+            if idx > 0:
                 if args.calibration_model in ['histogram_binning', 'isotonic_regression', 'bayesian_binning_quantiles']:
                     calibration_model = CALIBRATION_MODELS[args.calibration_model]()
-                    X = np.array(confidences[:idx])
-                    X = np.array([1 - X, X]).T
-                    y = np.array(observations[:idx]) * 1
-                    calibration_model.fit(X, y)
-                    calibrated_holdout_confidences = calibration_model.predict_proba(holdout_X)[:, 1].tolist()
+                    calibration_model.fit(train_X[:idx], train_y[:idx])
+                    calibrated_holdout_confidences[slot] = calibration_model.predict_proba(
+                        holdout_X)[:, 1]
 
                 elif args.calibration_model in ['platt_scaling', 'temperature_scaling']:
                     calibration_model = CALIBRATION_MODELS[args.calibration_model]()
-                    X = logits[indices[:idx]]
-                    y = np.array(labels[:idx], dtype=np.int)
-                    calibration_model.fit(X, y)
-
-                    pred_array = np.array(holdout_categories).astype(int).reshape(-1, 1)
-                    calibrated_holdout_confidences = calibration_model.predict_proba(holdout_X)
-                    calibrated_holdout_confidences = np.take_along_axis(calibrated_holdout_confidences, pred_array,
-                                                                        axis=1).squeeze().tolist()
+                    calibration_model.fit(logits[train_indices[:idx]], train_labels[:idx])
+                    calibrated_holdout_confidences[slot] = np.take_along_axis(
+                        calibration_model.predict_proba(holdout_X), holdout_pred_array, axis=1).squeeze()
 
                 elif args.calibration_model in ['classwise_histogram_binning']:
                     # use the current MPE reliability diagram for calibration, no need to train a separate calibration model
-                    calibration_mapping = model.beta_params_mpe
-                    bin_idx = np.floor(np.array(holdout_confidences) * 10).astype(int)
-                    bin_idx[bin_idx == 10] = 9
-                    calibrated_holdout_confidences = calibration_mapping[holdout_categories, bin_idx].tolist()
+                    calibration_maps[slot] = model.beta_params_mpe
 
                 elif args.calibration_model in ['two_group_histogram_binning']:
 
-                    calibrated_holdout_confidences = np.zeros(len(holdout_confidences))
+                    calibrated = calibrated_holdout_confidences[slot]
 
                     calibration_model_less_calibrated = CALIBRATION_MODELS['histogram_binning']()
                     calibration_model_more_calibrated = CALIBRATION_MODELS['histogram_binning']()
-                    X = np.array(confidences[:idx])
-                    X = np.array([1 - X, X]).T
-                    y = np.array(observations[:idx]) * 1
-
-                    train_mask = np.array([ground_truth[val] for val in categories[:idx]])
-                    holdout_mask = np.array([ground_truth[val] for val in holdout_categories])
+                    X, y, mask = train_X[:idx], train_y[:idx], train_mask[:idx]
+                    holdout_mask = holdout.group_mask
 
-                    calibration_model_less_calibrated.fit(X[train_mask], y[train_mask])
-                    calibration_model_more_calibrated.fit(X[np.invert(train_mask)],
-                                                          y[np.invert(train_mask)])
+                    calibration_model_less_calibrated.fit(X[mask], y[mask])
+                    calibration_model_more_calibrated.fit(X[np.invert(mask)], y[np.invert(mask)])
 
-                    calibrated_holdout_confidences[holdout_mask] = calibration_model_less_calibrated.predict_proba(
+                    calibrated[holdout_mask] = calibration_model_less_calibrated.predict_proba(
                         holdout_X[holdout_mask])[:, 1]
-                    calibrated_holdout_confidences[
-                        np.invert(holdout_mask)] = calibration_model_more_calibrated.predict_proba(
+                    calibrated[np.invert(holdout_mask)] = calibration_model_more_calibrated.predict_proba(
                         holdout_X[np.invert(holdout_mask)])[:, 1]
 
-                    calibrated_holdout_confidences = calibrated_holdout_confidences.tolist()
                 else:
                     raise ValueError("%s is not an implemented calibration method." % args.calibration_model)
 
-                holdout_calibrated_ece[idx // CALIBRATION_FREQ] = eval_ece(calibrated_holdout_confidences,
-                                                                           holdout_observations, num_bins=10)
+    if args.metric == 'calibration_error':
+        if args.calibration_model == 'classwise_histogram_binning':
+            # (num_calibrations, num_holdout) calibrated confidences gathered from the stacked calibration maps
+            calibrated_holdout_confidences = calibration_maps[:, holdout.categories, holdout.bin_idx]
+        recalibrated = np.array(list(calibration_slots), dtype=int) > 0
+        holdout_calibrated_ece[~recalibrated] = holdout.ece
+        if recalibrated.any():
+            holdout_calibrated_ece[recalibrated] = batch_eval_ece(calibrated_holdout_confidences[recalibrated],
+                                                                  holdout.observations, num_bins=10)
 
     if args.metric == 'accuracy':
         return avg_num_agreement, mrr
@@ -251,9 +466,23 @@ def evaluate(args: argparse.Namespace,
         return avg_num_agreement, holdout_calibrated_ece, mrr
 
 
+def metric_checkpoints(args: argparse.Namespace, metric: str, num_samples: int) -> np.ndarray:
+    """
+    Sample indices of the checkpoints a metric returned by evaluate is evaluated at.
+    :param metric: str
+        'avg_num_agreement', 'mrr' or 'holdout_ece_<calibration_model>'.
+    :param num_samples: int
+        Length of the evaluated sample sequences.
+    :return: np.ndarray
+    """
+    if metric.startswith('holdout_ece'):
+        return get_checkpoint_schedule(args, CALIBRATION_FREQ).indices(num_samples)
+    return get_checkpoint_schedule(args, LOG_FREQ).indices(num_samples)
+
+
 #########################PLOT##########################
-def _comparison_plot(args: argparse.Namespace, eval_result_dict: Dict[str, np.ndarray], eval_freq: int, figname: str,
-                     ylabel: str) -> None:
+def _comparison_plot(args: argparse.Namespace, eval_result_dict: Dict[str, np.ndarray], schedule: CheckpointSchedule,
+                     figname: str, ylabel: str) -> None:
     # If labels are getting cut off make the figsize smaller
     plt.figure(figsize=(COLUMN_WIDTH, COLUMN_WIDTH / GOLDEN_RATIO), dpi=300)
 
@@ -261,12 +490,12 @@ def _comparison_plot(args: argparse.Namespace, eval_result_dict: Dict[str, np.nd
         total_samples = DATASIZE_DICT[args.dataset] * (1 - HOLDOUT_RATIO)
     elif args.metric == 'accuracy':
         total_samples = DATASIZE_DICT[args.dataset]
+    x = schedule.indices(int(total_samples)) / total_samples
 
     for method_name in eval_result_dict:
         metric_eval = eval_result_dict[method_name]
-        metric_eval = metric_eval[: int(len(metric_eval) / 2)]
-        x = np.arange(len(metric_eval)) * eval_freq / total_samples
-        plt.plot(x, metric_eval, label=method_name)
+        num_plotted = min(len(metric_eval), np.searchsorted(x, PLOT_FRACTION))
+        plt.plot(x[:num_plotted], metric_eval[:num_plotted], label=method_name)
     plt.xlabel('#Percentage')
     plt.ylabel(ylabel)
     plt.legend(fontsize=FONT_SIZE - 2)
@@ -286,11 +515,11 @@ def comparison_plot(args: argparse.Namespace,
     :param args: argparse.Namespace
     :param experiment_name: str
     :param avg_num_agreement_dict:
-        Dict maps str to np.ndarray of shape (RUNS, num_samples // LOG_FREQ + 1)
+        Dict maps str to np.ndarray of shape (RUNS, num_checkpoints)
     :param cumulative_metric_dict:
-        Dict maps str to np.ndarray of shape (RUNS, num_samples // LOG_FREQ + 1)
+        Dict maps str to np.ndarray of shape (RUNS, num_calibrations)
     :param non_cumulative_metric_dict:
-        Dict maps str to np.ndarray of shape (RUNS, num_samples // LOG_FREQ + 1)
+        Dict maps str to np.ndarray of shape (RUNS, num_checkpoints)
     :return:
     """
 
@@ -308,42 +537,131 @@ def comparison_plot(args: argparse.Namespace,
     else:
         tmp = ''
 
-    _comparison_plot(args, avg_num_agreement_dict, LOG_FREQ,
+    _comparison_plot(args, avg_num_agreement_dict, get_checkpoint_schedule(args, LOG_FREQ),
                      args.output / experiment_name / ("avg_num_agreement%s.pdf" % tmp),
                      'Avg number of agreement')
-    _comparison_plot(args, mrr_dict, LOG_FREQ,
+    _comparison_plot(args, mrr_dict, get_checkpoint_schedule(args, LOG_FREQ),
                      args.output / experiment_name / ("mrr%s.pdf" % tmp),
                      'Mean Reciprocal Rank %s' % args.metric)
     if holdout_ece_dict:
-        _comparison_plot(args, holdout_ece_dict, CALIBRATION_FREQ,
+        _comparison_plot(args, holdout_ece_dict, get_checkpoint_schedule(args, CALIBRATION_FREQ),
                          args.output / experiment_name / ("holdout_ece_%s%s.pdf" % (args.calibration_model, tmp)),
                          'ECE')
 
 
 #########################METRIC##########################
+def checkpoint_counts(categories: np.ndarray, observations: np.ndarray, num_classes: int,
+                      checkpoints: np.ndarray) -> np.ndarray:
+    """
+    Cumulative counts of correct and incorrect predictions per class at the checkpoints of evaluate.
+    :param categories: np.ndarray (num_samples, )
+        Predicted classes of the labeled samples, in labeling order.
+    :param observations: np.ndarray (num_samples, )
+        Whether each prediction is correct.
+    :param num_classes: int
+    :param checkpoints: np.ndarray (num_checkpoints, )
+        Sorted sample indices of the checkpoints, e.g. from CheckpointSchedule.indices.
+    :return: A (num_checkpoints, num_classes, 2) array. Entry [t, c] holds the numbers of correct and incorrect
+        predictions of class c among the first checkpoints[t] + 1 samples.
+    """
+    num_checkpoints = len(checkpoints)
+    # samples after the last checkpoint are never evaluated
+    num_counted = checkpoints[-1] + 1 if num_checkpoints else 0
+    categories = np.asarray(categories[:num_counted], dtype=int)
+    incorrect = np.invert(np.asarray(observations[:num_counted], dtype=np.bool_)).astype(int)
+    # sample i is first counted at the first checkpoint at or after i
+    checkpoint = np.searchsorted(checkpoints, np.arange(num_counted))
+    counts = np.bincount((checkpoint * num_classes + categories) * 2 + incorrect,
+                         minlength=num_checkpoints * num_classes * 2)
+    return np.cumsum(counts.reshape(num_checkpoints, num_classes, 2), axis=0)
+
+
+def evaluate_priors(args: argparse.Namespace,
+                    categories: np.ndarray,
+                    observations: np.ndarray,
+                    ground_truth: np.ndarray,
+                    num_classes: int,
+                    priors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluate one run of accuracy samples under several priors at once. Equivalent to calling evaluate once per prior,
+        since the posterior at a checkpoint is the prior plus the checkpoint counts.
+    :param categories: np.ndarray (num_samples, )
+        Predicted classes of the labeled samples, in labeling order.
+    :param observations: np.ndarray (num_samples, )
+    :param ground_truth: np.ndarray (num_classes, )
+        Binary indicator of the ground truth topk classes.
+    :param num_classes: int
+    :param priors: np.ndarray (num_priors, num_classes, 2)
+        Alpha and beta parameters of the priors.
+    :return avg_num_agreement: (num_priors, num_checkpoints) array.
+    :return mrr: (num_priors, num_checkpoints) array.
+    """
+    dtype = PRECISION_DICT[args.precision]
+    checkpoints = get_checkpoint_schedule(args, LOG_FREQ).indices(len(categories))
+    counts = checkpoint_counts(categories, observations, num_classes, checkpoints)
+    params = np.asarray(priors, dtype=dtype)[:, np.newaxis] + counts[np.newaxis]  # (num_priors, T, k, 2)
+    metric_val = params[..., 0] / (params[..., 0] + params[..., 1])
+
+    avg_num_agreement = topk_agreement(metric_val, ground_truth, args.mode, args.topk).astype(dtype)
+    mrr = batch_mean_reciprocal_rank(metric_val, ground_truth, args.mode).astype(dtype)
+    return avg_num_agreement, mrr
+
+
+def topk_agreement(metric_val: np.ndarray,
+                   ground_truth: np.ndarray,
+                   mode: str,
+                   topk: int) -> np.ndarray:
+    """
+    Fraction of ground truth topk classes among the topk classes of each metric vector.
+    :param metric_val: np.ndarray (..., num_classes)
+        E.g. (num_runs, num_checkpoints, num_classes) estimates of all runs and checkpoints of an experiment.
+    :param ground_truth: np.ndarray (num_classes, )
+        Binary indicator of the ground truth topk classes.
+    :param mode: str
+        'min' or 'max'
+    :param topk: int
+    :return: An array of shape metric_val.shape[:-1].
+    """
+    ground_truth = np.asarray(ground_truth, dtype=np.bool_)
+    ranked = np.asarray(metric_val).argsort(axis=-1)
+    if mode == 'min':
+        selected = ranked[..., :topk]
+    elif mode == 'max':
+        selected = ranked[..., -topk:]
+    return ground_truth[selected].sum(axis=-1) / ground_truth.sum()
+
+
+def batch_mean_reciprocal_rank(metric_val: np.ndarray,
+                               ground_truth: np.ndarray,
+                               mode: str) -> np.ndarray:
+    """
+    Mean reciprocal rank of the ground truth topk classes for every metric vector along the last axis. Each ground
+        truth class is ranked among the classes that are not in the ground truth, i.e. a perfect ranking scores 1.
+    :param metric_val: np.ndarray (..., num_classes)
+        E.g. (num_runs, num_checkpoints, num_classes) estimates of all runs and checkpoints of an experiment.
+    :param ground_truth: np.ndarray (num_classes, )
+        Binary indicator of the ground truth topk classes.
+    :param mode: str
+        'min' or 'max'
+    :return: An array of shape metric_val.shape[:-1].
+    """
+    metric_val = np.asarray(metric_val)
+    num_classes = metric_val.shape[-1]
+    rank = metric_val.argsort(axis=-1).argsort(axis=-1) + 1
+    if mode == 'max':
+        rank = num_classes - rank + 1
+
+    # other ground truth classes ranked higher are not counted
+    raw_rank = rank[..., np.asarray(ground_truth, dtype=np.bool_)]
+    adjusted_rank = raw_rank - raw_rank.argsort(axis=-1).argsort(axis=-1)
+    return (1 / adjusted_rank).mean(axis=-1)
+
+
 def mean_reciprocal_rank(metric_val: np.ndarray,
                          ground_truth: np.ndarray,
                          mode: str) -> float:
     """Computes mean reciprocal rank"""
-    num_classes = metric_val.shape[0]
-    k = np.sum(ground_truth)
-
-    # Compute rank of each class
-    argsort = metric_val.argsort()
-    rank = np.empty_like(argsort)
-    rank[argsort] = np.arange(num_classes) + 1
-    if mode == 'max':  # Need to flip so that largest class has rank 1
-        rank = num_classes - rank + 1
-
-    # In top-k setting, we need to adjust so that other ground truth classes
-    # are not considered in the ranking.
-    raw_rank = rank[ground_truth]
-    argsort = raw_rank.argsort()
-    offset = np.empty_like(argsort)
-    offset[argsort] = np.arange(k)
-    adjusted_rank = raw_rank - offset
-
-    return (1 / adjusted_rank).mean()
+    return float(batch_mean_reciprocal_rank(metric_val, ground_truth, mode))
 
 
 #########################MULTIPROCESSING##########################
@@ -352,7 +670,9 @@ class MpSafeSharedArray:
     DTYPE_TO_CTYPE = {
         np.int: ctypes.c_long,
         np.bool: ctypes.c_bool,
-        np.float: ctypes.c_double
+        np.float: ctypes.c_double,
+        np.float32: ctypes.c_float,
+        np.float64: ctypes.c_double,
     }
 
     def __init__(self, shape, dtype=np.float):